@@ -1,11 +1,33 @@
+import importlib
 import os
 
+import click
 from flask import Flask
 
 # Extension defined in separate file for use with application factory function
 #from .cache import cache
 
 
+class LazyGroup(click.Group):
+    """
+    A command group standing in for one defined elsewhere, which is only imported once the group is used
+    'target' is 'module:attribute', e.g. 'beauty_flask.bench:bench_cli'
+    """
+    def __init__(self, name, target, **attrs):
+        super().__init__(name, **attrs)
+        self.target = target
+
+    def _group(self):
+        module, attribute = self.target.split(':')
+        return getattr(importlib.import_module(module), attribute)
+
+    def list_commands(self, ctx):
+        return self._group().list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self._group().get_command(ctx, name)
+
+
 def create_app(test_config=None):
     """
     Application factory function
@@ -14,7 +36,52 @@ def create_app(test_config=None):
     app = Flask(__name__, instance_relative_config=True)
     app.config.from_mapping(
         SECRET_KEY='dev',
-        DATABASE=os.path.join(app.instance_path, 'beauty_flask.sqlite')
+        DATABASE=os.path.join(app.instance_path, 'beauty_flask.sqlite'),
+        DATABASE_POOL=True, # keep one tuned connection open per thread instead of one per request
+        DATABASE_MIGRATE=True, # at startup, create missing tables and upgrade older ones in place, keeping all data
+        SLOT_MINUTES=15, # minutes per block of the booking grid; availability and openings are on this grid
+        SLOT_DAY_START='0800', # first block of the day, 'hhmm'
+        SLOT_DAY_END='2100', # end of the last block of the day, 'hhmm'
+        SESSION_DURATIONS=(30, 60, 90, 120), # session lengths in minutes clients can book
+        SESSION_DEFAULT_DURATION=60, # session length shown until a client picks one
+        OPENINGS_PREFETCH_WEEKS=4, # weeks of openings computed together on a cache miss
+        OPENINGS_MAX_WEEKS=12, # most weeks one /openings request may ask for
+        CALENDAR_MIRROR=True, # compute openings from the local event mirror in the database
+        CALENDAR_MIRROR_REFRESH=60, # seconds between incremental syncs of the mirror
+        CALENDAR_BUSY_SOURCE='freebusy', # busy time without the mirror: 'freebusy', or 'list' for a fields-masked events listing
+        CALENDAR_FETCH_WORKERS=8, # threads per process fetching the calendars of several artists at once
+        OPENINGS_CACHE_TIMEOUT=None, # seconds to cache openings; None uses CACHE_DEFAULT_TIMEOUT
+        OPENINGS_STALE_TIMEOUT=86400, # seconds a week's last known good openings are kept to serve while recomputing
+        OPENINGS_COALESCE_TIMEOUT=30, # most seconds a cache miss waits for the same computation in another request
+        OPENINGS_COALESCE_POLL=0.05, # seconds between checks of the cache while another worker computes
+        OPENINGS_REFRESH=True, # keep upcoming weeks precomputed from a thread in each process; else run `flask refresh-openings --loop`
+        OPENINGS_REFRESH_WEEKS=4, # weeks from this one kept precomputed
+        OPENINGS_REFRESH_MARGIN=120, # seconds before cached openings expire that they are recomputed
+        OPENINGS_REFRESH_TIMEZONES=(), # timezones kept warm even before any visitor has used them
+        CALENDAR_WEBHOOK_URL=None, # public https URL of webhook.calendarNotify, to enable push notifications
+        CALENDAR_WATCH_TTL=604800, # seconds a watch channel is requested to live
+        CALENDAR_WATCH_RENEW_BEFORE=86400, # renew a watch channel this many seconds before it expires
+        CALENDAR_POOL_SIZE=8, # idle calendar clients (keep-alive connections) kept per process
+        CALENDAR_HTTP_TIMEOUT=10, # seconds before a calendar request gives up
+        CALENDAR_TOKEN_REFRESH_MARGIN=300, # refresh the access token this many seconds before it expires
+        CALENDAR_BREAKER_THRESHOLD=5, # failed calls to Google in a row before calls fail fast
+        CALENDAR_BREAKER_BACKOFF=5, # seconds before the first probe call, doubling after each failed probe
+        CALENDAR_BREAKER_MAX_BACKOFF=300, # most seconds between probe calls
+        LEDGER_RECONCILE_AFTER=3600, # seconds before a looked-up appointment is checked against the calendar
+        RESERVATION_HOLD_TTL=600, # seconds a selected slot is held for a client while they confirm it
+        IMAGE_WIDTHS=(480, 960, 1600), # pixel widths of the resized copies made by `flask build-images`
+        IMAGE_QUALITY=80, # WebP/JPEG quality of the resized copies
+        STATIC_FINGERPRINT=True, # point url_for('static', ...) at the copies made by `flask build-assets`
+        STATIC_IMMUTABLE_MAX_AGE=31536000, # seconds browsers may cache a fingerprinted file
+        LANGUAGES=('en',), # locales pages are rendered (and cached) for, the first being the default
+        PAGE_CACHE=True, # serve the pages that are the same for every visitor from the cache
+        PAGE_CACHE_TIMEOUT=None, # seconds to cache a rendered page; None uses CACHE_DEFAULT_TIMEOUT
+        PAGE_CACHE_VERSION=None, # change (e.g. to the release) to drop every cached page on deploy
+        SESSION_BACKEND='sqlite', # keep session data in 'sqlite' or 'cache'; None for Flask's signed cookie
+        SESSION_IDLE_TIMEOUT=86400, # seconds an unused (non-permanent) session is kept
+        SESSION_TOUCH_INTERVAL=300, # least seconds between pushing back an unchanged session's expiry
+        SESSION_PURGE_INTERVAL=3600, # seconds between deleting expired sessions from the database
+        METRICS_SERVER_TIMING=None # add a Server-Timing header to responses; None means only in debug
     )
 
     if test_config is None:
@@ -33,10 +100,26 @@ def create_app(test_config=None):
 #    # import logging functionality
 #    import logging
 #
+    # import hot path timing functionality
+    from . import metrics
+    metrics.init_app(app)
+
     # import db functionality
     from . import db
     db.init_app(app)
 
+    # import server-side session functionality
+    from . import sessions
+    sessions.init_app(app)
+
+    # import calendar client functionality
+    from . import gcal
+    gcal.init_app(app)
+
+    # import artist registry functionality
+    from . import artists
+    artists.init_app(app)
+
     # import admin functionality
     from . import admin
     app.register_blueprint(admin.bp)
@@ -49,19 +132,57 @@ def create_app(test_config=None):
     # (i.e. url_for('index') and url_for('site.index') will now both work)
     app.add_url_rule('/', endpoint='index')
 
+    # import calendar push notification functionality
+    from . import webhook
+    app.register_blueprint(webhook.bp)
+    app.cli.add_command(webhook.renew_watch_command)
+
+    # import email outbox functionality
+    from . import outbox
+    outbox.init_app(app)
+
+    # import openings refresh-ahead functionality
+    from . import refresher
+    refresher.init_app(app)
+
+    # import fingerprinted static asset functionality
+    from . import assets
+    assets.init_app(app)
+
+    # import responsive image functionality
+    from . import images
+    app.cli.add_command(images.build_images_command)
+    app.add_template_global(images.responsive_image)
+
+    # benchmark commands, only imported when `flask bench` is run (they bring the stand-in calendar along)
+    app.cli.add_command(LazyGroup('bench', __name__ + '.bench:bench_cli', help='Benchmark the booking hot paths.'))
+
     # Extensions
     ## Caching and Mail
     from .extensions import cache, mail
-    ## Configure extensions for this app
-    app.config.from_mapping(
+    ## Configure extensions for this app, unless the instance or test config already has
+    ## CACHE_TYPE may be 'SimpleCache' (per process), or 'FileSystemCache' or 'RedisCache' (with
+    ## CACHE_REDIS_URL) to share cached openings across all worker processes; while a shared cache
+    ## can't be reached, everything is computed as if nothing were cached
+    for key, value in dict(
         CACHE_TYPE='SimpleCache',
         CACHE_DEFAULT_TIMEOUT=900,
+        CACHE_KEY_PREFIX='beauty_flask_',
         MAIL_SERVER='smtp.madhundle.com',
         MAIL_PORT=587,
         MAIL_USERNAME='no-reply@madhundle.com',
         MAIL_PASSWORD='no-replyMH',
-        MAIL_DEFAULT_SENDER='no-reply@madhundle.com')
-        
+        MAIL_DEFAULT_SENDER='no-reply@madhundle.com',
+        MAIL_OUTBOX_WORKER=True, # deliver queued emails from a thread in each process; else run `flask send-mail`
+        MAIL_OUTBOX_BATCH=20, # emails sent per SMTP connection
+        MAIL_OUTBOX_POLL=60, # seconds between checks for emails due a retry
+        MAIL_OUTBOX_BACKOFF=30, # seconds before the first retry, doubling after each failure
+        MAIL_OUTBOX_MAX_ATTEMPTS=6,
+        MAIL_OUTBOX_CLAIM_TIMEOUT=300).items(): # seconds before a claimed but unsent email is retried
+        app.config.setdefault(key, value)
+    if app.config['CACHE_TYPE'] in ('FileSystemCache', 'flask_caching.backends.FileSystemCache'):
+        app.config.setdefault('CACHE_DIR', os.path.join(app.instance_path, 'cache'))
+
     ## Initialize
     cache.init_app(app)
     mail.init_app(app)
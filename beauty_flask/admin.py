@@ -1,14 +1,19 @@
 import functools
 
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, session, url_for
+    Blueprint, current_app, flash, g, redirect, render_template, request, session, url_for
 )
+from werkzeug.local import LocalProxy
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from beauty_flask.db import get_db
+from beauty_flask import availability
+from beauty_flask import pagecache
+from beauty_flask import metrics
+from beauty_flask import slotgrid
+from beauty_flask.openings import DAYS
 
 import datetime
-import os.path
 from googleapiclient.discovery import build
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
@@ -49,19 +54,28 @@ def login():
     return render_template('admin/login.html')
 
 
-@bp.before_app_request # Registers a function that runs before the view function
+def get_user():
+    """
+    Load the logged in admin's information the first time it's asked for in a request, or None
+    """
+    if '_user' not in g:
+        user_id = session.get('user_id')
+        if user_id is None:
+            g._user = None
+        else:
+            g._user = get_db().execute(
+                'SELECT * FROM admin WHERE id = ?', (user_id,)
+            ).fetchone()
+    return g._user
+
+
+@bp.before_request # Registers a function that runs before this blueprint's view functions only
 def load_logged_in_user():
     """
-    If a user is logged in, load their information and store in g.user so it's available to all views 
+    Make g.user available to the admin views and templates without querying for it yet
+    Public site requests never run this, so they do no database work for it
     """
-    user_id = session.get('user_id')
-
-    if user_id is None:
-        g.user = None
-    else:
-        g.user = get_db().execute(
-            'SELECT * FROM admin WHERE id = ?', (user_id,)
-        ).fetchone()
+    g.user = LocalProxy(get_user)
 
 def login_required(view):
     """
@@ -69,7 +83,7 @@ def login_required(view):
     """
     @functools.wraps(view)
     def wrapped_view(**kwargs):
-        if g.user is None:
+        if get_user() is None:
             return redirect(url_for('admin.login'))
 
         return view(**kwargs)
@@ -84,7 +98,7 @@ def logout():
     """
     session.clear()
     #session.modified = True # make Flask send the updated session cookie to the client
-    return render_template('admin/logout.html')
+    return pagecache.render('admin/logout.html') # rendered with the session already cleared
 
 
 @bp.route('/dash', methods=('GET', 'POST'))
@@ -94,14 +108,11 @@ def dash():
     Create a 'dash' view for the 'admin' blueprint
     Associate the '/dash' URL with this 'login' view function
     """
-    # immutable tuples to maintain sorting
-    days = ('Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat')
-    timeblocks = ('0800', '0830', '0900', '0930', '1000', '1030', '1100', '1130', '1200', '1230', '1300', '1330', '1400', '1430', '1500', '1530', '1600', '1630', '1700', '1730', '1800', '1830', '1900', '1930', '2000')
+    # immutable tuples to maintain sorting; the timeblocks are the configured slot grid's
+    days = DAYS
+    timeblocks = slotgrid.currentGrid().labels
     
-    avail = {d:{t:False for t in timeblocks} for d in days} # initialize empty schedule
-    if os.path.exists('instance/availability.json'): # load saved schedule
-        with open('instance/availability.json', 'r') as f:
-            avail = json.load(f)
+    avail = availability.getAvailability() # saved schedule, or an empty one
  
     if request.method == "POST" and request.form['Edit']=='Edit':
 #        flash(request)
@@ -118,10 +129,15 @@ def dash():
             day, time = item[0].split('_')
             avail[day][time] = json.loads(item[1].lower()) # item[1] is str 'True'|'False'; convert to bool
 #        flash(avail)
-        with open('instance/availability.json', 'w') as f:
-            json.dump(avail, f)
+        availability.saveAvailability(avail)
 
     return render_template('admin/dash.html', edit=False, days=days, timeblocks=timeblocks, avail=avail)
 
 
-
+@bp.route('/metrics')
+@login_required
+def metrics_view():
+    """
+    This worker's timings and cache counters in the Prometheus text format
+    """
+    return current_app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
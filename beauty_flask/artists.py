@@ -0,0 +1,172 @@
+#--------------------------------------------------------------------------------------------------#
+#                                         Artist Registry                                          #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Keep the artists clients can book in the database: each has their own Google Calendar, and optionally
+their own weekly schedule (else the shared one from availability) kept in their own timezone
+With no artists registered the site books the one DEFAULT_CALENDAR_ID calendar, as it always has
+Manage the registry with `flask artist add|list|remove`
+"""
+
+import json
+import sqlite3
+from collections import namedtuple
+from functools import lru_cache
+
+import click
+from flask.cli import AppGroup
+
+from .db import get_db
+from . import availability
+from . import slotgrid
+from . import weekcache
+
+DEFAULT_CALENDAR_ID = 'onspl2i87fputjkjg8h0uhhmno@group.calendar.google.com'
+
+# id is None for the implicit artist of an empty registry; schedule is the availability JSON text, or None
+# for the shared schedule; tzName is None to keep the schedule in the calendar's own timezone
+Artist = namedtuple('Artist', ['id', 'name', 'calendarId', 'tzName', 'schedule'])
+
+DEFAULT_ARTIST = Artist(None, None, DEFAULT_CALENDAR_ID, None, None)
+
+artist_cli = AppGroup('artist', help='Manage the artists clients can book.')
+
+
+def _fromRow(row):
+    return Artist(row['id'], row['name'], row['calendar_id'], row['tz_name'], row['availability'])
+
+
+def _query(sql, args=()):
+    """
+    The artist rows the query finds; none while the database has no artist table yet (it is created by
+    migrating), as then no artists can have been registered
+    """
+    try:
+        return get_db().execute(sql, args).fetchall()
+    except sqlite3.OperationalError as e:
+        if 'no such table' not in str(e):
+            raise
+        return []
+
+
+def getArtists():
+    """
+    Every active artist in the order they were added, or just DEFAULT_ARTIST if none are registered
+    """
+    rows = _query('SELECT id, name, calendar_id, tz_name, availability FROM artist WHERE active = 1 ORDER BY id')
+    return [_fromRow(row) for row in rows] or [DEFAULT_ARTIST]
+
+
+def getArtist(artistID):
+    """
+    The active artist with this ID, or None (None also finds DEFAULT_ARTIST when no artists are registered)
+    """
+    return next((a for a in getArtists() if a.id == artistID), None)
+
+
+def forCalendar(calendarId):
+    """
+    The artist booked on this calendar, even if since removed, so their appointments still resolve
+    The default calendar gives DEFAULT_ARTIST unless it has been registered; any other gives None
+    """
+    rows = _query('SELECT id, name, calendar_id, tz_name, availability FROM artist WHERE calendar_id = ?',
+                  (calendarId,))
+    if rows:
+        return _fromRow(rows[0])
+    return DEFAULT_ARTIST if calendarId == DEFAULT_CALENDAR_ID else None
+
+
+@lru_cache(maxsize=64)
+def _compile(schedule, grid):
+    return availability.compileSchedule(json.loads(schedule), grid)[1]
+
+
+def getMasks(artist):
+    """
+    The artist's schedule as 7 day bitmasks on the current grid, in the artist's own wall clock
+    """
+    if artist.schedule is None:
+        return availability.getMasks()
+    return _compile(artist.schedule, slotgrid.currentGrid())
+
+
+def addArtist(name, calendarId, tzName=None, schedule=None):
+    """
+    Register an artist, or bring back (and update) one removed earlier with the same calendar
+    schedule is the availability JSON text, or None for the shared schedule
+    Returns the artist's ID
+    """
+    db = get_db()
+    with db:
+        db.execute(
+            'INSERT INTO artist (name, calendar_id, tz_name, availability) VALUES (?, ?, ?, ?)'
+            ' ON CONFLICT (calendar_id) DO UPDATE SET name = excluded.name, tz_name = excluded.tz_name,'
+            ' availability = excluded.availability, active = 1',
+            (name, calendarId, tzName, schedule)
+        )
+    weekcache.invalidate() # cached openings are for the old roster
+    return db.execute('SELECT id FROM artist WHERE calendar_id = ?', (calendarId,)).fetchone()['id']
+
+
+def removeArtist(artistID):
+    """
+    Stop offering an artist's openings; their row is kept so existing appointments still resolve
+    Returns True if an active artist was removed
+    """
+    db = get_db()
+    with db:
+        removed = db.execute('UPDATE artist SET active = 0 WHERE id = ? AND active = 1', (artistID,)).rowcount
+    if removed:
+        weekcache.invalidate()
+    return removed == 1
+
+
+# define command line commands 'artist add', 'artist list' and 'artist remove'
+@artist_cli.command('add')
+@click.argument('name')
+@click.argument('calendar_id')
+@click.option('--tz', 'tzName', help='IANA timezone the schedule is kept in, if not the calendar\'s.')
+@click.option('--availability', 'availabilityFile', type=click.File('r'),
+              help='JSON schedule file, as saved in the instance folder; default the shared schedule.')
+def add_artist_command(name, calendar_id, tzName, availabilityFile):
+    """
+    Register an artist and the Google Calendar they are booked on
+    """
+    schedule = None
+    if availabilityFile is not None:
+        schedule = json.dumps(json.load(availabilityFile)) # fail here on a malformed file
+    artistID = addArtist(name, calendar_id, tzName, schedule)
+    click.echo('Registered {} as artist {}.'.format(name, artistID))
+    return
+
+
+@artist_cli.command('list')
+def list_artists_command():
+    """
+    Show the artists clients can book
+    """
+    for artist in getArtists():
+        click.echo('{}\t{}\t{}\t{}\t{}'.format(artist.id, artist.name, artist.calendarId, artist.tzName or '-',
+                                              'own schedule' if artist.schedule else 'shared schedule'))
+    return
+
+
+@artist_cli.command('remove')
+@click.argument('artist_id', type=int)
+def remove_artist_command(artist_id):
+    """
+    Stop offering an artist's openings
+    """
+    if not removeArtist(artist_id):
+        raise click.ClickException('No active artist {}.'.format(artist_id))
+    click.echo('Removed artist {}.'.format(artist_id))
+    return
+
+
+def init_app(app):
+    """
+    Register these functions with the application instance so they get used
+    """
+    app.cli.add_command(artist_cli)
+    return
@@ -0,0 +1,210 @@
+#--------------------------------------------------------------------------------------------------#
+#                                          Static Assets                                           #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Serve static files under content-hashed names that browsers may cache for a year without revalidating
+`flask build-assets` copies each file in static/ to static/dist with a hash of its contents in the name,
+and writes gzip (and, with the brotli package, Brotli) variants of text files ahead of time, plus a
+manifest. url_for('static', ...) then points at the hashed name, and the static view sends the best
+precompressed variant the client accepts, so nothing is compressed per request
+"""
+
+import gzip
+import json
+import mimetypes
+import os
+import shutil
+
+import click
+from flask import current_app, request, send_from_directory
+from flask.cli import with_appcontext
+
+from .files import fileHash, loadManifest, writeManifest
+from .images import DERIVED_DIR
+
+DIST_DIR = 'dist' # relative to the static folder
+MANIFEST_FILE = 'manifest.json'
+IMMUTABLE_PREFIXES = (DIST_DIR + '/', DERIVED_DIR + '/') # files whose names change with their contents
+COMPRESS_EXTS = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.xml', '.ico', '.map')
+ENCODINGS = (('br', '.br'), ('gzip', '.gz')) # in order of preference
+
+
+#----------------------------------------#
+#            Building assets             #
+#----------------------------------------#
+
+def hashedName(name, digest):
+    """
+    'css/site.css' -> 'dist/css/site.<digest>.css'
+    """
+    stem, ext = os.path.splitext(name)
+    return '{}/{}.{}{}'.format(DIST_DIR, stem, digest[:10], ext)
+
+
+def _compressors():
+    """
+    The precompressed encodings available here, as (encoding, suffix, compress function)
+    """
+    compressors = []
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    if brotli is not None:
+        compressors.append(('br', '.br', lambda data: brotli.compress(data, quality=11)))
+    compressors.append(('gzip', '.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0)))
+    return compressors
+
+
+def _sources(staticFolder):
+    """
+    Every static file to fingerprint, as names relative to the static folder
+    Files that already have content-hashed names (dist/ and the derived images) are left alone
+    """
+    for root, dirs, files in os.walk(staticFolder):
+        rel = os.path.relpath(root, staticFolder).replace(os.sep, '/')
+        rel = '' if rel == '.' else rel + '/'
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and not (rel + d + '/').startswith(IMMUTABLE_PREFIXES))
+        for filename in sorted(files):
+            if not filename.startswith('.'):
+                yield rel + filename
+    return
+
+
+def buildAssets(staticFolder):
+    """
+    Fingerprint and precompress the static files, keeping the previous build's files for pages still
+    cached with the old names; returns (written, removed) lists of file names under dist/
+    """
+    distDir = os.path.join(staticFolder, DIST_DIR)
+    manifestPath = os.path.join(distDir, MANIFEST_FILE)
+    os.makedirs(distDir, exist_ok=True)
+    try:
+        with open(manifestPath) as f:
+            old = json.load(f)
+    except (FileNotFoundError, ValueError):
+        old = {'files': {}, 'encodings': {}}
+
+    compressors = _compressors()
+    manifest = {'files': {}, 'encodings': {}}
+    written = []
+    for name in _sources(staticFolder):
+        source = os.path.join(staticFolder, name)
+        hashed = hashedName(name, fileHash(source))
+        target = os.path.join(staticFolder, hashed)
+        manifest['files'][name] = hashed
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+            written.append(hashed)
+
+        if name.lower().endswith(COMPRESS_EXTS):
+            with open(source, 'rb') as f:
+                data = f.read()
+            encodings = []
+            for encoding, suffix, compress in compressors:
+                if not os.path.exists(target + suffix):
+                    packed = compress(data)
+                    if len(packed) >= len(data): # not worth sending
+                        continue
+                    with open(target + suffix, 'wb') as f:
+                        f.write(packed)
+                    written.append(hashed + suffix)
+                encodings.append(encoding)
+            if encodings:
+                manifest['encodings'][hashed] = encodings
+
+    ## keep this build's and the previous build's files, drop anything older
+    keep = set(manifest['files'].values()) | set(old['files'].values())
+    removed = []
+    for root, dirs, files in os.walk(distDir):
+        for filename in files:
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, staticFolder).replace(os.sep, '/')
+            for _, suffix in ENCODINGS:
+                if name.endswith(suffix):
+                    name = name[:-len(suffix)]
+                    break
+            if path != manifestPath and not filename.startswith('.') and name not in keep:
+                os.remove(path)
+                removed.append(os.path.relpath(path, staticFolder).replace(os.sep, '/'))
+
+    ## previous build's files stay servable with their encodings until the next build drops them
+    for hashed in set(old['files'].values()) - set(manifest['files'].values()):
+        if hashed in old['encodings'] and os.path.exists(os.path.join(staticFolder, hashed)):
+            manifest['encodings'][hashed] = old['encodings'][hashed]
+    writeManifest(manifestPath, manifest)
+    return written, removed
+
+
+# define a command line command 'build-assets' to fingerprint static files, e.g. when deploying
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    """
+    Fingerprint and precompress the files in static/
+    """
+    written, removed = buildAssets(current_app.static_folder)
+    click.echo('Wrote {} files, removed {} old files.'.format(len(written), len(removed)))
+    return
+
+
+#----------------------------------------#
+#            Serving assets              #
+#----------------------------------------#
+
+def getManifest():
+    """
+    The static asset manifest for the current app, re-read only when the file changes
+    """
+    return loadManifest(os.path.join(current_app.static_folder, DIST_DIR, MANIFEST_FILE), "static asset manifest")
+
+
+def fingerprintURL(endpoint, values):
+    """
+    url_defaults callback: point url_for('static', filename=...) at the fingerprinted copy
+    """
+    if endpoint != 'static' or not current_app.config['STATIC_FINGERPRINT']:
+        return
+    filename = values.get('filename')
+    manifest = getManifest()
+    if filename and manifest:
+        values['filename'] = manifest['files'].get(filename, filename)
+    return
+
+
+def serveStatic(filename):
+    """
+    The static view: fingerprinted files are cached for good and sent precompressed when accepted
+    Anything else is served by Flask as usual
+    """
+    if not filename.startswith(IMMUTABLE_PREFIXES):
+        return current_app.send_static_file(filename)
+
+    maxAge = current_app.config['STATIC_IMMUTABLE_MAX_AGE']
+    manifest = getManifest() or {'encodings': {}}
+    encodings = manifest['encodings'].get(filename, ())
+    for encoding, suffix in ENCODINGS:
+        if encoding in encodings and request.accept_encodings[encoding]:
+            response = send_from_directory(current_app.static_folder, filename + suffix,
+                                           mimetype=mimetypes.guess_type(filename)[0], max_age=maxAge)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(current_app.static_folder, filename, max_age=maxAge)
+    if encodings:
+        response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_app(app):
+    """
+    Register these functions with the application instance so they get used
+    """
+    app.url_defaults(fingerprintURL)
+    app.view_functions['static'] = serveStatic # replaces Flask's own static view
+    app.cli.add_command(build_assets_command)
+    return
@@ -0,0 +1,138 @@
+#--------------------------------------------------------------------------------------------------#
+#                                        Availability Store                                        #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Keep a parsed, compiled snapshot of the basic availability schedule in each process
+The schedule file in the instance folder is only re-read when its version (mtime, size, inode) changes,
+and saves are published atomically with a temp file + rename so readers never see a partial file
+A schedule marks the slot grid blocks the artist works, {'step': minutes, 'days': {'day': {'hhmm': bool}}};
+a schedule saved before the grid (a bare {'day': {'hhmm': bool}} of allowed one hour session starts) is
+read as working the hour from each allowed start
+"""
+
+import json
+import os
+import tempfile
+import threading
+from collections import namedtuple
+
+from flask import current_app
+
+from .files import fileVersion
+from .openings import DAYS
+from . import slotgrid
+
+AVAIL_FILE = 'availability.json'
+LEGACY_SESSION = 60 # minutes worked from each allowed start in a schedule saved before the grid
+
+# version identifies the file contents on disk and the grid they were compiled for; avail is the
+# {'day': {'hhmm': bool}} schedule on the grid; masks is the tuple of 7 day bitmasks used by the openings engine
+Snapshot = namedtuple('Snapshot', ['version', 'avail', 'masks'])
+
+_snapshots = {} # path -> Snapshot, one per app instance folder
+_lock = threading.Lock()
+
+
+def emptyAvailability():
+    """
+    A schedule with nothing available
+    """
+    return {d:{t:False for t in slotgrid.currentGrid().labels} for d in DAYS}
+
+
+def workingSpans(data):
+    """
+    The (start, end) minutes after midnight worked each day, from a schedule file's contents
+    """
+    if 'days' in data:
+        days, length = data['days'], data['step']
+    else: # saved before the grid
+        days, length = data, LEGACY_SESSION
+    spans = {}
+    for d in DAYS:
+        spans[d] = [(slotgrid.parseTime(t), slotgrid.parseTime(t) + length)
+                    for t, available in days.get(d, {}).items() if available]
+    return spans
+
+
+def compileSchedule(data, grid):
+    """
+    The schedule on the grid and its 7 day bitmasks, from a schedule file's contents
+    """
+    spans = workingSpans(data)
+    masks = tuple(slotgrid.dayMask(grid, spans[d]) for d in DAYS)
+    avail = {d: {t: bool(mask >> k & 1) for k, t in enumerate(grid.labels)} for d, mask in zip(DAYS, masks)}
+    return avail, masks
+
+
+def availabilityPath():
+    """
+    Absolute path of the schedule file for the current app
+    """
+    return os.path.join(current_app.instance_path, AVAIL_FILE)
+
+
+def getSnapshot():
+    """
+    Get the current schedule snapshot, reloading from disk only if the file has changed
+    """
+    path = availabilityPath()
+    grid = slotgrid.currentGrid()
+    version = (fileVersion(path), grid)
+    snap = _snapshots.get(path)
+    if snap is not None and snap.version == version:
+        return snap
+
+    with _lock:
+        snap = _snapshots.get(path)
+        if snap is not None and snap.version == version: # another thread already reloaded
+            return snap
+        if version[0] is None:
+            data = {'step': grid.step, 'days': {}}
+        else:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        avail, masks = compileSchedule(data, grid)
+        snap = Snapshot(version, avail, masks)
+        _snapshots[path] = snap
+        current_app.logger.debug("Loaded availability version {}".format(version))
+    return snap
+
+
+def getAvailability():
+    """
+    A copy of the schedule that the caller is free to modify
+    """
+    return {d:dict(times) for d, times in getSnapshot().avail.items()}
+
+
+def getMasks():
+    """
+    The schedule compiled to a tuple of 7 day bitmasks on the current grid
+    """
+    return getSnapshot().masks
+
+
+def saveAvailability(avail):
+    """
+    Atomically publish a new schedule: write a temp file in the same folder, then rename over the old one
+    avail is {'day': {'hhmm': bool}} on the current grid
+    """
+    path = availabilityPath()
+    grid = slotgrid.currentGrid()
+    data = {'step': grid.step, 'days': avail}
+    fd, tmpPath = tempfile.mkstemp(prefix='.availability-', suffix='.json', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpPath, path)
+    except BaseException:
+        os.unlink(tmpPath)
+        raise
+
+    with _lock:
+        _snapshots[path] = Snapshot((fileVersion(path), grid), *compileSchedule(data, grid))
+    return
@@ -0,0 +1,194 @@
+#--------------------------------------------------------------------------------------------------#
+#                                            Benchmarks                                            #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Command line benchmarks for the app's hot paths, run with e.g. `flask bench startup`
+They never talk to Google; credentials and calendar responses are stand-ins (see fakecal)
+"""
+
+import sqlite3
+import statistics
+import time
+import tracemalloc
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from google.auth.credentials import AnonymousCredentials
+
+bench_cli = AppGroup('bench', help='Benchmark the booking hot paths.')
+
+
+def timeit(fn, repeat, setup=None):
+    """
+    Run fn 'repeat' times and return the timings in milliseconds
+    setup, if given, runs untimed before each call
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def allocations(fn, repeat=5, setup=None):
+    """
+    Peak memory allocated during one call of fn, in KiB, as the median of 'repeat' traced calls
+    """
+    peaks = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        try:
+            fn()
+            peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+        finally:
+            tracemalloc.stop()
+    return statistics.median(peaks)
+
+
+def report(name, timings, peak=None):
+    """
+    Echo one line of summary statistics for a set of timings in milliseconds
+    Returns the summary, with the peak allocation in KiB if measured
+    """
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    summary = {'n': len(timings), 'mean': statistics.mean(timings), 'median': statistics.median(timings), 'p95': p95}
+    line = '{:<48} n={:<5} mean={:>9.3f}ms  median={:>9.3f}ms  p95={:>9.3f}ms'.format(
+        name, len(timings), summary['mean'], summary['median'], p95)
+    if peak is not None:
+        summary['peak_kib'] = peak
+        line += '  peak={:>9.1f}KiB'.format(peak)
+    click.echo(line)
+    return summary
+
+
+@bench_cli.command('startup')
+@click.option('--repeat', default=50, show_default=True, help='Iterations per measurement.')
+def startup_command(repeat):
+    """
+    Compare calendar client bootstrap: building from discovery each time versus the gcal provider
+    """
+    from googleapiclient.discovery import build
+    from .. import gcal
+
+    creds = AnonymousCredentials()
+
+    def buildEachTime():
+        ## what connectToCalendar used to do whenever the cached service expired
+        build('calendar', 'v3', credentials=creds, static_discovery=True)
+
+    def providerCold():
+        ## a new pooled client; the parsed discovery document is reused
+        gcal.connectToCalendar(creds)
+
+    gcal.discoveryDocument() # parse once, as the first request in a worker would
+    report('build() per connection', timeit(buildEachTime, repeat))
+    report('gcal.connectToCalendar (new client)', timeit(providerCold, repeat))
+
+    pool = gcal._processState()['pool']
+    pool.put_nowait(gcal.connectToCalendar(creds))
+    def providerWarm():
+        ## a request borrowing and returning a pooled client
+        pool.put_nowait(pool.get_nowait())
+    report('gcal pool borrow/return', timeit(providerWarm, repeat))
+    return
+
+
+@bench_cli.command('requests')
+@click.option('--repeat', default=500, show_default=True, help='Requests per measurement.')
+def requests_command(repeat):
+    """
+    Per-request database overhead on a public page, for a visitor whose session has a user_id
+    Compares the old eager admin lookup on a fresh connection with lazy g.user on a pooled connection
+    """
+    from .. import db, refresher
+
+    database = current_app.config['DATABASE']
+    app = current_app._get_current_object()
+
+    def eagerLookup():
+        ## what load_logged_in_user used to do before every request
+        conn = sqlite3.connect(database, detect_types=sqlite3.PARSE_DECLTYPES)
+        conn.row_factory = sqlite3.Row
+        conn.execute('SELECT * FROM admin WHERE id = ?', (1,)).fetchone()
+        conn.close()
+
+    def pooledNoLookup():
+        ## a public request now: at most a pooled connection, and no query
+        db.pooled_connection(database)
+
+    report('eager lookup, new connection', timeit(eagerLookup, repeat))
+    report('lazy g.user, pooled connection', timeit(pooledNoLookup, repeat))
+
+    ## time the request alone, not this app's refresh thread starting and computing openings alongside it
+    refresher.stopRefresher(app.extensions['refresher'])
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+    report('GET /pay (full request)', timeit(lambda: client.get('/pay'), repeat))
+    return
+
+
+@bench_cli.command('sessions')
+@click.option('--repeat', default=2000, show_default=True, help='Requests per measurement.')
+def sessions_command(repeat):
+    """
+    Per-request session cost for a client part way through booking: signed cookie versus server-side
+    Each request opens the session, reads from it, sets session.modified as the booking views do, and saves it
+    """
+    from datetime import datetime, timezone
+    from flask.sessions import SecureCookieSessionInterface
+    from flask import request
+    from .. import sessions
+
+    app = current_app._get_current_object()
+    apptDT = datetime(2024, 5, 14, 17, 30, tzinfo=timezone.utc)
+    data = {'tzName': 'America/Chicago', 'tzStr': 'Central Daylight Time', 'offset': 1, 'holdToken': 'x' * 22,
+            'apptDT': apptDT, 'apptDate': 'Tuesday, May 14th', 'apptTime': {'start': '5:30pm', 'end': '6:30pm'},
+            'clientName': 'Jane Client', 'clientEmail': 'jane.client@example.com', 'apptID': 'a' * 26,
+            'oldDT': apptDT, 'oldDate': 'Monday, May 13th', 'oldTime': {'start': '9:00am', 'end': '10:00am'}}
+    interfaces = (('signed cookie', SecureCookieSessionInterface()),
+                  ('server-side, sqlite', sessions.ServerSessionInterface(sessions.SQLiteStore())),
+                  ('server-side, cache', sessions.ServerSessionInterface(sessions.CacheStore())))
+
+    def bareRequest():
+        with app.test_request_context():
+            pass
+    report('request context only', timeit(bareRequest, repeat))
+
+    for name, interface in interfaces:
+        ## the visit's first request creates the session
+        with app.test_request_context():
+            session = interface.open_session(app, request)
+            session.update(data)
+            response = app.response_class()
+            interface.save_session(app, session, response)
+        cookie = response.headers['Set-Cookie'].split(';')[0]
+
+        def oneRequest():
+            with app.test_request_context(headers={'Cookie': cookie}):
+                session = interface.open_session(app, request)
+                session.get('offset')
+                session.modified = True
+                interface.save_session(app, session, app.response_class())
+        report('{} ({} byte cookie)'.format(name, len(cookie)), timeit(oneRequest, repeat))
+    return
+
+
+# the hot path, slot grid, busy time and artist suites live in their own modules
+from .hotpaths import hotpaths_command # noqa: E402
+from .grid import grid_command # noqa: E402
+from .busy import busy_command # noqa: E402
+from .artists import artists_command # noqa: E402
+
+bench_cli.add_command(hotpaths_command)
+bench_cli.add_command(grid_command)
+bench_cli.add_command(busy_command)
+bench_cli.add_command(artists_command)
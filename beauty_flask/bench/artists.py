@@ -0,0 +1,138 @@
+#--------------------------------------------------------------------------------------------------#
+#                                        Artist Benchmarks                                         #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Cost of getting every artist's openings as the roster grows, run with e.g.
+`flask bench artists --artists 1,4,16 --latency 50`
+Each artist gets a fake calendar of their own behind one service, every request to it taking 'latency';
+busy time is listed one calendar after another, listed several calendars at a time, or asked for in
+batched freebusy queries, and each way must find the same openings
+"""
+
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import click
+from dateutil import tz
+from flask import session
+
+from . import report, timeit
+from .fakecal import FakeCalendar, FakeRequest, syntheticEvents
+from .hotpaths import _ints, benchApp, fakeCalendar
+
+
+class Studio:
+    """
+    A calendar service over one FakeCalendar per calendarId, routing each call to the calendar it names
+    Every request sleeps 'latency' seconds on execute, as a round trip to Google would
+    """
+    def __init__(self, byCalendar, latency=0.0):
+        self.byCalendar = byCalendar # calendarId -> FakeCalendar
+        self.latency = latency
+        self.calls = Counter() # 'events.list' -> number of requests
+        self.lock = threading.Lock()
+
+    def _request(self, method, run):
+        with self.lock:
+            self.calls[method] += 1
+
+        def delayed():
+            time.sleep(self.latency)
+            return run()
+        return FakeRequest(delayed)
+
+    def calendars(self):
+        return self
+
+    def events(self):
+        return self
+
+    def freebusy(self):
+        return self
+
+    def get(self, calendarId, eventId=None):
+        return self._request('events.get', self.byCalendar[calendarId].get(calendarId, eventId).execute)
+
+    def list(self, calendarId, **kwargs):
+        return self._request('events.list', self.byCalendar[calendarId].list(calendarId, **kwargs).execute)
+
+    def insert(self, calendarId, body):
+        return self._request('events.insert', self.byCalendar[calendarId].insert(calendarId, body).execute)
+
+    def patch(self, calendarId, eventId, body):
+        return self._request('events.patch', self.byCalendar[calendarId].patch(calendarId, eventId, body).execute)
+
+    def delete(self, calendarId, eventId):
+        return self._request('events.delete', self.byCalendar[calendarId].delete(calendarId, eventId).execute)
+
+    def query(self, body):
+        def run():
+            calendars = {}
+            for item in body['items']:
+                one = self.byCalendar[item['id']].freebusy().query(dict(body, items=[item])).execute()
+                calendars.update(one['calendars'])
+            return {'kind': 'calendar#freeBusy', 'timeMin': body['timeMin'], 'timeMax': body['timeMax'],
+                    'calendars': calendars}
+        return self._request('freebusy.query', run)
+
+
+@click.command('artists')
+@click.option('--artists', 'counts', default='1,4,16', show_default=True, help='Roster sizes to run, comma separated.')
+@click.option('--events-per-day', default=20, show_default=True, help='Events a day on each artist\'s calendar.')
+@click.option('--weeks', default=4, show_default=True, help='Weeks of openings got at once.')
+@click.option('--latency', default=50.0, show_default=True, help='Milliseconds each calendar request takes.')
+@click.option('--workers', default=8, show_default=True, help='Fetch threads when listing several calendars at a time.')
+@click.option('--tz', 'tzName', default='America/Chicago', show_default=True, help='Timezone to run in.')
+@click.option('--repeat', default=5, show_default=True, help='Iterations per measurement.')
+def artists_command(counts, events_per_day, weeks, latency, workers, tzName, repeat):
+    """
+    Latency of every artist's openings for each way of getting busy time, and of merging them for
+    "any artist"
+    """
+    from .. import artists, site, slotgrid
+    from .. import openings as engine
+
+    tzInfo = tz.gettz(tzName)
+    sources = (
+        ('listed in turn', 'list', 1),
+        ('listed {} at a time'.format(workers), 'list', workers),
+        ('batched freebusy', 'freebusy', workers),
+    )
+    with tempfile.TemporaryDirectory(prefix='beauty-bench-') as instance:
+        for count in _ints(counts):
+            today = datetime.now(tzInfo).date()
+            byCalendar = {'artist{}@example.com'.format(i):
+                          FakeCalendar(syntheticEvents(today - timedelta(days=7), weeks + 2, events_per_day, 0.2,
+                                                       tzName, seed=i), tzName)
+                          for i in range(count)}
+            studio = Studio(byCalendar, latency / 1000)
+            app = benchApp(os.path.join(instance, str(count)), CALENDAR_MIRROR=False)
+            click.echo('-- {} artists, {}/day, {} weeks, {:g}ms a request --'.format(
+                count, events_per_day, weeks, latency))
+            with fakeCalendar(studio), app.test_request_context():
+                session['tzName'] = tzName
+                for i, calendarId in enumerate(byCalendar):
+                    artists.addArtist('Artist {}'.format(i), calendarId)
+                grid = slotgrid.currentGrid()
+                duration = slotgrid.defaultDuration()
+                bases = [site.weekBase(offset, tzInfo) for offset in range(1, weeks + 1)]
+                end = site.endOfWeek(bases[0], weeks)
+
+                expected = None
+                for name, source, fetchWorkers in sources:
+                    app.config.update(CALENDAR_BUSY_SOURCE=source, CALENDAR_FETCH_WORKERS=fetchWorkers)
+                    got = site.getArtistOpenings(studio, bases, end, duration)
+                    expected = expected if expected is not None else got
+                    studio.calls.clear()
+                    timings = timeit(lambda: site.getArtistOpenings(studio, bases, end, duration), repeat)
+                    report('{} ({:g} requests, {})'.format(name, sum(studio.calls.values()) / repeat,
+                                                           'same' if got == expected else 'DIFFERENT'), timings)
+
+                merge = lambda: [engine.pickOpenings(grid, byArtist) for week, byArtist in expected]
+                report('any artist merge ({} weeks)'.format(weeks), timeit(merge, repeat * 100))
+    return
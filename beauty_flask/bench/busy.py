@@ -0,0 +1,142 @@
+#--------------------------------------------------------------------------------------------------#
+#                                       Busy Time Benchmarks                                       #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Compare the ways of asking the calendar for busy time on dense synthetic weeks, run with e.g.
+`flask bench busy --events-per-day 20,60,120 --weeks 1,4`
+For each source it reports the response size, the time to parse it as JSON and the time to get merged
+busy intervals, and checks the intervals against the ones worked out straight from the fake's events
+Responses are fetched from the fake once and replayed from JSON, so timings are the app's work alone
+"""
+
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import click
+from dateutil import tz
+
+from . import report, timeit
+from .fakecal import FakeCalendar, FakeRequest, eventBounds, syntheticEvents
+from .hotpaths import _ints, benchApp
+
+
+class Replay:
+    """
+    A calendar service answering events().list and freebusy().query with recorded JSON responses,
+    parsed afresh on every call as the real client does
+    """
+    def __init__(self, payloads):
+        self.pages = {} # pageToken -> JSON of that page
+        token = None
+        for payload in payloads:
+            self.pages[token] = payload
+            token = json.loads(payload).get('nextPageToken')
+
+    def events(self):
+        return self
+
+    def freebusy(self):
+        return self
+
+    def list(self, pageToken=None, **kwargs):
+        return FakeRequest(lambda: json.loads(self.pages[pageToken]))
+
+    def query(self, body):
+        return FakeRequest(lambda: json.loads(self.pages[None]))
+
+
+def fullListing(service, calendarId, start, end):
+    """
+    Pages of a full events().list, as the app fetched busy time before busytime
+    """
+    pages = []
+    pageToken = None
+    while True:
+        result = service.events().list(calendarId=calendarId, orderBy='startTime', singleEvents=True,
+                                       timeMin=start.isoformat(), timeMax=end.isoformat(),
+                                       pageToken=pageToken).execute()
+        pages.append(result)
+        pageToken = result.get('nextPageToken')
+        if pageToken is None:
+            return pages
+
+
+def maskedListing(service, calendarId, start, end):
+    """
+    Pages of the fields-masked events().list that busytime.listBusy makes
+    """
+    from ..busytime import LIST_FIELDS
+
+    pages = []
+    pageToken = None
+    while True:
+        result = service.events().list(calendarId=calendarId, singleEvents=True, fields=LIST_FIELDS,
+                                       timeMin=start.isoformat(), timeMax=end.isoformat(),
+                                       pageToken=pageToken).execute()
+        pages.append(result)
+        pageToken = result.get('nextPageToken')
+        if pageToken is None:
+            return pages
+
+
+def freeBusy(service, calendarId, start, end):
+    """
+    The single freebusy().query response that busytime.queryFreeBusy asks for
+    """
+    body = {'timeMin': start.isoformat(), 'timeMax': end.isoformat(), 'items': [{'id': calendarId}]}
+    return [service.freebusy().query(body=body).execute()]
+
+
+@click.command('busy')
+@click.option('--events-per-day', default='20,60,120', show_default=True, help='Calendar densities to run, comma separated.')
+@click.option('--weeks', default='1,4', show_default=True, help='Weeks fetched at once, comma separated.')
+@click.option('--all-day', default=0.1, show_default=True, help='Share of days with an all-day event.')
+@click.option('--tz', 'tzName', default='America/Chicago', show_default=True, help='Timezone to run in.')
+@click.option('--page-size', default=250, show_default=True, help='Events per page of the fake events().list.')
+@click.option('--repeat', default=20, show_default=True, help='Iterations per measurement.')
+def busy_command(events_per_day, weeks, all_day, tzName, page_size, repeat):
+    """
+    Response size, JSON parse time and latency of each busy time source, and whether each is correct
+    """
+    from .. import site, busytime
+    from .. import openings as engine
+
+    tzInfo = tz.gettz(tzName)
+    calendarId = site.CAL_ID
+    with tempfile.TemporaryDirectory(prefix='beauty-bench-') as instance:
+        app = benchApp(os.path.join(instance, 'busy'))
+        for perDay in _ints(events_per_day):
+            for count in _ints(weeks):
+                today = datetime.now(tzInfo).date()
+                events = syntheticEvents(today - timedelta(days=7), count + 2, perDay, 0.2, tzName, allDay=all_day)
+                service = FakeCalendar(events, tzName, page_size)
+                start = site.weekBase(1, tzInfo)
+                end = site.endOfWeek(start, count)
+                expected = engine.busyIntervals([(max(s, start), min(e, end)) for s, e in
+                                                 (eventBounds(e, tzInfo) for e in events) if s < end and e > start])
+                click.echo('-- {}/day, {} weeks ({} events in range) --'.format(
+                    perDay, count, sum(1 for e in events if eventBounds(e, tzInfo)[0] < end
+                                       and eventBounds(e, tzInfo)[1] > start)))
+
+                sources = (
+                    ('full listing', fullListing, None), # the old way, which fails on all-day events
+                    ('masked listing', maskedListing, busytime.listBusy),
+                    ('freebusy', freeBusy, busytime.queryFreeBusy),
+                )
+                with app.app_context():
+                    for name, fetch, getBusy in sources:
+                        payloads = [json.dumps(page) for page in fetch(service, calendarId, start, end)]
+                        size = sum(len(p) for p in payloads)
+                        report('{} parse ({} pages, {:.1f}KiB)'.format(name, len(payloads), size / 1024),
+                               timeit(lambda: [json.loads(p) for p in payloads], repeat))
+                        if getBusy is None:
+                            continue
+                        replay = Replay(payloads)
+                        busy = lambda: engine.busyIntervals(getBusy(replay, calendarId, start, end))
+                        got = [[max(s, engine.toMinutes(start)), min(e, engine.toMinutes(end) + 1)] for s, e in busy()]
+                        report('{} busy intervals ({})'.format(name, 'correct' if got == expected else 'WRONG'),
+                               timeit(busy, repeat))
+    return
@@ -0,0 +1,196 @@
+#--------------------------------------------------------------------------------------------------#
+#                                       Fake Calendar Service                                      #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+An in-memory stand-in for the googleapiclient calendar service, and synthetic weeks of events for it
+It answers the calls the app makes (calendars().get, freebusy().query, and events()
+list/get/insert/patch/delete) with the same resource shapes, paging and partial responses (fields=) as
+Google, and counts calls per method
+"""
+
+import random
+from collections import Counter
+from datetime import datetime, timedelta
+
+from dateutil import tz
+
+
+class FakeRequest:
+    """
+    What a service method returns; the work happens on execute(), as with googleapiclient
+    """
+    def __init__(self, fn):
+        self.fn = fn
+
+    def execute(self):
+        return self.fn()
+
+
+def eventBounds(e, tzInfo):
+    """
+    Aware (start, end) datetimes of an event resource, all-day events spanning whole days in tzInfo
+    """
+    def bound(t):
+        if 'dateTime' in t:
+            return datetime.fromisoformat(t['dateTime'])
+        day = datetime.fromisoformat(t['date'])
+        return datetime(day.year, day.month, day.day, tzinfo=tzInfo)
+    return bound(e['start']), bound(e['end'])
+
+
+def masked(item, fields):
+    """
+    An event resource cut down to the item fields of a partial response mask like 'items(id,start),...'
+    """
+    if not fields or 'items(' not in fields:
+        return dict(item)
+    keep = fields.split('items(', 1)[1].split(')', 1)[0].split(',')
+    return {k: item[k] for k in keep if k in item}
+
+
+class FreeBusy:
+    """
+    freebusy().query over a FakeCalendar: merged busy intervals of its non-transparent events, in UTC
+    """
+    def __init__(self, calendar):
+        self.calendar = calendar
+
+    def query(self, body):
+        self.calendar.calls['freebusy.query'] += 1
+
+        def run():
+            lo = datetime.fromisoformat(body['timeMin'])
+            hi = datetime.fromisoformat(body['timeMax'])
+            tzInfo = tz.gettz(self.calendar.tzName)
+            spans = sorted(eventBounds(e, tzInfo) for e in self.calendar.store.values()
+                           if e.get('transparency') != 'transparent')
+            busy = []
+            for s, e in spans:
+                s, e = max(s, lo), min(e, hi)
+                if s >= e:
+                    continue
+                if busy and s <= busy[-1][1]:
+                    busy[-1][1] = max(busy[-1][1], e)
+                else:
+                    busy.append([s, e])
+            utc = lambda t: t.astimezone(tz.UTC).strftime('%Y-%m-%dT%H:%M:%SZ')
+            calendars = {item['id']: {'busy': [{'start': utc(s), 'end': utc(e)} for s, e in busy]}
+                         for item in body['items']}
+            return {'kind': 'calendar#freeBusy', 'timeMin': body['timeMin'], 'timeMax': body['timeMax'],
+                    'calendars': calendars}
+        return FakeRequest(run)
+
+
+class FakeCalendar:
+    """
+    A calendar service over a dict of event resources
+    """
+    def __init__(self, events=(), tzName='America/Chicago', pageSize=250):
+        self.tzName = tzName
+        self.pageSize = pageSize
+        self.store = {e['id']: e for e in events}
+        self.calls = Counter() # 'events.list' -> number of calls
+        self.serial = len(self.store)
+
+    def calendars(self):
+        return self
+
+    def events(self):
+        return self
+
+    def freebusy(self):
+        return FreeBusy(self)
+
+    def get(self, calendarId, eventId=None):
+        if eventId is None: # calendars().get
+            self.calls['calendars.get'] += 1
+            return FakeRequest(lambda: {'id': calendarId, 'timeZone': self.tzName})
+        self.calls['events.get'] += 1
+        return FakeRequest(lambda: dict(self.store[eventId]))
+
+    def list(self, calendarId, timeMin=None, timeMax=None, pageToken=None, syncToken=None, fields=None,
+             **kwargs):
+        self.calls['events.list'] += 1
+
+        def run():
+            if syncToken is not None: # nothing changes behind the benchmark's back
+                return {'items': [], 'nextSyncToken': syncToken, 'timeZone': self.tzName}
+            lo = datetime.fromisoformat(timeMin) if timeMin else None
+            hi = datetime.fromisoformat(timeMax) if timeMax else None
+            tzInfo = tz.gettz(self.tzName)
+            bounds = {e['id']: eventBounds(e, tzInfo) for e in self.store.values()}
+            items = sorted((e for e in self.store.values()
+                            if (lo is None or bounds[e['id']][1] > lo) and (hi is None or bounds[e['id']][0] < hi)),
+                           key=lambda e: bounds[e['id']][0])
+            first = int(pageToken or 0)
+            result = {'items': [masked(e, fields) for e in items[first:first + self.pageSize]],
+                      'timeZone': self.tzName}
+            if first + self.pageSize < len(items):
+                result['nextPageToken'] = str(first + self.pageSize)
+            else:
+                result['nextSyncToken'] = 'sync-{}'.format(self.serial)
+            return result
+        return FakeRequest(run)
+
+    def insert(self, calendarId, body):
+        self.calls['events.insert'] += 1
+
+        def run():
+            self.serial += 1
+            event = dict(body, id=body.get('id') or 'bench{}'.format(self.serial), status='confirmed',
+                         etag='"{}"'.format(self.serial), updated=datetime.now(tz.UTC).isoformat())
+            self.store[event['id']] = event
+            return dict(event)
+        return FakeRequest(run)
+
+    def patch(self, calendarId, eventId, body):
+        self.calls['events.patch'] += 1
+
+        def run():
+            self.serial += 1
+            self.store[eventId] = dict(self.store[eventId], etag='"{}"'.format(self.serial), **body)
+            return dict(self.store[eventId])
+        return FakeRequest(run)
+
+    def delete(self, calendarId, eventId):
+        self.calls['events.delete'] += 1
+        return FakeRequest(lambda: self.store.pop(eventId) and '')
+
+
+def syntheticEvents(start, weeks, perDay, overlap=0.0, tzName='America/Chicago', seed=0, allDay=0.0):
+    """
+    Event resources for 'weeks' weeks from the date 'start': 'perDay' events a day between 8am and 9pm,
+    30 to 120 minutes long, in tzName; 'overlap' is the share of events that start inside the one before
+    'allDay' is the share of days that also get an all-day event
+    Events carry a description and attendees, like real bookings, so full listings are realistically sized
+    """
+    rng = random.Random(seed)
+    tzInfo = tz.gettz(tzName)
+    events = []
+    for day in range(weeks * 7):
+        date = start + timedelta(days=day)
+        opening = datetime(date.year, date.month, date.day, 8, 0, tzinfo=tzInfo)
+        previous = None
+        for i in range(perDay):
+            length = timedelta(minutes=rng.choice((30, 45, 60, 90, 120)))
+            if previous is not None and rng.random() < overlap:
+                begin = previous[0] + (previous[1] - previous[0]) / 2
+            else:
+                begin = opening + timedelta(minutes=rng.randrange(0, 13 * 60, 15))
+            events.append({
+                'id': 'synth{}x{}'.format(day, i), 'status': 'confirmed', 'etag': '"0"',
+                'updated': '2020-01-01T00:00:00.000Z', 'summary': 'Busy',
+                'description': 'Session with Client {0}; client{0}@example.com'.format(i),
+                'attendees': [{'email': 'client{}@example.com'.format(i), 'responseStatus': 'accepted'}],
+                'start': {'dateTime': begin.isoformat(), 'timeZone': tzName},
+                'end': {'dateTime': (begin + length).isoformat(), 'timeZone': tzName},
+            })
+            previous = (begin, begin + length)
+        if allDay and rng.random() < allDay:
+            events.append({
+                'id': 'synth{}allday'.format(day), 'status': 'confirmed', 'etag': '"0"',
+                'updated': '2020-01-01T00:00:00.000Z', 'summary': 'Day off',
+                'start': {'date': date.isoformat()}, 'end': {'date': (date + timedelta(days=1)).isoformat()},
+            })
+    return events
@@ -0,0 +1,57 @@
+#--------------------------------------------------------------------------------------------------#
+#                                       Slot Grid Benchmarks                                       #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Cost of finding a week's openings as the slot grid gets finer and sessions get longer, run with e.g.
+`flask bench grid --steps 5,15,30 --durations 30,60,120 --events-per-day 5,60`
+Each grid step gets a throwaway app with every block available, against the same fake calendar
+"""
+
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import click
+from dateutil import tz
+from flask import session
+
+from . import allocations, report, timeit
+from .fakecal import FakeCalendar, syntheticEvents
+from .hotpaths import _ints, benchApp
+
+
+@click.command('grid')
+@click.option('--steps', default='5,15,30', show_default=True, help='Grid steps in minutes, comma separated.')
+@click.option('--durations', default='30,60,120', show_default=True, help='Session lengths in minutes, comma separated.')
+@click.option('--events-per-day', default='5,60', show_default=True, help='Calendar densities to run, comma separated.')
+@click.option('--tz', 'tzName', default='America/Chicago', show_default=True, help='Timezone to run in.')
+@click.option('--repeat', default=200, show_default=True, help='Iterations per measurement.')
+def grid_command(steps, durations, events_per_day, tzName, repeat):
+    """
+    Latency and allocations of findOpenings for each grid step, session length and calendar density
+    """
+    from .. import availability, site, slotgrid
+    from .. import openings as engine
+
+    durations = _ints(durations)
+    tzInfo = tz.gettz(tzName)
+    with tempfile.TemporaryDirectory(prefix='beauty-bench-') as instance:
+        for perDay in _ints(events_per_day):
+            today = datetime.now(tzInfo).date()
+            events = syntheticEvents(today - timedelta(days=7), 7, perDay, 0.2, tzName)
+            service = FakeCalendar(events, tzName)
+            for step in _ints(steps):
+                app = benchApp(os.path.join(instance, '{}_{}'.format(perDay, step)), SLOT_MINUTES=step,
+                               SESSION_DURATIONS=tuple(durations))
+                with app.test_request_context():
+                    session['tzName'] = tzName
+                    grid = slotgrid.currentGrid()
+                    base = site.weekBase(1, tzInfo) # a whole week, nothing dropped as past
+                    busy = engine.busyIntervals(site.getEventsForRange(service, base, site.endOfWeek(base)))
+                    masks = availability.getMasks()
+                    click.echo('-- {}/day, {} minute grid ({} blocks a day) --'.format(perDay, step, grid.size))
+                    for duration in durations:
+                        fn = lambda: engine.findOpenings(base, masks, busy, grid, duration)
+                        report('findOpenings {} min'.format(duration), timeit(fn, repeat), allocations(fn, 3))
+    return
@@ -0,0 +1,219 @@
+#--------------------------------------------------------------------------------------------------#
+#                                       Hot Path Benchmarks                                        #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Latency and allocations of the openings and appointment paths against a fake calendar, as calendars get
+denser and offsets grow, run with e.g. `flask bench hotpaths --events-per-day 5,20,60 --offsets 0,4,11`
+Each run uses a throwaway app (own instance folder, database and cache) so nothing real is touched
+Save a run with --save and check a later one against it with --compare to catch regressions between commits
+"""
+
+import json
+import os
+import platform
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import click
+from dateutil import tz
+from flask import session
+
+from . import allocations, report, timeit
+from .fakecal import FakeCalendar, syntheticEvents
+
+
+def _ints(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+@contextmanager
+def fakeCalendar(service):
+    """
+    Have gcal.getService hand out 'service' for the duration
+    """
+    from .. import gcal
+    original = gcal.getService
+    gcal.getService = lambda: service
+    try:
+        yield service
+    finally:
+        gcal.getService = original
+    return
+
+
+def benchApp(instance, **config):
+    """
+    A throwaway app using the 'instance' folder, with its database created and every timeblock available
+    Keyword arguments override its config
+    """
+    from .. import create_app, db, availability, slotgrid
+    from ..openings import DAYS
+
+    os.makedirs(instance, exist_ok=True)
+    app = create_app(dict(dict(TESTING=True, SECRET_KEY='bench', DATABASE=os.path.join(instance, 'bench.sqlite'),
+                               CACHE_TYPE='SimpleCache', MAIL_OUTBOX_WORKER=False, OPENINGS_REFRESH=False,
+                               PAGE_CACHE=False), **config))
+    app.instance_path = instance
+    with app.app_context():
+        db.init_db()
+        availability.saveAvailability({d: {t: True for t in slotgrid.currentGrid().labels} for d in DAYS})
+    return app
+
+
+def benchFunctions(app, service, tzName, offset, measure):
+    """
+    The openings functions for the week 'offset' weeks from now
+    """
+    from .. import site, availability, slotgrid
+    from .. import openings as engine
+
+    tzInfo = tz.gettz(tzName)
+    with app.test_request_context():
+        session['tzName'] = tzName
+        session['offset'] = offset
+        base = site.weekBase(offset, tzInfo)
+        raw = site.getEventsForRange(service, base, site.endOfWeek(base))
+        busy = engine.busyIntervals(raw)
+        masks = availability.getMasks()
+        grid = slotgrid.currentGrid()
+        duration = slotgrid.defaultDuration()
+
+        measure('getEventsForWeek', lambda: site.getEventsForWeek(service, base))
+        measure('busyIntervals', lambda: engine.busyIntervals(raw))
+        measure('findOpenings', lambda: engine.findOpenings(base, masks, busy, grid, duration))
+        app.config['CALENDAR_MIRROR'] = False
+        measure('getOpeningsForWeek list', lambda: site.getOpeningsForWeek(service))
+        app.config['CALENDAR_MIRROR'] = True
+        site.getOpeningsForWeek(service) # the first call fills the mirror
+        measure('getOpeningsForWeek mirror', lambda: site.getOpeningsForWeek(service))
+        site.getCachedOpenings(service, offset, 1)
+        measure('getCachedOpenings warm', lambda: site.getCachedOpenings(service, offset, 1))
+    return
+
+
+def benchEndpoints(app, tzName, offset, measure):
+    """
+    The fetch endpoints through the test client, for a client whose session already has its timezone
+    """
+    from ..extensions import cache
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['tzName'] = tzName
+        sess['tzStr'] = "the " + tzName + " timezone"
+        sess['offset'] = offset
+
+    def clearCache():
+        with app.app_context():
+            cache.clear()
+
+    url = '/openings?from={}'.format(offset)
+    measure('GET /openings cold', lambda: client.get(url), setup=clearCache)
+    client.get(url)
+    measure('GET /openings warm', lambda: client.get(url))
+    etag = client.get(url).headers['ETag']
+    measure('GET /openings 304', lambda: client.get(url, headers={'If-None-Match': etag}))
+    measure('GET /openings 4 weeks cold', lambda: client.get(url + '&weeks=4'), setup=clearCache)
+
+    ## each booking takes the next free hour from tomorrow on
+    slots = iter(datetime.now(tz.gettz(tzName)).replace(tzinfo=None, minute=0, second=0, microsecond=0)
+                 + timedelta(days=1, hours=h) for h in range(10 ** 6))
+    def nextSlot():
+        with client.session_transaction() as sess:
+            sess['apptDT'] = next(slots)
+            sess['apptDate'] = 'Benchday'
+            sess['apptTime'] = {'start': '9:00am', 'end': '10:00am'}
+            sess['clientName'] = 'Bench Client'
+            sess['clientEmail'] = 'bench@example.com'
+    measure('GET /appointment (book)', lambda: client.get('/appointment'), setup=nextSlot)
+
+    nextSlot()
+    apptID = client.get('/appointment').get_json()['apptID']
+    measure('GET /appointment/<id>', lambda: client.get('/appointment/' + apptID))
+    return
+
+
+def compareResults(results, baseline, threshold, minDelta):
+    """
+    Echo how each benchmark changed against the baseline run; returns the names that regressed
+    A benchmark regresses if its median time or peak allocation grew by more than 'threshold' (a fraction),
+    and the median by more than minDelta milliseconds, so noise on tiny timings is ignored
+    """
+    regressed = []
+    for name, now in results.items():
+        was = baseline.get(name)
+        if was is None:
+            click.echo('{:<48} new'.format(name))
+            continue
+        change = now['median'] / was['median'] - 1 if was['median'] else 0.0
+        slower = change > threshold and now['median'] - was['median'] > minDelta
+        fatter = ('peak_kib' in now and 'peak_kib' in was and was['peak_kib']
+                  and now['peak_kib'] > was['peak_kib'] * (1 + threshold) and now['peak_kib'] - was['peak_kib'] > 1)
+        flag = 'REGRESSED' if slower or fatter else ''
+        click.echo('{:<48} median {:>+7.1%}  peak {:>+7.1%}  {}'.format(
+            name, change, now.get('peak_kib', 0) / was['peak_kib'] - 1 if was.get('peak_kib') else 0.0, flag))
+        if flag:
+            regressed.append(name)
+    return regressed
+
+
+@click.command('hotpaths')
+@click.option('--events-per-day', default='5,20,60', show_default=True, help='Calendar densities to run, comma separated.')
+@click.option('--overlap', default=0.2, show_default=True, help='Share of events overlapping the one before.')
+@click.option('--tz', 'tzNames', default='America/Chicago', show_default=True, help='Timezones to run, comma separated.')
+@click.option('--offsets', default='0,4', show_default=True, help='Week offsets to run, comma separated.')
+@click.option('--page-size', default=250, show_default=True, help='Events per page of the fake events().list.')
+@click.option('--repeat', default=50, show_default=True, help='Iterations per measurement.')
+@click.option('--endpoints/--no-endpoints', default=True, help='Also benchmark the endpoints through the test client.')
+@click.option('--save', type=click.Path(dir_okay=False), help='Write the results to this JSON file.')
+@click.option('--compare', type=click.Path(exists=True, dir_okay=False), help='Compare against results saved earlier.')
+@click.option('--threshold', default=0.25, show_default=True, help='Fractional slowdown counted as a regression.')
+@click.option('--min-delta', default=0.05, show_default=True, help='Ignore median changes smaller than this (ms).')
+def hotpaths_command(events_per_day, overlap, tzNames, offsets, page_size, repeat, endpoints, save, compare,
+                     threshold, min_delta):
+    """
+    Latency and allocations of the openings and appointment paths on synthetic calendars
+    Exits with status 1 if --compare finds a regression
+    """
+    results = {}
+    tzNames = [t.strip() for t in tzNames.split(',') if t.strip()]
+    with tempfile.TemporaryDirectory(prefix='beauty-bench-') as instance:
+        for tzName in tzNames:
+            for perDay in _ints(events_per_day):
+                for offset in _ints(offsets):
+                    label = '{}/day {} +{}w'.format(perDay, tzName.split('/')[-1], offset)
+                    click.echo('-- {} --'.format(label))
+                    today = datetime.now(tz.gettz(tzName)).date()
+                    events = syntheticEvents(today - timedelta(days=7), offset + 6, perDay, overlap, tzName)
+                    service = FakeCalendar(events, tzName, page_size)
+                    app = benchApp(os.path.join(instance, label.replace('/', '_').replace(' ', '_')))
+
+                    def measure(name, fn, setup=None):
+                        name = '{} {}'.format(label, name)
+                        results[name] = report(name, timeit(fn, repeat, setup), allocations(fn, 3, setup))
+                        return
+
+                    with fakeCalendar(service):
+                        benchFunctions(app, service, tzName, offset, measure)
+                        if endpoints:
+                            benchEndpoints(app, tzName, offset, measure)
+
+    if save:
+        meta = {'python': platform.python_version(), 'machine': platform.machine(), 'overlap': overlap,
+                'repeat': repeat, 'page_size': page_size, 'created': datetime.now().isoformat(timespec='seconds')}
+        with open(save, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=1, sort_keys=True)
+        click.echo('Saved {} results to {}'.format(len(results), save))
+
+    if compare:
+        with open(compare) as f:
+            baseline = json.load(f)
+        click.echo('-- compared with {} ({}) --'.format(compare, baseline.get('meta', {}).get('created')))
+        regressed = compareResults(results, baseline['results'], threshold, min_delta)
+        if regressed:
+            click.echo('{} benchmarks regressed by more than {:.0%}'.format(len(regressed), threshold))
+            raise SystemExit(1)
+        click.echo('No regressions beyond {:.0%}'.format(threshold))
+    return
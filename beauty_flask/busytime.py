@@ -0,0 +1,164 @@
+#--------------------------------------------------------------------------------------------------#
+#                                         Busy Time Source                                         #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Ask Google Calendar only for when a calendar is busy, never for whole event resources
+freebusy().query answers with just the merged busy intervals, all-day events included; where it cannot
+answer for the calendar (or CALENDAR_BUSY_SOURCE is 'list'), events().list is paged through with a
+fields mask so only each event's start, end, status and transparency come back
+Either way events marked "free" (transparent) don't block openings, as in Google's own free/busy view
+Many calendars (one per artist) are asked about together, FREEBUSY_MAX_CALENDARS to a query; calendars
+that must be listed instead are fetched in a pool of up to CALENDAR_FETCH_WORKERS threads
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time
+
+from dateutil import tz
+from flask import current_app
+from googleapiclient.errors import HttpError
+
+from . import gcal
+
+# partial response masks for events().list: just enough to place each event in time
+LIST_FIELDS = 'items(start,end,status,transparency),nextPageToken,timeZone'
+SYNC_FIELDS = 'items(id,start,end,status,transparency),nextPageToken,nextSyncToken,timeZone'
+FREEBUSY_MAX_CALENDARS = 50 # most calendars one freebusy().query may ask about
+
+_executor = {'pid': None, 'pool': None}
+_executorLock = threading.Lock()
+
+
+class BusyTimeError(Exception):
+    """
+    freebusy().query could not answer for the calendar, e.g. it is not shared for free/busy reads
+    """
+
+
+def eventSpan(e, tzInfo=None):
+    """
+    The (start, end) of a calendar event resource, or None if it does not take up time
+    Timed events give their ISO strings; all-day events give aware datetimes from midnight of their first
+    day to midnight after their last, in tzInfo (the calendar's timezone), or None without one
+    """
+    if e.get('status') == 'cancelled' or e.get('transparency') == 'transparent':
+        return None
+    start, end = e.get('start', {}), e.get('end', {})
+    if 'dateTime' in start and 'dateTime' in end:
+        return start['dateTime'], end['dateTime']
+    if 'date' in start and 'date' in end and tzInfo is not None: # all-day; the end date is exclusive
+        return (datetime.combine(date.fromisoformat(start['date']), time(), tzInfo),
+                datetime.combine(date.fromisoformat(end['date']), time(), tzInfo))
+    return None
+
+
+def queryFreeBusy(service, calendarId, start, end):
+    """
+    The calendar's busy intervals between the start and end datetimes, as (start, end) ISO strings
+    Raises BusyTimeError if Google reports an error for the calendar instead of its busy time
+    """
+    found = queryFreeBusyMany(service, [calendarId], start, end)
+    if calendarId not in found:
+        raise BusyTimeError("No free/busy for {}".format(calendarId))
+    return found[calendarId]
+
+
+def queryFreeBusyMany(service, calendarIds, start, end):
+    """
+    Busy intervals of several calendars between the start and end datetimes, FREEBUSY_MAX_CALENDARS to a query
+    Returns {calendarId: [(start, end), ...]} for the calendars Google answered for; those it reported
+    an error for are logged and left out
+    """
+    busy = {}
+    for i in range(0, len(calendarIds), FREEBUSY_MAX_CALENDARS):
+        chunk = calendarIds[i:i + FREEBUSY_MAX_CALENDARS]
+        body = {'timeMin': start.isoformat(), 'timeMax': end.isoformat(), 'items': [{'id': c} for c in chunk]}
+        result = service.freebusy().query(body=body).execute()
+        for calendarId in chunk:
+            found = result.get('calendars', {}).get(calendarId)
+            if found is None or found.get('errors'):
+                current_app.logger.info("No free/busy for {}: {}".format(calendarId, found and found['errors']))
+                continue
+            busy[calendarId] = [(b['start'], b['end']) for b in found.get('busy', [])]
+    return busy
+
+
+def listBusy(service, calendarId, start, end):
+    """
+    The calendar's events between the start and end datetimes, as (start, end) pairs
+    Pages through events().list with a fields mask; all-day events span whole days in the calendar's
+    timezone as the listing gives it (start's if it doesn't), as the mirror places them
+    """
+    items = []
+    pageToken = None
+    while True:
+        result = service.events().list(calendarId=calendarId, singleEvents=True, fields=LIST_FIELDS,
+                                       timeMin=start.isoformat(), timeMax=end.isoformat(),
+                                       pageToken=pageToken).execute()
+        items.extend(result.get('items', []))
+        pageToken = result.get('nextPageToken')
+        if pageToken is None:
+            break
+    tzName = result.get('timeZone')
+    tzInfo = tz.gettz(tzName) if tzName else start.tzinfo
+    return [span for span in (eventSpan(e, tzInfo) for e in items) if span is not None]
+
+
+def _pool():
+    """
+    This process's fetch threads, started afresh in a forked worker
+    """
+    if _executor['pid'] != os.getpid():
+        with _executorLock:
+            if _executor['pid'] != os.getpid():
+                _executor.update(pid=os.getpid(), pool=ThreadPoolExecutor(
+                    max_workers=current_app.config['CALENDAR_FETCH_WORKERS'], thread_name_prefix='busytime'))
+    return _executor['pool']
+
+
+def fetchEach(service, calendarIds, fetch):
+    """
+    {calendarId: fetch(service, calendarId)} for each calendar, several at a time in the fetch threads
+    Each thread works in its own app context with a calendar client of its own, as one client's connection
+    can't be shared; a single calendar is fetched straight away with 'service'
+    """
+    if len(calendarIds) <= 1 or current_app.config['CALENDAR_FETCH_WORKERS'] <= 1:
+        return {calendarId: fetch(service, calendarId) for calendarId in calendarIds}
+    app = current_app._get_current_object()
+
+    def task(calendarId):
+        with app.app_context():
+            return fetch(gcal.getService(), calendarId)
+
+    futures = {calendarId: _pool().submit(task, calendarId) for calendarId in calendarIds}
+    return {calendarId: future.result() for calendarId, future in futures.items()}
+
+
+def getBusyTimes(service, calendarId, start, end):
+    """
+    The calendar's busy time between the start and end datetimes, from CALENDAR_BUSY_SOURCE
+    """
+    return getBusyTimesMany(service, [calendarId], start, end)[calendarId]
+
+
+def getBusyTimesMany(service, calendarIds, start, end):
+    """
+    {calendarId: busy time} between the start and end datetimes for each calendar, from CALENDAR_BUSY_SOURCE
+    With 'freebusy', calendars it cannot answer for are listed instead; an outage is raised as it is,
+    as listing would fail the same way
+    """
+    busy = {}
+    if current_app.config['CALENDAR_BUSY_SOURCE'] == 'freebusy':
+        try:
+            busy = queryFreeBusyMany(service, list(calendarIds), start, end)
+        except HttpError as e:
+            if gcal.isOutage(e):
+                raise
+            current_app.logger.info("Error while querying free/busy, listing events instead")
+            current_app.logger.error(e)
+    unanswered = [calendarId for calendarId in calendarIds if calendarId not in busy]
+    busy.update(fetchEach(service, unanswered, lambda svc, calendarId: listBusy(svc, calendarId, start, end)))
+    return busy
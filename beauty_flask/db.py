@@ -1,9 +1,74 @@
+import os
 import sqlite3
+import threading
+import time
 
 import click
 from flask import current_app, g
 from flask.cli import with_appcontext
 
+from . import metrics
+
+# One open connection per thread (and per database file), reused across requests
+_pool = threading.local()
+
+# Tuning applied to every new connection
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL', # readers don't block the writer and vice versa
+    'PRAGMA synchronous = NORMAL', # safe with WAL, and far fewer fsyncs
+    'PRAGMA busy_timeout = 5000', # wait for a lock instead of failing straight away
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -8000', # 8MB page cache
+)
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    A connection that records how long each statement takes, by statement type (SELECT, INSERT, ...)
+    """
+    def _timed(self, run, sql, *args):
+        start = time.perf_counter()
+        try:
+            return run(sql, *args)
+        finally:
+            verb = sql.split(None, 1)[0].upper() if sql.strip() else 'EMPTY'
+            metrics.observe('db_query_seconds', time.perf_counter() - start, statement=verb)
+
+    def execute(self, sql, *args):
+        return self._timed(super().execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._timed(super().executemany, sql, *args)
+
+    def executescript(self, sql):
+        return self._timed(super().executescript, sql)
+
+
+def connect(database):
+    """
+    Open and tune a new connection to the database
+    """
+    db = sqlite3.connect(database, detect_types=sqlite3.PARSE_DECLTYPES, factory=TimedConnection)
+    db.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        db.execute(pragma)
+    return db
+
+
+def pooled_connection(database):
+    """
+    Get this thread's connection to the database, opening it the first time
+    A forked worker opens its own rather than sharing its parent's
+    """
+    conns = getattr(_pool, 'conns', None)
+    if conns is None or _pool.pid != os.getpid():
+        conns = _pool.conns = {}
+        _pool.pid = os.getpid()
+    db = conns.get(database)
+    if db is None:
+        db = conns[database] = connect(database)
+    return db
+
 
 def get_db():
     """
@@ -12,47 +77,113 @@ def get_db():
     # g is a special object unique for each request
     # current_app is a special object pointing to the Flask app handling the request
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        if current_app.config['DATABASE_POOL']:
+            g.db = pooled_connection(current_app.config['DATABASE'])
+        else:
+            g.db = connect(current_app.config['DATABASE'])
 
     return g.db
 
 
 def close_db(e=None):
     """
-    If there is an open connection to the database, close it
+    If there is an open connection to the database, close it, or hand it back to the pool
     """
     # check if a connection was created
     db = g.pop('db', None)
 
-    # if so, close it
+    # if so, close it (pooled connections stay open, with any unfinished transaction rolled back)
     if db is not None:
-        db.close()
+        if current_app.config['DATABASE_POOL']:
+            if db.in_transaction:
+                db.rollback()
+        else:
+            db.close()
     return
 
 
-def init_db():
+def columns(db, table):
+    """
+    Names of the table's columns, or an empty list if it does not exist
     """
-    Initialize the SQL database
+    return [row['name'] for row in db.execute('PRAGMA table_info({})'.format(table))]
+
+
+def _appointmentCalendar(db):
+    """
+    appointment.calendar_id came with artists; older appointments are on the default calendar, which a
+    NULL calendar_id already stands for
+    """
+    found = columns(db, 'appointment')
+    if found and 'calendar_id' not in found:
+        db.execute('ALTER TABLE appointment ADD COLUMN calendar_id TEXT')
+    return
+
+
+def _reservationCalendar(db):
+    """
+    reservation became keyed on (calendar_id, unit_start) with artists; SQLite can't change a primary key,
+    so the table is rebuilt with the reservations it had on the default calendar
+    """
+    found = columns(db, 'reservation')
+    if not found or 'calendar_id' in found:
+        return
+    from .artists import DEFAULT_CALENDAR_ID
+    db.execute('ALTER TABLE reservation RENAME TO reservation_old')
+    db.execute(
+        "CREATE TABLE reservation (calendar_id TEXT NOT NULL, unit_start INTEGER NOT NULL, token TEXT NOT NULL,"
+        " status TEXT NOT NULL DEFAULT 'held', appt_id TEXT, expires INTEGER, PRIMARY KEY (calendar_id, unit_start))"
+    )
+    db.execute('INSERT INTO reservation (calendar_id, unit_start, token, status, appt_id, expires)'
+               ' SELECT ?, unit_start, token, status, appt_id, expires FROM reservation_old', (DEFAULT_CALENDAR_ID,))
+    db.execute('DROP TABLE reservation_old') # and its index, which schema.sql then makes on the new table
+    return
+
+
+# In-place upgrades of tables made by an older schema.sql, run before it in one transaction
+# Each is called with the connection and checks the table itself, so it is a no-op once applied
+UPGRADES = (
+    _appointmentCalendar,
+    _reservationCalendar,
+)
+
+
+def migrate_db():
+    """
+    Bring the database up to the current schema without losing any data
+    Tables made by an older schema are upgraded in place, then missing tables and indexes are created
     """
     db = get_db()
+    db.execute('BEGIN IMMEDIATE') # one process at a time
+    try:
+        for upgrade in UPGRADES:
+            upgrade(db)
+    except BaseException:
+        db.rollback()
+        raise
+    db.commit()
 
     with current_app.open_resource('schema.sql') as f:
         db.executescript(f.read().decode('utf8'))
     return
 
 
+def init_db():
+    """
+    Initialize the SQL database, keeping any existing data
+    """
+    migrate_db()
+    return
+
+
 # define a command line command 'init-db' to call this function and show success message to user
-@click.command('init-db') 
+@click.command('init-db')
 @with_appcontext
 def init_db_command():
     """
     Initialize the database
     """
-    # Clear existing data if present and create new tables
+    # Create any missing tables and upgrade older ones; existing data is kept
     init_db()
     click.echo('Initialized the database.')
     return
@@ -64,6 +195,11 @@ def init_app(app):
     """
     app.teardown_appcontext(close_db) # tell Flask to call this when cleaning up after returning response
     app.cli.add_command(init_db_command) # adds a new command that can be called with the `flask` command
+    if app.config['DATABASE_MIGRATE']:
+        with app.app_context():
+            try:
+                migrate_db()
+            except Exception as e: # e.g. a read-only database; the schema may well be current already
+                app.logger.info("Error while migrating the database")
+                app.logger.error(e)
     return
-
-
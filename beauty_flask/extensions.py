@@ -1,3 +1,4 @@
+from flask import current_app
 from flask_caching import Cache
 from flask_mail import Mail
 
@@ -8,7 +9,57 @@ Define extension instances here in own file so they can be imported all around t
 #config = {'CACHE_TYPE': 'SimpleCache',
 #          'CACHE_DEFAULT_TIMEOUT' : 900}
 #cache = Cache(config=config)
-cache = Cache()
+
+class FallbackCache(Cache):
+    """
+    The cache, carrying on without it when its backend can't be reached (e.g. a shared Redis that is
+    down): reads miss and writes are dropped, so everything is computed as if nothing were cached
+    """
+    def _guarded(self, call, missed, *args, **kwargs):
+        try:
+            return call(*args, **kwargs)
+        except Exception as e:
+            current_app.logger.info("Error while using the cache, carrying on without it")
+            current_app.logger.error(e)
+            return missed
+
+    def get(self, *args, **kwargs):
+        return self._guarded(super().get, None, *args, **kwargs)
+
+    def get_many(self, *keys):
+        return self._guarded(super().get_many, [None] * len(keys), *keys)
+
+    def has(self, *args, **kwargs):
+        return self._guarded(super().has, False, *args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        return self._guarded(super().set, False, *args, **kwargs)
+
+    def add(self, *args, **kwargs):
+        return self._guarded(super().add, False, *args, **kwargs)
+
+    def set_many(self, *args, **kwargs):
+        return self._guarded(super().set_many, [], *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._guarded(super().delete, False, *args, **kwargs)
+
+    def delete_many(self, *args, **kwargs):
+        return self._guarded(super().delete_many, [], *args, **kwargs)
+
+    def clear(self):
+        return self._guarded(super().clear, False)
+
+cache = FallbackCache()
+
+# Cache types that keep entries in each process, so workers never see each other's
+PROCESS_CACHES = ('SimpleCache', 'NullCache', 'flask_caching.backends.SimpleCache', 'flask_caching.backends.NullCache')
+
+def sharedCache(app):
+    """
+    Whether the app's cache is shared between worker processes
+    """
+    return app.config['CACHE_TYPE'] not in PROCESS_CACHES
 
 # Mail
 #config = {'MAIL_DEFAULT_SENDER': 'no-reply@stephaniebeauty.com'}
@@ -0,0 +1,81 @@
+#--------------------------------------------------------------------------------------------------#
+#                                          Versioned Files                                         #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Files on disk that a running app re-reads only when they change, and writes so they never change halfway
+A file's version is its (mtime, size, inode), cheap enough to check on every request; writers publish a
+temp file + rename, which gives the file a new inode even when the mtime and size come out the same
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from flask import current_app
+
+_manifests = {} # path -> (version, manifest), one per manifest file
+_lock = threading.Lock()
+
+
+def fileVersion(path):
+    """
+    Cheap version check for the file on disk, or None if it does not exist
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def fileHash(path):
+    """
+    Hex sha256 of a file's contents
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def writeManifest(path, manifest):
+    """
+    Publish a JSON manifest atomically so a running app never reads half of it
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.manifest-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return
+
+
+def loadManifest(path, name):
+    """
+    A JSON manifest, re-read only when the file changes, or None if it is missing or unreadable
+    'name' says which manifest in the log
+    """
+    version = fileVersion(path)
+    if version is None:
+        return None
+
+    cached = _manifests.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with _lock:
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError) as e:
+            current_app.logger.info("Error while loading the {}".format(name))
+            current_app.logger.error(e)
+            return None
+        _manifests[path] = (version, manifest)
+    return manifest
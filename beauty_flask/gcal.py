@@ -0,0 +1,257 @@
+#--------------------------------------------------------------------------------------------------#
+#                                      Google Calendar Client                                      #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Provide the Google Calendar client to every view from one place
+The discovery document is parsed once per process from the copy bundled with googleapiclient, the
+service-account credentials are loaded once and refreshed before they expire, and built clients
+(each with its own keep-alive connection) are kept in a thread-safe pool and lent out per request
+The client is never put in the (possibly shared, always serializing) cache
+Every request to Google goes through a per-process circuit breaker, so an outage fails fast instead of
+tying up each worker thread for the full timeout
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import google.auth.transport.requests
+import google_auth_httplib2
+import httplib2
+from flask import current_app, g
+from google.oauth2 import service_account
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+
+from . import metrics
+
+SCOPES = ['https://www.googleapis.com/auth/calendar.readonly', 'https://www.googleapis.com/auth/calendar.events']
+SVC_ACCT_FILE = 'beauty-svc-acct.json'
+
+_lock = threading.Lock()
+_state = {'pid': None, 'doc': None, 'creds': None, 'pool': None, 'session': None, 'breaker': None}
+
+
+def _processState():
+    """
+    This process's client state, started afresh in a forked worker so nothing is shared with its parent
+    """
+    if _state['pid'] != os.getpid():
+        with _lock:
+            if _state['pid'] != os.getpid():
+                _state.update(pid=os.getpid(), doc=None, creds=None, session=None, breaker=CircuitBreaker(),
+                              pool=queue.LifoQueue(maxsize=current_app.config['CALENDAR_POOL_SIZE']))
+    return _state
+
+
+def discoveryDocument():
+    """
+    The Calendar v3 discovery document, read and parsed once from the copy bundled with googleapiclient
+    """
+    state = _processState()
+    if state['doc'] is None:
+        state['doc'] = json.loads(discovery_cache.get_static_doc('calendar', 'v3'))
+    return state['doc']
+
+
+def credentials():
+    """
+    The service account's credentials, loaded from the instance folder once per process
+    """
+    state = _processState()
+    if state['creds'] is None:
+        with _lock:
+            if state['creds'] is None:
+                svcAcctFile = os.path.join(current_app.instance_path, SVC_ACCT_FILE)
+                state['creds'] = service_account.Credentials.from_service_account_file(svcAcctFile, scopes = SCOPES)
+    return state['creds']
+
+
+def refreshCredentials(creds):
+    """
+    Refresh the access token if it is missing or expires within CALENDAR_TOKEN_REFRESH_MARGIN seconds,
+    so no calendar request has to stop and wait for a refresh (or race another thread doing one)
+    """
+    margin = timedelta(seconds=current_app.config['CALENDAR_TOKEN_REFRESH_MARGIN'])
+    utcnow = datetime.now(timezone.utc).replace(tzinfo=None) # google-auth keeps expiry as naive UTC
+    if creds.token is not None and creds.expiry is not None and creds.expiry - margin > utcnow:
+        return
+    with _lock:
+        if creds.token is None or creds.expiry is None or creds.expiry - margin <= utcnow:
+            state = _processState()
+            if state['session'] is None:
+                state['session'] = google.auth.transport.requests.Request()
+            creds.refresh(state['session'])
+            current_app.logger.debug("Refreshed calendar credentials")
+    return
+
+
+#----------------------------------------#
+#            Circuit breaker             #
+#----------------------------------------#
+
+class CalendarUnavailable(Exception):
+    """
+    Raised instead of calling Google while the circuit breaker is open
+    """
+    pass
+
+
+class CircuitBreaker:
+    """
+    Fail calendar calls fast once Google has failed CALENDAR_BREAKER_THRESHOLD times in a row
+    After CALENDAR_BREAKER_BACKOFF seconds one call is let through as a probe: if it succeeds the breaker
+    closes, otherwise it stays open for twice as long (up to CALENDAR_BREAKER_MAX_BACKOFF) before the next
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.failures = 0 # in a row
+        self.openUntil = None # monotonic time of the next probe while open, None while closed
+        self.backoff = None
+        self.probing = False
+
+    def allow(self):
+        """
+        Whether a call may go ahead now; while open, the one call let through is the probe
+        """
+        with self.lock:
+            if self.openUntil is None:
+                return True
+            if self.probing or time.monotonic() < self.openUntil:
+                return False
+            self.probing = True
+            return True
+
+    def succeeded(self):
+        with self.lock:
+            if self.openUntil is not None:
+                current_app.logger.info("Calendar circuit breaker closed")
+            self.failures = 0
+            self.openUntil = self.backoff = None
+            self.probing = False
+        return
+
+    def failed(self):
+        config = current_app.config
+        with self.lock:
+            self.failures += 1
+            if self.probing or (self.openUntil is None and self.failures >= config['CALENDAR_BREAKER_THRESHOLD']):
+                if self.backoff is None:
+                    self.backoff = config['CALENDAR_BREAKER_BACKOFF']
+                else:
+                    self.backoff = min(self.backoff * 2, config['CALENDAR_BREAKER_MAX_BACKOFF'])
+                self.openUntil = time.monotonic() + self.backoff
+                self.probing = False
+                current_app.logger.info("Calendar circuit breaker open for {}s after {} failures".format(
+                    self.backoff, self.failures))
+        return
+
+
+def circuitBreaker():
+    """
+    This process's circuit breaker for calls to Google
+    """
+    return _processState()['breaker']
+
+
+def isOutage(e):
+    """
+    Whether an error from a Google call means Google is unavailable, rather than that the call was wrong
+    """
+    if isinstance(e, HttpError):
+        return e.status_code is None or e.status_code >= 500 or e.status_code == 429
+    return True # timeouts, refused or dropped connections
+
+
+class CalendarHttpRequest(HttpRequest):
+    """
+    A Google API request that goes through the circuit breaker and records its latency, and any error,
+    per API method
+    """
+    def execute(self, http=None, num_retries=0):
+        method = self.methodId or 'unknown'
+        breaker = circuitBreaker()
+        if not breaker.allow():
+            metrics.inc('google_api_rejected_total', method=method)
+            raise CalendarUnavailable("Not calling {} while the calendar circuit breaker is open".format(method))
+        with metrics.timer('google_api_seconds', method=method):
+            try:
+                result = super().execute(http=http, num_retries=num_retries)
+            except Exception as e:
+                metrics.inc('google_api_errors_total', method=method)
+                if isOutage(e):
+                    breaker.failed()
+                else:
+                    breaker.succeeded()
+                raise
+        breaker.succeeded()
+        return result
+
+
+#----------------------------------------#
+#                Clients                 #
+#----------------------------------------#
+
+def connectToCalendar(creds=None):
+    """
+    Connect to Google Calendar via the service account
+    Returns the connection Resource service, with its own keep-alive HTTP connection
+    """
+    if creds is None:
+        creds = credentials()
+    http = google_auth_httplib2.AuthorizedHttp(
+        creds, http=httplib2.Http(timeout=current_app.config['CALENDAR_HTTP_TIMEOUT']))
+    return build_from_document(discoveryDocument(), http=http, requestBuilder=CalendarHttpRequest)
+
+
+def getService():
+    """
+    Get a calendar service for the rest of this request, borrowed from the pool or newly connected
+    It goes back to the pool when the app context tears down
+    """
+    service = g.get('calendar_service')
+    if service is None:
+        try:
+            service = _processState()['pool'].get_nowait()
+        except queue.Empty:
+            with metrics.stage('connect'):
+                service = connectToCalendar()
+            current_app.logger.debug("Successfully connected to service")
+        g.calendar_service = service
+    refreshCredentials(credentials())
+    return service
+
+
+def resetService():
+    """
+    Drop this request's calendar service instead of returning it to the pool, e.g. after a broken connection
+    """
+    g.pop('calendar_service', None)
+    return
+
+
+def releaseService(e=None):
+    """
+    Return this request's calendar service to the pool, if one was borrowed
+    """
+    service = g.pop('calendar_service', None)
+    if service is not None:
+        try:
+            _processState()['pool'].put_nowait(service)
+        except queue.Full: # enough idle clients already
+            pass
+    return
+
+
+def init_app(app):
+    """
+    Register these functions with the application instance so they get used
+    """
+    app.teardown_appcontext(releaseService) # lend each request's client back to the pool
+    return
@@ -0,0 +1,211 @@
+#--------------------------------------------------------------------------------------------------#
+#                                        Responsive Images                                         #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Build resized WebP and JPEG (PNG for transparent images) copies of the gallery images, and emit
+<picture> markup that lets the browser pick the smallest copy that fits
+`flask build-images` writes the copies under static/images/derived with content-hashed names, plus a
+manifest; only sources whose contents (or the width/quality settings) changed are processed again,
+across a pool of worker processes. Templates call responsive_image(), which falls back to the original
+file for anything not in the manifest
+"""
+
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import click
+from flask import current_app, url_for
+from flask.cli import with_appcontext
+from markupsafe import Markup, escape
+
+from .files import fileHash, loadManifest, writeManifest
+
+SOURCE_DIR = 'images' # relative to the static folder
+DERIVED_DIR = 'images/derived'
+MANIFEST_FILE = 'manifest.json'
+SOURCE_EXTS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+#----------------------------------------#
+#            Building copies             #
+#----------------------------------------#
+
+def targetWidths(width, widths):
+    """
+    The widths to build for an image 'width' pixels wide: never upscale, but always include one copy
+    """
+    targets = sorted(w for w in set(widths) if w < width)
+    if not targets or max(widths) >= width:
+        targets.append(width)
+    return targets
+
+
+def renderImage(source, name, derivedDir, widths, quality):
+    """
+    Write every resized copy of one source image and return its manifest entry
+    Runs in a worker process, so it only takes and returns plain data
+    """
+    from PIL import Image, ImageOps
+
+    stem = os.path.splitext(os.path.basename(name))[0]
+    with Image.open(source) as img:
+        img = ImageOps.exif_transpose(img) # phone photos are often stored sideways
+        alpha = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+        img = img.convert('RGBA' if alpha else 'RGB')
+        fallback = 'png' if alpha else 'jpeg'
+        entry = {'width': img.width, 'height': img.height, 'fallback': fallback,
+                 'srcset': {'webp': [], fallback: []}}
+
+        for w in targetWidths(img.width, widths):
+            h = max(1, round(img.height * w / img.width))
+            resized = img if w == img.width else img.resize((w, h), Image.LANCZOS)
+            for fmt in ('webp', fallback):
+                buf = io.BytesIO()
+                if fmt == 'png':
+                    resized.save(buf, 'PNG', optimize=True)
+                else:
+                    resized.save(buf, fmt.upper(), quality=quality, optimize=True, **(
+                        {'method': 6} if fmt == 'webp' else {'progressive': True}))
+                data = buf.getvalue()
+                ext = 'jpg' if fmt == 'jpeg' else fmt
+                filename = '{}-{}.{}.{}'.format(stem, w, hashlib.sha256(data).hexdigest()[:10], ext)
+                path = os.path.join(derivedDir, filename)
+                if not os.path.exists(path): # same name means same bytes, so an existing copy is fine
+                    with open(path, 'wb') as f:
+                        f.write(data)
+                entry['srcset'][fmt].append([w, '{}/{}'.format(DERIVED_DIR, filename)])
+    return entry
+
+
+def buildImages(staticFolder, widths, quality, jobs=None, force=False, prune=True):
+    """
+    Bring the derived copies and manifest in line with static/images
+    Returns (built, kept, removed): names processed, names left as they were, stale files deleted
+    """
+    sourceDir = os.path.join(staticFolder, SOURCE_DIR)
+    derivedDir = os.path.join(staticFolder, DERIVED_DIR)
+    manifestPath = os.path.join(derivedDir, MANIFEST_FILE)
+    os.makedirs(derivedDir, exist_ok=True)
+
+    try:
+        with open(manifestPath) as f:
+            old = json.load(f)
+    except (FileNotFoundError, ValueError):
+        old = {}
+
+    settings = {'widths': sorted(widths), 'quality': quality}
+    manifest, todo = {}, {}
+    for filename in sorted(os.listdir(sourceDir)):
+        source = os.path.join(sourceDir, filename)
+        if not filename.lower().endswith(SOURCE_EXTS) or not os.path.isfile(source):
+            continue
+        name = '{}/{}'.format(SOURCE_DIR, filename)
+        digest = fileHash(source)
+        entry = old.get(name)
+        if (not force and entry and entry.get('hash') == digest and entry.get('settings') == settings
+                and all(os.path.exists(os.path.join(staticFolder, path))
+                        for srcset in entry['srcset'].values() for _, path in srcset)):
+            manifest[name] = entry
+        else:
+            todo[name] = (source, digest)
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(renderImage, source, name, derivedDir, widths, quality): (name, digest)
+                       for name, (source, digest) in todo.items()}
+            for future in as_completed(futures):
+                name, digest = futures[future]
+                entry = future.result()
+                entry.update(hash=digest, settings=settings)
+                manifest[name] = entry
+
+    removed = []
+    if prune:
+        wanted = {os.path.basename(path) for entry in manifest.values()
+                  for srcset in entry['srcset'].values() for _, path in srcset}
+        for filename in os.listdir(derivedDir):
+            if filename != MANIFEST_FILE and not filename.startswith('.') and filename not in wanted:
+                os.remove(os.path.join(derivedDir, filename))
+                removed.append(filename)
+
+    if todo or removed or manifest != old:
+        writeManifest(manifestPath, manifest)
+    return sorted(todo), sorted(set(manifest) - set(todo)), sorted(removed)
+
+
+# define a command line command 'build-images' to (re)build the resized copies, e.g. when deploying
+@click.command('build-images')
+@click.option('--jobs', '-j', type=int, default=None, help='Worker processes (default: one per CPU).')
+@click.option('--force', is_flag=True, help='Rebuild every image, even if unchanged.')
+@click.option('--no-prune', is_flag=True, help='Keep derived files no longer in the manifest.')
+@with_appcontext
+def build_images_command(jobs, force, no_prune):
+    """
+    Build resized WebP/JPEG copies of the images in static/images
+    """
+    try:
+        import PIL # noqa: F401  only needed to build, not to serve
+    except ImportError:
+        raise click.ClickException('Building images needs Pillow: pip install Pillow')
+
+    built, kept, removed = buildImages(current_app.static_folder, current_app.config['IMAGE_WIDTHS'],
+                                       current_app.config['IMAGE_QUALITY'], jobs=jobs, force=force,
+                                       prune=not no_prune)
+    for name in built:
+        click.echo('Built {}'.format(name))
+    click.echo('Built {} images, {} unchanged, removed {} stale files.'.format(len(built), len(kept), len(removed)))
+    return
+
+
+#----------------------------------------#
+#             Serving copies             #
+#----------------------------------------#
+
+def getManifest():
+    """
+    The derived image manifest for the current app, re-read only when the file changes
+    """
+    path = os.path.join(current_app.static_folder, DERIVED_DIR, MANIFEST_FILE)
+    return loadManifest(path, "image manifest") or {}
+
+
+def _srcset(srcset):
+    """
+    Format [[width, path], ...] as an HTML srcset attribute value
+    """
+    return ', '.join('{} {}w'.format(url_for('static', filename=path), w) for w, path in srcset)
+
+
+def responsive_image(filename, alt='', sizes='100vw', lazy=True, **attrs):
+    """
+    Markup for a static image that lets the browser choose the best derived copy
+    'sizes' describes how wide the image is displayed; pass lazy=False for images visible on load
+    Other keyword arguments become attributes of the <img> ('class_' for class)
+    """
+    attrs = {k.rstrip('_').replace('_', '-'): v for k, v in attrs.items()}
+    attrs['alt'] = alt
+    attrs.setdefault('decoding', 'async')
+    if lazy:
+        attrs.setdefault('loading', 'lazy')
+
+    entry = getManifest().get(filename)
+    if entry is None: # not built yet: serve the original
+        attrs['src'] = url_for('static', filename=filename)
+        return Markup('<img {}>'.format(_attributes(attrs)))
+
+    fallback = entry['srcset'][entry['fallback']]
+    attrs.update(src=url_for('static', filename=fallback[-1][1]), srcset=_srcset(fallback), sizes=sizes,
+                 width=entry['width'], height=entry['height'])
+    return Markup('<picture><source type="image/webp" srcset="{}" sizes="{}"><img {}></picture>'.format(
+        escape(_srcset(entry['srcset']['webp'])), escape(sizes), _attributes(attrs)))
+
+
+def _attributes(attrs):
+    """
+    Format a dict as escaped HTML attributes
+    """
+    return ' '.join('{}="{}"'.format(k, escape(v)) for k, v in attrs.items())
@@ -0,0 +1,49 @@
+#--------------------------------------------------------------------------------------------------#
+#                                              Leases                                              #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Named, expiring leases in the database, so only one worker process at a time does a shared job
+A lease is held by one holder until it is released or its TTL passes without a renewal, after which any
+other worker may take it over; the holder renews it by acquiring it again
+"""
+
+import os
+import socket
+import time
+
+from .db import get_db
+
+
+def holder():
+    """
+    This process's holder name
+    """
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def acquire(name, ttl, who=None):
+    """
+    Take or renew the lease 'name' for ttl seconds
+    Returns whether it is now held by 'who' (this process by default)
+    """
+    who = who or holder()
+    now = int(time.time())
+    db = get_db()
+    with db:
+        cur = db.execute(
+            'INSERT INTO lease (name, holder, expires) VALUES (?, ?, ?)'
+            ' ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires = excluded.expires'
+            ' WHERE lease.holder = excluded.holder OR lease.expires <= ?',
+            (name, who, now + int(ttl), now))
+    return cur.rowcount == 1
+
+
+def release(name, who=None):
+    """
+    Give up the lease 'name' if 'who' (this process by default) holds it
+    """
+    db = get_db()
+    with db:
+        db.execute('DELETE FROM lease WHERE name = ? AND holder = ?', (name, who or holder()))
+    return
@@ -0,0 +1,120 @@
+#--------------------------------------------------------------------------------------------------#
+#                                        Appointment Ledger                                        #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Record every appointment booked through the site in the database
+Looking up, cancelling and rescheduling an appointment read the ledger instead of calling Google first;
+the ledger is reconciled with the calendar in the background when an entry has not been checked lately
+"""
+
+import queue
+import threading
+import time
+
+from flask import current_app
+
+from .db import get_db
+from . import gcal
+
+_jobs = queue.Queue() # (app, calendarId, apptID) waiting to be reconciled
+_pending = set() # apptIDs already queued, so a busy booking link doesn't queue duplicates
+_workerLock = threading.Lock()
+_worker = {'thread': None}
+
+
+def recordAppointment(event, tzName=None, clientName=None, clientEmail=None, calendarId=None):
+    """
+    Insert or update the ledger entry for a calendar event resource just returned by Google
+    Client details, timezone and calendar are kept from the existing entry when not given
+    """
+    status = 'cancelled' if event.get('status') == 'cancelled' else 'booked'
+    db = get_db()
+    with db:
+        db.execute(
+            'INSERT INTO appointment (id, start_time, end_time, tz_name, calendar_id, client_name, client_email,'
+            ' status, etag, updated, synced_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+            ' ON CONFLICT (id) DO UPDATE SET start_time = excluded.start_time, end_time = excluded.end_time,'
+            ' tz_name = COALESCE(excluded.tz_name, tz_name),'
+            ' calendar_id = COALESCE(excluded.calendar_id, calendar_id),'
+            ' client_name = COALESCE(excluded.client_name, client_name),'
+            ' client_email = COALESCE(excluded.client_email, client_email),'
+            ' status = excluded.status, etag = excluded.etag, updated = excluded.updated,'
+            ' synced_at = excluded.synced_at',
+            (event['id'], event['start']['dateTime'], event['end']['dateTime'],
+             tzName or event['start'].get('timeZone'), calendarId, clientName, clientEmail, status,
+             event.get('etag'), event.get('updated'), int(time.time()))
+        )
+    return
+
+
+def getAppointment(apptID):
+    """
+    The ledger entry for an appointment, or None if it was not booked through the site
+    """
+    return get_db().execute('SELECT * FROM appointment WHERE id = ?', (apptID,)).fetchone()
+
+
+def markCancelled(apptID):
+    """
+    Record that an appointment has been cancelled
+    """
+    db = get_db()
+    with db:
+        db.execute("UPDATE appointment SET status = 'cancelled', synced_at = ? WHERE id = ?",
+                   (int(time.time()), apptID))
+    return
+
+
+def reconcile(calendarId, apptID):
+    """
+    Bring one ledger entry in line with the calendar, e.g. after the event was moved in Google Calendar
+    """
+    try:
+        event = gcal.getService().events().get(calendarId=calendarId, eventId=apptID).execute()
+    except Exception as e:
+        if getattr(e, 'status_code', None) in (404, 410): # deleted from the calendar
+            markCancelled(apptID)
+            return
+        raise
+    recordAppointment(event, calendarId=calendarId)
+    return
+
+
+def _work():
+    """
+    Worker thread loop: reconcile queued appointments one at a time
+    """
+    while True:
+        app, calendarId, apptID = _jobs.get()
+        with app.app_context():
+            try:
+                reconcile(calendarId, apptID)
+            except Exception as e:
+                app.logger.info("Error while reconciling appointment {}".format(apptID))
+                app.logger.error(e)
+        with _workerLock:
+            _pending.discard(apptID)
+    return
+
+
+def reconcileLater(calendarId, apptID):
+    """
+    Queue a background check of this appointment against the calendar
+    """
+    with _workerLock:
+        if apptID in _pending:
+            return
+        _pending.add(apptID)
+        if _worker['thread'] is None or not _worker['thread'].is_alive():
+            _worker['thread'] = threading.Thread(target=_work, name='ledger', daemon=True)
+            _worker['thread'].start()
+    _jobs.put((current_app._get_current_object(), calendarId, apptID))
+    return
+
+
+def isStale(row):
+    """
+    Whether a ledger entry is due a background check against the calendar
+    """
+    return time.time() - row['synced_at'] > current_app.config['LEDGER_RECONCILE_AFTER']
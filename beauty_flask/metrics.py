@@ -0,0 +1,200 @@
+#--------------------------------------------------------------------------------------------------#
+#                                             Metrics                                              #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Time the hot paths and count cache lookups, aggregated into histograms and counters per process
+Stages of serving openings and bookings, every Google API call (by method), SMTP sends and SQLite
+statements are timed; cache lookups are counted per key family. The admin '/admin/metrics' view serves
+them in the Prometheus text format, and with METRICS_SERVER_TIMING (on by default in debug) each response
+gets a Server-Timing header summing its own timings
+Each worker process keeps its own numbers, so a scrape sees the worker that answered it
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context
+
+PREFIX = 'beauty_'
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) # seconds
+
+# name -> (type, help)
+METRICS = {
+    'stage_seconds': ('histogram', 'Time spent in each stage of serving openings and bookings.'),
+    'google_api_seconds': ('histogram', 'Google API call latency by method.'),
+    'google_api_errors_total': ('counter', 'Google API calls that raised, by method.'),
+    'google_api_rejected_total': ('counter', 'Google API calls failed fast by the open circuit breaker, by method.'),
+    'cache_requests_total': ('counter', 'Cache lookups by key family and result.'),
+    'coalesced_total': ('counter', 'Cache misses served by waiting for a computation already running, by scope.'),
+    'smtp_seconds': ('histogram', 'SMTP connection and send latency.'),
+    'db_query_seconds': ('histogram', 'SQLite statement execution time by statement type.'),
+}
+
+_lock = threading.Lock()
+_histograms = {} # (name, labels) -> [bucket counts..., sum, count]
+_counters = {} # (name, labels) -> value
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _timingKey(name, labels):
+    """
+    The Server-Timing entry a timing adds to, e.g. 'events', 'google.calendar.events.list' or 'db'
+    """
+    if 'stage' in labels:
+        return labels['stage']
+    key = name.split('_')[0]
+    if 'method' in labels:
+        key += '.' + labels['method']
+    return key
+
+
+def observe(name, seconds, **labels):
+    """
+    Record one timing in the histogram 'name'
+    """
+    key = (name, _labels(labels))
+    i = bisect_left(BUCKETS, seconds)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        histogram[i] += 1 # counts per bucket (the last bucket is +Inf); made cumulative when rendered
+        histogram[-2] += seconds
+        histogram[-1] += 1
+    if has_request_context():
+        timings = g.get('_serverTiming')
+        if timings is not None:
+            timingKey = _timingKey(name, labels)
+            timings[timingKey] = timings.get(timingKey, 0.0) + seconds
+    return
+
+
+def inc(name, amount=1, **labels):
+    """
+    Add to the counter 'name'
+    """
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+    return
+
+
+@contextmanager
+def timer(name, **labels):
+    """
+    Time the with block (or, used as a decorator, each call) into the histogram 'name'
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def stage(stageName):
+    """
+    Time the with block or decorated function as a stage of serving a request
+    """
+    return timer('stage_seconds', stage=stageName)
+
+
+def cacheLookup(family, hits=0, misses=0):
+    """
+    Count cache lookups for a key family, e.g. 'openings', 'page' or 'session'
+    """
+    if hits:
+        inc('cache_requests_total', hits, family=family, result='hit')
+    if misses:
+        inc('cache_requests_total', misses, family=family, result='miss')
+    return
+
+
+#----------------------------------------#
+#                Exposing                #
+#----------------------------------------#
+
+def _formatLabels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs) + '}'
+
+
+def render():
+    """
+    Every metric in the Prometheus text exposition format
+    """
+    with _lock:
+        histograms = {key: list(values) for key, values in _histograms.items()}
+        counters = dict(_counters)
+
+    lines = []
+    for name, (kind, help) in METRICS.items():
+        full = PREFIX + name
+        lines.append('# HELP {} {}'.format(full, help))
+        lines.append('# TYPE {} {}'.format(full, kind))
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append('{}{} {}'.format(full, _formatLabels(labels), value))
+            continue
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for le, count in zip(BUCKETS + ('+Inf',), values[:-2]):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(full, _formatLabels(labels, [('le', le)]), cumulative))
+            lines.append('{}_sum{} {}'.format(full, _formatLabels(labels), repr(values[-2])))
+            lines.append('{}_count{} {}'.format(full, _formatLabels(labels), values[-1]))
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """
+    Forget everything recorded so far
+    """
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+    return
+
+
+def _serverTimingOn(app):
+    setting = app.config['METRICS_SERVER_TIMING']
+    return app.debug if setting is None else setting
+
+
+def startServerTiming():
+    """
+    before_request: collect this request's timings if it will get a Server-Timing header
+    """
+    if _serverTimingOn(current_app):
+        g._serverTiming = {}
+    return
+
+
+def addServerTiming(response):
+    """
+    after_request: sum up this request's timings in a Server-Timing header
+    """
+    timings = g.get('_serverTiming')
+    if timings:
+        response.headers['Server-Timing'] = ', '.join(
+            '{};dur={:.2f}'.format(key, seconds * 1000) for key, seconds in timings.items())
+    return response
+
+
+def init_app(app):
+    """
+    Register these functions with the application instance so they get used
+    """
+    app.before_request(startServerTiming)
+    app.after_request(addServerTiming)
+    return
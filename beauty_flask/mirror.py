@@ -0,0 +1,198 @@
+#--------------------------------------------------------------------------------------------------#
+#                                      Calendar Event Mirror                                       #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Mirror a Google Calendar's events into the app's SQLite database
+The mirror is filled once with a full listing, then kept current with syncToken-based incremental
+listings that only return changed or deleted events, so refreshing it costs a tiny delta request
+Listings ask only for the fields that place an event in time; all-day events are mirrored as whole days
+in the calendar's timezone, and events marked "free" are left out
+"""
+
+import time
+from datetime import datetime, timedelta, timezone
+
+from dateutil import tz
+from flask import current_app
+from googleapiclient.errors import HttpError
+
+from .busytime import SYNC_FIELDS, eventSpan
+from .db import get_db
+
+
+def _eventRow(e, tzInfo=None):
+    """
+    The (start, end) ISO strings of a calendar event resource, or None if it takes up no time
+    All-day events need the calendar's tzInfo; without it they are left out
+    """
+    span = eventSpan(e, tzInfo)
+    if span is None:
+        return None
+    return tuple(t if isinstance(t, str) else t.isoformat() for t in span)
+
+
+def _listAll(service, **kwargs):
+    """
+    Page through events().list with the given arguments, asking only for the fields the mirror keeps
+    Returns all event resources, the nextSyncToken from the final page and the calendar's tzinfo
+    """
+    items = []
+    pageToken = None
+    while True:
+        result = service.events().list(pageToken=pageToken, fields=SYNC_FIELDS, **kwargs).execute()
+        items += result.get('items', [])
+        pageToken = result.get('nextPageToken')
+        if pageToken is None:
+            tzName = result.get('timeZone')
+            return items, result.get('nextSyncToken'), tz.gettz(tzName) if tzName else None
+
+
+def _store(db, calendarId, e, tzInfo=None):
+    """
+    Insert, update or (for cancelled or free events) delete one event in the mirror
+    Returns the (start, end) spans touched: the old times of a changed event and its new times
+    """
+    touched = [(row['start_time'], row['end_time']) for row in db.execute(
+        'SELECT start_time, end_time FROM event WHERE calendar_id = ? AND id = ?', (calendarId, e['id'])
+    )]
+    times = _eventRow(e, tzInfo)
+    if times is None:
+        db.execute('DELETE FROM event WHERE calendar_id = ? AND id = ?', (calendarId, e['id']))
+        return touched
+
+    start, end = times
+    db.execute(
+        'INSERT OR REPLACE INTO event (id, calendar_id, start_time, end_time, start_ts, end_ts)'
+        ' VALUES (?, ?, ?, ?, ?, ?)',
+        (e['id'], calendarId, start, end,
+         int(datetime.fromisoformat(start).timestamp()), int(datetime.fromisoformat(end).timestamp()))
+    )
+    touched.append(times)
+    return touched
+
+
+def fullSync(service, calendarId):
+    """
+    Replace the mirror for this calendar with a full listing from yesterday onwards
+    Returns the (start, end) spans of every mirrored event
+    """
+    timeMin = (datetime.now(timezone.utc) - timedelta(days=1)).isoformat()
+    items, syncToken, tzInfo = _listAll(service, calendarId=calendarId, singleEvents=True, timeMin=timeMin)
+
+    db = get_db()
+    touched = []
+    with db: # one transaction, so readers never see a half-built mirror
+        db.execute('DELETE FROM event WHERE calendar_id = ?', (calendarId,))
+        for e in items:
+            touched += _store(db, calendarId, e, tzInfo)
+        db.execute('INSERT OR REPLACE INTO calendar_sync (calendar_id, sync_token, synced_at) VALUES (?, ?, ?)',
+                   (calendarId, syncToken, int(time.time())))
+    current_app.logger.debug("Full sync of calendar mirror: {} events".format(len(items)))
+    return touched
+
+
+def syncCalendar(service, calendarId):
+    """
+    Bring the mirror up to date with an incremental listing, or a full one if there is no valid sync token
+    Returns the (start, end) spans of events that changed, including where changed events used to be
+    """
+    db = get_db()
+    row = db.execute('SELECT sync_token FROM calendar_sync WHERE calendar_id = ?', (calendarId,)).fetchone()
+    if row is None or row['sync_token'] is None:
+        return fullSync(service, calendarId)
+
+    try:
+        items, syncToken, tzInfo = _listAll(service, calendarId=calendarId, singleEvents=True,
+                                            syncToken=row['sync_token'])
+    except HttpError as e:
+        if e.status_code == 410: # sync token expired; start over
+            current_app.logger.info("Calendar sync token expired, doing a full sync")
+            return fullSync(service, calendarId)
+        raise
+
+    touched = []
+    with db:
+        for e in items:
+            touched += _store(db, calendarId, e, tzInfo)
+        db.execute('UPDATE calendar_sync SET sync_token = ?, synced_at = ? WHERE calendar_id = ?',
+                   (syncToken, int(time.time()), calendarId))
+    current_app.logger.debug("Incremental sync of calendar mirror: {} changes".format(len(items)))
+    return touched
+
+
+def recordEvent(calendarId, event):
+    """
+    Apply an event this app just inserted or updated to the mirror without waiting for the next sync
+    Returns the (start, end) spans touched, as syncCalendar does
+    """
+    db = get_db()
+    with db:
+        return _store(db, calendarId, event)
+
+
+def forgetEvent(calendarId, eventId):
+    """
+    Remove an event this app just deleted from the mirror
+    Returns the (start, end) span it used to occupy, if it was mirrored
+    """
+    return recordEvent(calendarId, {'id': eventId, 'status': 'cancelled'})
+
+
+def lastSynced(calendarId):
+    """
+    Unix time of the last successful sync of this calendar, or None if it has never been mirrored
+    """
+    row = get_db().execute('SELECT synced_at FROM calendar_sync WHERE calendar_id = ?', (calendarId,)).fetchone()
+    return None if row is None else row['synced_at']
+
+
+def isDue(calendarId):
+    """
+    Whether this calendar's mirror is older than CALENDAR_MIRROR_REFRESH seconds (or was never filled)
+    """
+    synced = lastSynced(calendarId)
+    return synced is None or time.time() - synced >= current_app.config['CALENDAR_MIRROR_REFRESH']
+
+
+def refreshMirror(service, calendarId):
+    """
+    Sync the mirror if it is older than CALENDAR_MIRROR_REFRESH seconds
+    If the sync fails but the mirror has been filled before, keep serving the mirror as it is
+    """
+    if not isDue(calendarId):
+        return
+    synced = lastSynced(calendarId)
+    try:
+        syncCalendar(service, calendarId)
+    except Exception as e:
+        if synced is None: # nothing to fall back on
+            raise
+        current_app.logger.info("Error while syncing the calendar mirror, using the last synced events")
+        current_app.logger.error(e)
+    return
+
+
+def getMirroredEvents(calendarId, start, end):
+    """
+    Get mirrored events overlapping the provided start and end datetimes
+    Returns as a list of tuples of (startTime, endTime), like site.getEventsForRange
+    """
+    return getMirroredEventsMany([calendarId], start, end)[calendarId]
+
+
+def getMirroredEventsMany(calendarIds, start, end):
+    """
+    Get mirrored events of several calendars overlapping the provided start and end datetimes, in one query
+    Returns {calendarId: [(startTime, endTime), ...]}
+    """
+    events = {calendarId: [] for calendarId in calendarIds}
+    rows = get_db().execute(
+        'SELECT calendar_id, start_time, end_time FROM event'
+        ' WHERE calendar_id IN ({}) AND start_ts < ? AND end_ts > ? ORDER BY start_ts'.format(
+            ','.join('?' * len(events))),
+        list(events) + [int(end.timestamp()) + 1, int(start.timestamp())]
+    )
+    for row in rows:
+        events[row['calendar_id']].append((row['start_time'], row['end_time']))
+    return events
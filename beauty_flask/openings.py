@@ -0,0 +1,185 @@
+#--------------------------------------------------------------------------------------------------#
+#                                         Openings Engine                                          #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Find a week's openings in one pass over the calendar's busy time
+Events become sorted, merged busy intervals in integer minutes, availability is a slot grid bitmask per
+day, and each day's busy blocks are taken out of it with a single merge sweep, leaving the free blocks
+where a session of the requested length fits
+With several artists each is found on their own calendar, and "any artist" openings are the union of
+theirs, ORed per day through the grid's label index, so merging stays linear in the openings merged
+"""
+
+import bisect
+import heapq
+import math
+from datetime import datetime, timedelta
+
+from . import slotgrid
+
+# Constants for calculating datetimes
+DAYS = ('Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat')
+
+
+def toMinutes(dt):
+    """
+    Absolute minutes since the epoch, rounded down, for an aware datetime
+    """
+    return math.floor(dt.timestamp() / 60)
+
+
+def busyIntervals(events):
+    """
+    Turn (start, end) events, as ISO strings or aware datetimes, into sorted, merged busy intervals
+    Returns a list of [startMinute, endMinute) pairs in absolute minutes since the epoch
+    Starts round down and ends round up, so comparisons against whole-minute slots stay exact
+    """
+    intervals = []
+    for eStart, eEnd in events:
+        if isinstance(eStart, str):
+            eStart = datetime.fromisoformat(eStart)
+        if isinstance(eEnd, str):
+            eEnd = datetime.fromisoformat(eEnd)
+        intervals.append((toMinutes(eStart), math.ceil(eEnd.timestamp() / 60)))
+    intervals.sort()
+
+    merged = []
+    for s, e in intervals:
+        if merged and s <= merged[-1][1]: # overlaps or touches the previous interval
+            if e > merged[-1][1]:
+                merged[-1][1] = e
+        else:
+            merged.append([s, e])
+    return merged
+
+
+def mergeIntervals(*lists):
+    """
+    Merge already sorted and merged lists of [startMinute, endMinute) intervals into one, in a single pass
+    """
+    merged = []
+    for s, e in heapq.merge(*lists):
+        if merged and s <= merged[-1][1]:
+            if e > merged[-1][1]:
+                merged[-1][1] = e
+        else:
+            merged.append([s, e])
+    return merged
+
+
+def offSchedule(masks, grid, tzInfo, start, end):
+    """
+    The time from start to end outside a weekly schedule kept in tzInfo's wall clock, as busy intervals
+    masks are the schedule's 7 day bitmasks on the grid; this lets the schedule of an artist in another
+    timezone be taken out of openings computed in the calendar's timezone
+    """
+    intervals = []
+    free = toMinutes(start) # start of the time not yet known to be worked
+    currDate = start.astimezone(tzInfo).date() - timedelta(days=1) # a day that starts west of start
+    lastDate = end.astimezone(tzInfo).date()
+    while currDate <= lastDate:
+        mask = masks[int(currDate.strftime('%w'))]
+        first = dayOrigin(currDate, tzInfo) + grid.start
+        k = 0
+        while mask: # each run of worked blocks
+            low = (mask & -mask).bit_length() - 1
+            run = ((mask >> low) ^ ((mask >> low) + 1)).bit_length() - 1
+            workStart, workEnd = first + (k + low) * grid.step, first + (k + low + run) * grid.step
+            if workStart > free:
+                intervals.append([free, workStart])
+            free = max(free, workEnd)
+            mask >>= low + run
+            k += low + run
+        currDate += timedelta(days=1)
+    if free <= toMinutes(end):
+        intervals.append([free, toMinutes(end) + 1])
+    return intervals
+
+
+def mergeOpenings(grid, weeksOpenings):
+    """
+    The union of several {'day': ['hhmm', ...]} openings, e.g. every artist's for "any artist"
+    Each day's labels are ORed into one grid mask, so the work is linear in the labels merged
+    """
+    merged = {}
+    for openings in weeksOpenings:
+        for d, labels in openings.items():
+            merged[d] = merged.get(d, 0) | slotgrid.labelsMask(grid, labels)
+    return {d: slotgrid.maskLabels(grid, mask) for d, mask in merged.items()}
+
+
+def pickOpenings(grid, byArtist, artistID=None):
+    """
+    From {artistID: openings}, one artist's openings, or with artistID None those of any artist
+    """
+    if artistID is None:
+        if len(byArtist) == 1: # nothing to merge
+            return next(iter(byArtist.values()))
+        return mergeOpenings(grid, byArtist.values())
+    return byArtist.get(artistID, {})
+
+
+def weekInfo(baseDateTime):
+    """
+    The week's basic information around baseDateTime
+    Returns {'day': ['Mon', 'dd', 'yyyy']} e.g. {'Sun': ['May', '09', '2021'], ...}
+    """
+    baseDate = baseDateTime.date()
+    sunday = baseDate - timedelta(days=int(baseDate.strftime('%w')))
+    week = {}
+    for i, d in enumerate(DAYS):
+        week[d] = (sunday + timedelta(days=i)).strftime('%b %d %Y').split()
+    return week
+
+
+def dayOrigin(currDate, tzInfo):
+    """
+    Absolute minute of midnight (wall clock) for the given date in tzInfo
+    The UTC offset is taken at noon so a DST switch in the small hours does not shift the timeblocks
+    """
+    noon = datetime(currDate.year, currDate.month, currDate.day, 12, 00, 00, 000000, tzInfo)
+    return toMinutes(noon) - 12*60
+
+
+def findOpenings(baseDateTime, masks, busy, grid, duration):
+    """
+    From baseDateTime through the end of its week, find every start on the grid where a session of
+    'duration' minutes lies within available time and does not overlap a busy interval
+    masks is a tuple of 7 day bitmasks on the grid; busy is the merged list from busyIntervals
+    Returns {'day': ['hhmm', ...]} for each remaining day of the week
+    """
+    tzInfo = baseDateTime.tzinfo
+    baseMinutes = baseDateTime.timestamp() / 60
+    baseDateTimew = int(baseDateTime.strftime('%w'))
+    blocks = grid.blocks(duration)
+    span = grid.size * grid.step
+
+    openings = {}
+    # sweep position in busy, starting at the last interval that begins before baseDateTime
+    # days are visited in increasing time so it only moves forward
+    j = max(bisect.bisect_right(busy, [toMinutes(baseDateTime)]) - 1, 0)
+    nBusy = len(busy)
+    for i in range(baseDateTimew, 7): # from baseDateTime through the end of the week
+        currDate = (baseDateTime + timedelta(days=i-baseDateTimew)).date()
+        mask = masks[i]
+        if not mask: # nothing available this day
+            openings[DAYS[i]] = []
+            continue
+        first = dayOrigin(currDate, tzInfo) + grid.start # absolute minute of the day's first block
+
+        ## take out the blocks overlapping busy time
+        while j < nBusy and busy[j][1] <= first: # busy time entirely before this day
+            j += 1
+        k = j
+        while k < nBusy and busy[k][0] < first + span:
+            mask &= ~slotgrid.spanMask(grid, busy[k][0] - first, busy[k][1] - first)
+            k += 1
+
+        starts = slotgrid.fits(mask, blocks)
+        if baseMinutes >= first: # drop starts in the past
+            past = min(math.floor((baseMinutes - first) / grid.step) + 1, grid.size)
+            starts &= ~((1 << past) - 1)
+        openings[DAYS[i]] = slotgrid.maskLabels(grid, starts) # we have openings!
+
+    return openings
@@ -0,0 +1,220 @@
+#--------------------------------------------------------------------------------------------------#
+#                                           Email Outbox                                           #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Queue outgoing emails in the database and deliver them in the background
+Views only write a row, so their response never waits on an SMTP handshake; a worker thread (or the
+`flask send-mail` command) drains the outbox over one SMTP connection per batch, retrying with backoff
+"""
+
+import atexit
+import json
+import smtplib
+import threading
+import time
+from contextlib import ExitStack
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flask_mail import Message
+
+from .db import get_db
+from .extensions import mail
+from . import metrics
+
+_started = [] # every Worker started in this process, to stop at exit
+_startedLock = threading.Lock()
+
+
+class Worker:
+    """
+    An app's delivery thread and the events controlling it, kept in app.extensions['outbox'] so stopping
+    or waking one app's worker leaves any other app's alone
+    """
+    def __init__(self):
+        self.thread = None
+        self.wake = threading.Event() # set to deliver straight away instead of at the next poll
+        self.stop = threading.Event()
+
+
+def enqueue(msg):
+    """
+    Write a flask_mail Message to the outbox and wake the delivery worker
+    """
+    now = int(time.time())
+    db = get_db()
+    with db:
+        db.execute(
+            'INSERT INTO outbox (subject, sender, recipients, html, next_attempt, created)'
+            ' VALUES (?, ?, ?, ?, ?, ?)',
+            (msg.subject, msg.sender, json.dumps(msg.recipients), msg.html, now, now)
+        )
+    if current_app.config['MAIL_OUTBOX_WORKER']:
+        startWorker(current_app._get_current_object()).wake.set()
+    return
+
+
+def _claim(db, limit):
+    """
+    Claim up to 'limit' due emails for this worker so no other worker sends them too
+    Emails left 'sending' by a worker that died are claimed again once they are stale
+    """
+    now = int(time.time())
+    stale = now - current_app.config['MAIL_OUTBOX_CLAIM_TIMEOUT']
+    with db:
+        db.execute('BEGIN IMMEDIATE') # serialize claims between processes
+        rows = db.execute(
+            "SELECT * FROM outbox WHERE (status = 'pending' AND next_attempt <= ?)"
+            " OR (status = 'sending' AND next_attempt <= ?) ORDER BY id LIMIT ?",
+            (now, stale, limit)
+        ).fetchall()
+        db.executemany("UPDATE outbox SET status = 'sending', next_attempt = ? WHERE id = ?",
+                       [(now, row['id']) for row in rows])
+    return rows
+
+
+def _failed(db, row, error):
+    """
+    Schedule a retry with exponential backoff, or give up after MAIL_OUTBOX_MAX_ATTEMPTS
+    """
+    attempts = row['attempts'] + 1
+    if attempts >= current_app.config['MAIL_OUTBOX_MAX_ATTEMPTS']:
+        status, nextAttempt = 'failed', 0
+        current_app.logger.error("Giving up on outbox email {}: {}".format(row['id'], error))
+    else:
+        status = 'pending'
+        nextAttempt = int(time.time()) + current_app.config['MAIL_OUTBOX_BACKOFF'] * 2 ** (attempts - 1)
+    with db:
+        db.execute('UPDATE outbox SET status = ?, attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?',
+                   (status, attempts, nextAttempt, str(error), row['id']))
+    return
+
+
+def deliverPending():
+    """
+    Send one batch of due emails over a single SMTP connection
+    Returns the number of emails sent
+    """
+    db = get_db()
+    rows = _claim(db, current_app.config['MAIL_OUTBOX_BATCH'])
+    if not rows:
+        return 0
+
+    sent = 0
+    try:
+        with ExitStack() as stack:
+            with metrics.timer('smtp_seconds', op='connect'):
+                conn = stack.enter_context(mail.connect())
+            for i, row in enumerate(rows):
+                msg = Message(row['subject'], recipients=json.loads(row['recipients']),
+                              html=row['html'], sender=row['sender'])
+                try:
+                    with metrics.timer('smtp_seconds', op='send'):
+                        conn.send(msg)
+                except smtplib.SMTPServerDisconnected as e: # the connection is gone; retry the rest later
+                    for unsent in rows[i:]:
+                        _failed(db, unsent, e)
+                    break
+                except Exception as e:
+                    _failed(db, row, e)
+                else:
+                    with db:
+                        db.execute("UPDATE outbox SET status = 'sent', attempts = attempts + 1,"
+                                   " last_error = NULL WHERE id = ?", (row['id'],))
+                    sent += 1
+    except Exception as e: # could not connect, or the connection failed outside a send
+        current_app.logger.info("Error while connecting to the mail server")
+        current_app.logger.error(e)
+        for row in rows:
+            if db.execute("SELECT status FROM outbox WHERE id = ?", (row['id'],)).fetchone()['status'] == 'sending':
+                _failed(db, row, e)
+    current_app.logger.debug("Outbox delivered {} of {} emails".format(sent, len(rows)))
+    return sent
+
+
+def _work(app, worker):
+    """
+    Worker thread loop: drain the outbox whenever woken, and every MAIL_OUTBOX_POLL seconds for retries
+    """
+    while not worker.stop.is_set():
+        worker.wake.wait(app.config['MAIL_OUTBOX_POLL'])
+        worker.wake.clear()
+        with app.app_context():
+            try:
+                while deliverPending() and not worker.stop.is_set(): # keep going while full batches go out
+                    pass
+            except Exception as e:
+                app.logger.info("Error in the outbox worker")
+                app.logger.error(e)
+    return
+
+
+def startWorker(app):
+    """
+    Start this process's delivery thread for the app, if it is not already running (or stopped)
+    Returns the app's Worker
+    """
+    worker = app.extensions['outbox']
+    if worker.thread is not None and worker.thread.is_alive():
+        return worker
+    with _startedLock:
+        if worker.stop.is_set() or (worker.thread is not None and worker.thread.is_alive()):
+            return worker
+        worker.thread = threading.Thread(target=_work, args=(app, worker), name='outbox', daemon=True)
+        worker.thread.start()
+        if worker not in _started:
+            _started.append(worker)
+    return worker
+
+
+def stopWorker(worker):
+    """
+    Ask a delivery thread to finish its current batch and stop
+    """
+    worker.stop.set()
+    worker.wake.set()
+    if worker.thread is not None:
+        worker.thread.join(timeout=5)
+    return
+
+
+@atexit.register
+def stopWorkers():
+    """
+    Stop every delivery thread started in this process
+    """
+    for worker in list(_started):
+        stopWorker(worker)
+    return
+
+
+# define a command line command 'send-mail' to drain the outbox from a separate process or cron
+@click.command('send-mail')
+@click.option('--loop', is_flag=True, help='Keep running, polling every MAIL_OUTBOX_POLL seconds.')
+@with_appcontext
+def send_mail_command(loop):
+    """
+    Deliver the emails waiting in the outbox
+    """
+    total = 0
+    while True:
+        sent = deliverPending()
+        total += sent
+        if sent:
+            continue
+        if not loop:
+            break
+        time.sleep(current_app.config['MAIL_OUTBOX_POLL'])
+    click.echo('Sent {} emails.'.format(total))
+    return
+
+
+def init_app(app):
+    """
+    Register these functions with the application instance so they get used
+    """
+    app.extensions['outbox'] = Worker()
+    app.cli.add_command(send_mail_command)
+    return
@@ -0,0 +1,114 @@
+#--------------------------------------------------------------------------------------------------#
+#                                            Page Cache                                            #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Keep the rendered HTML of the pages that are the same for every visitor in the cache
+Views call render() instead of render_template(), so anything else they do (like logging out) still
+happens on every request. Pages are keyed by template, locale and a version that changes whenever a
+template or the static asset/image manifests change on disk, so a deploy never serves old HTML
+Requests with pending flash messages or a logged in admin are always rendered
+"""
+
+import hashlib
+import os
+import threading
+from collections import Counter
+
+from flask import current_app, make_response, render_template, request, session
+
+from .extensions import cache
+from .files import fileVersion
+from . import assets
+from . import images
+from . import metrics
+
+_counts = Counter() # 'hit', 'miss' and 'bypass' for this process
+_countsLock = threading.Lock()
+_versions = {} # app -> template tree signature, worked out once per process unless templates auto-reload
+
+
+def _count(outcome):
+    with _countsLock:
+        _counts[outcome] += 1
+    return
+
+
+def counters():
+    """
+    This process's page cache hits, misses and bypasses so far
+    """
+    with _countsLock:
+        return {outcome: _counts[outcome] for outcome in ('hit', 'miss', 'bypass')}
+
+
+def _templateSignature(app):
+    """
+    The newest mtime and the number of files in the app's template folder
+    """
+    newest, count = 0, 0
+    for root, dirs, files in os.walk(os.path.join(app.root_path, app.template_folder)):
+        for filename in files:
+            newest = max(newest, os.stat(os.path.join(root, filename)).st_mtime_ns)
+            count += 1
+    return (newest, count)
+
+
+def version():
+    """
+    A short key for everything a cached page depends on besides its template name and locale
+    """
+    app = current_app._get_current_object()
+    signature = _versions.get(app)
+    if signature is None or app.debug or app.config.get('TEMPLATES_AUTO_RELOAD'):
+        signature = _versions[app] = _templateSignature(app)
+    static = app.static_folder
+    parts = [app.config['PAGE_CACHE_VERSION'], signature, app.config['STATIC_FINGERPRINT'],
+             fileVersion(os.path.join(static, assets.DIST_DIR, assets.MANIFEST_FILE)),
+             fileVersion(os.path.join(static, images.DERIVED_DIR, images.MANIFEST_FILE))]
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:12]
+
+
+def locale():
+    """
+    The best of the app's LANGUAGES for this request
+    """
+    languages = current_app.config['LANGUAGES']
+    return request.accept_languages.best_match(languages) or languages[0]
+
+
+def bypass():
+    """
+    Whether this request must be rendered afresh: flashes are waiting or an admin is logged in
+    """
+    return (not current_app.config['PAGE_CACHE'] or request.method != 'GET'
+            or '_flashes' in session or session.get('user_id') is not None)
+
+
+def render(template, **context):
+    """
+    render_template(), served from the cache when the page is the same for everyone
+    """
+    if bypass():
+        _count('bypass')
+        response = make_response(render_template(template, **context))
+        response.headers['X-Page-Cache'] = 'BYPASS'
+        return response
+
+    key = "page_{}_{}_{}".format(version(), locale(), template)
+    if context:
+        key += '_' + hashlib.sha1(repr(sorted(context.items())).encode()).hexdigest()[:12]
+    html = cache.get(key)
+    if html is None:
+        _count('miss')
+        metrics.cacheLookup('page', misses=1)
+        html = render_template(template, **context)
+        cache.set(key, html, timeout=current_app.config['PAGE_CACHE_TIMEOUT'])
+        outcome = 'MISS'
+    else:
+        _count('hit')
+        metrics.cacheLookup('page', hits=1)
+        outcome = 'HIT'
+    response = make_response(html)
+    response.headers['X-Page-Cache'] = outcome
+    return response
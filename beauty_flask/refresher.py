@@ -0,0 +1,196 @@
+#--------------------------------------------------------------------------------------------------#
+#                                        Openings Refresher                                        #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Keep the next OPENINGS_REFRESH_WEEKS weeks of openings precomputed, so visitors are served from the cache
+Every timezone with cached weeks (plus OPENINGS_REFRESH_TIMEZONES) is recomputed OPENINGS_REFRESH_MARGIN
+seconds before its cached weeks would expire. With OPENINGS_REFRESH on, a thread in each process does it
+from the first request on; otherwise run `flask refresh-openings --loop` as its own process
+With a cache shared between processes only the holder of the refresh lease refreshes; with a per-process
+cache every process keeps its own copy warm
+"""
+
+import atexit
+import threading
+import time
+from datetime import datetime
+
+import click
+from dateutil import tz
+from flask import current_app
+from flask.cli import with_appcontext
+
+from .extensions import cache, sharedCache
+from . import gcal
+from . import leases
+from . import metrics
+from . import site
+from . import slotgrid
+from . import weekcache
+
+LEASE = 'openings_refresh'
+
+_started = [] # every Refresher started in this process, to stop at exit
+_startedLock = threading.Lock()
+
+
+class Refresher:
+    """
+    An app's refresh thread and the event that stops it, kept in app.extensions['refresher'] so stopping
+    one app's refresher leaves any other app's alone
+    """
+    def __init__(self):
+        self.thread = None
+        self.stop = threading.Event()
+
+
+def interval(app):
+    """
+    Seconds between refreshes: the openings cache timeout less the margin, so entries never run out
+    """
+    timeout = app.config['OPENINGS_CACHE_TIMEOUT']
+    if timeout is None:
+        timeout = app.config['CACHE_DEFAULT_TIMEOUT']
+    margin = app.config['OPENINGS_REFRESH_MARGIN']
+    if not timeout: # cached weeks never expire; refresh every margin to pick up calendar changes
+        return max(margin, 1)
+    return max(timeout - margin, 1)
+
+
+def timezones():
+    """
+    Every timezone to keep warm
+    """
+    return sorted(set(cache.get(weekcache.TZNAMES_KEY) or []) | set(current_app.config['OPENINGS_REFRESH_TIMEZONES']))
+
+
+def refreshOpenings():
+    """
+    Recompute and cache the next OPENINGS_REFRESH_WEEKS weeks in every timezone to keep warm, for every
+    session length
+    Returns the number of timezones refreshed, or None if another process holds the refresh lease
+    """
+    app = current_app._get_current_object()
+    if sharedCache(app) and not leases.acquire(LEASE, interval(app) + app.config['OPENINGS_REFRESH_MARGIN']):
+        return None
+
+    tzNames = timezones()
+    if not tzNames:
+        return 0
+    service = gcal.getService()
+    weeks = app.config['OPENINGS_REFRESH_WEEKS']
+    changed = []
+    for tzName in tzNames:
+        sunday = weekcache.startOfWeek(datetime.now(tz.gettz(tzName)))
+        for duration in slotgrid.durations():
+            with metrics.stage('refresh'):
+                computed = site.computeWeeks(service, sunday, weeks, duration)
+                if weekcache.putWeeks(tzName, duration, sunday, computed):
+                    changed.append((tzName, duration))
+    app.logger.debug("Refreshed {} weeks of openings in {} (changed in {})".format(weeks, tzNames, changed))
+    return len(tzNames)
+
+
+def _work(app, refresher):
+    """
+    Refresh thread loop: refresh, then wait out the interval, until asked to stop
+    The lease is given up on stopping so another process can take over straight away
+    """
+    while not refresher.stop.is_set():
+        with app.app_context():
+            try:
+                refreshOpenings()
+            except Exception as e:
+                app.logger.info("Error while refreshing openings")
+                app.logger.error(e)
+        refresher.stop.wait(interval(app))
+    if sharedCache(app):
+        with app.app_context():
+            try:
+                leases.release(LEASE)
+            except Exception as e:
+                app.logger.info("Error while releasing the openings refresh lease")
+                app.logger.error(e)
+    return
+
+
+def startRefresher():
+    """
+    before_request: start this process's refresh thread for the app, if it is not already running (or stopped)
+    It starts with the first request rather than with the app, so under a forking server each worker
+    process gets its own thread, and commands run from the command line never start one
+    """
+    app = current_app._get_current_object()
+    refresher = app.extensions['refresher']
+    if refresher.thread is not None and refresher.thread.is_alive():
+        return
+    with _startedLock:
+        if refresher.stop.is_set() or (refresher.thread is not None and refresher.thread.is_alive()):
+            return
+        refresher.thread = threading.Thread(target=_work, args=(app, refresher), name='refresher', daemon=True)
+        refresher.thread.start()
+        if refresher not in _started:
+            _started.append(refresher)
+    return
+
+
+def stopRefresher(refresher):
+    """
+    Ask a refresh thread to finish its current refresh and stop
+    """
+    refresher.stop.set()
+    if refresher.thread is not None:
+        refresher.thread.join(timeout=5)
+    return
+
+
+@atexit.register
+def stopRefreshers():
+    """
+    Stop every refresh thread started in this process
+    """
+    for refresher in list(_started):
+        stopRefresher(refresher)
+    return
+
+
+# define a command line command 'refresh-openings' to keep openings warm from a separate process or cron
+@click.command('refresh-openings')
+@click.option('--loop', is_flag=True, help='Keep running, refreshing before cached openings expire.')
+@with_appcontext
+def refresh_openings_command(loop):
+    """
+    Recompute the cached openings of the upcoming weeks
+    """
+    app = current_app._get_current_object()
+    if not sharedCache(app):
+        click.echo("The cache ({}) is per process, so only this process's copy is refreshed.".format(
+            app.config['CACHE_TYPE']))
+    try:
+        while True:
+            refreshed = refreshOpenings()
+            if refreshed is None:
+                click.echo('Another process holds the refresh lease.')
+            else:
+                click.echo('Refreshed openings in {} timezones.'.format(refreshed))
+            if not loop:
+                break
+            time.sleep(interval(app))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if sharedCache(app):
+            leases.release(LEASE)
+    return
+
+
+def init_app(app):
+    """
+    Register these functions with the application instance so they get used
+    """
+    app.extensions['refresher'] = Refresher()
+    if app.config['OPENINGS_REFRESH']:
+        app.before_request(startRefresher)
+    app.cli.add_command(refresh_openings_command)
+    return
@@ -0,0 +1,161 @@
+#--------------------------------------------------------------------------------------------------#
+#                                        Slot Reservations                                         #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Hold a slot in the database while a client confirms it, so two clients can never book the same time
+with the same artist
+A booking covers several units of the slot grid (SLOT_MINUTES each) and each unit is a row keyed on its
+calendar and start, so overlapping slots conflict too; holds and confirmations run under BEGIN IMMEDIATE
+and holds expire after a TTL
+"""
+
+import secrets
+import time
+from contextlib import contextmanager
+
+from flask import current_app, session
+
+from .db import get_db
+from . import slotgrid
+
+
+class SlotTaken(Exception):
+    """
+    Raised when another client holds or has booked part of the requested slot
+    """
+    pass
+
+
+def sessionToken():
+    """
+    The token identifying this client's holds, created the first time it is needed
+    """
+    if session.get('holdToken') is None:
+        session['holdToken'] = secrets.token_urlsafe(16)
+    return session['holdToken']
+
+
+def units(start, length):
+    """
+    The unix times of each grid unit covered by a booking of the timedelta length from the aware datetime start
+    """
+    first = int(start.timestamp())
+    return list(range(first, first + int(length.total_seconds()), slotgrid.currentGrid().step * 60))
+
+
+@contextmanager
+def _transaction():
+    """
+    A write transaction started straight away, so concurrent holds on the same units are serialized
+    It is committed when the block finishes, and rolled back if it raises, so the lock is never left held
+    """
+    db = get_db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        yield db
+    except BaseException:
+        db.rollback()
+        raise
+    db.commit()
+    return
+
+
+def _in(values):
+    return ','.join('?' * len(values))
+
+
+def hold(calendarId, start, length, token=None, rescheduling=None):
+    """
+    Hold (or re-hold) the slot of the timedelta length starting at 'start' on the calendar for
+    RESERVATION_HOLD_TTL seconds
+    When rescheduling, units booked by that appointment ID don't count as taken
+    Raises SlotTaken if another client holds or has booked any part of it
+    """
+    token = token or sessionToken()
+    now = int(time.time())
+    wanted = units(start, length)
+    with _transaction() as db:
+        db.execute("DELETE FROM reservation WHERE status = 'held' AND expires <= ?", (now,))
+        taken = db.execute(
+            "SELECT COUNT(*) FROM reservation WHERE calendar_id = ? AND unit_start IN ({})"
+            " AND NOT (token = ? AND status = 'held') AND NOT (status = 'booked' AND appt_id IS ?)".format(_in(wanted)),
+            [calendarId] + wanted + [token, rescheduling]
+        ).fetchone()[0]
+        if taken:
+            raise SlotTaken()
+        ## a client only ever holds one slot at a time
+        db.execute("DELETE FROM reservation WHERE token = ? AND status = 'held'", (token,))
+        ## the only rows left among the wanted units are those booked by the appointment being rescheduled;
+        ## they stay booked, so abandoning the reschedule (and letting the hold expire) never frees them
+        expires = now + current_app.config['RESERVATION_HOLD_TTL']
+        db.executemany("INSERT OR IGNORE INTO reservation (calendar_id, unit_start, token, status, expires)"
+                       " VALUES (?, ?, ?, 'held', ?)", [(calendarId, unit, token, expires) for unit in wanted])
+    return
+
+
+def confirm(calendarId, start, length, apptID, token=None):
+    """
+    Turn this client's hold on the slot on the calendar into the booking for apptID, before the calendar
+    is written to
+    Any units apptID booked before (when it is being rescheduled) outside the slot are freed in the same
+    transaction; those inside it were never held, and stay booked
+    Raises SlotTaken, changing nothing, if the hold has lapsed and any of the slot is no longer this client's
+    """
+    token = token or sessionToken()
+    wanted = units(start, length)
+    with _transaction() as db:
+        db.execute(
+            "UPDATE reservation SET status = 'booked', appt_id = ?, expires = NULL"
+            " WHERE token = ? AND status = 'held' AND calendar_id = ? AND unit_start IN ({})".format(_in(wanted)),
+            [apptID, token, calendarId] + wanted
+        )
+        booked = db.execute(
+            "SELECT COUNT(*) FROM reservation WHERE status = 'booked' AND appt_id = ? AND calendar_id = ?"
+            " AND unit_start IN ({})".format(_in(wanted)), [apptID, calendarId] + wanted
+        ).fetchone()[0]
+        if booked != len(wanted):
+            raise SlotTaken()
+        db.execute(
+            "DELETE FROM reservation WHERE appt_id = ? AND status = 'booked'"
+            " AND NOT (calendar_id = ? AND unit_start IN ({}))".format(_in(wanted)),
+            [apptID, calendarId] + wanted
+        )
+    return
+
+
+def rebook(calendarId, start, length, apptID, token=None):
+    """
+    Put apptID's booking back on the slot on the calendar, when moving it there failed after confirm
+    Units another client has taken since are left to them
+    """
+    token = token or sessionToken()
+    with _transaction() as db:
+        db.execute("DELETE FROM reservation WHERE appt_id = ? AND status = 'booked'", (apptID,))
+        db.executemany("INSERT OR IGNORE INTO reservation (calendar_id, unit_start, token, status, appt_id)"
+                       " VALUES (?, ?, ?, 'booked', ?)",
+                       [(calendarId, unit, token, apptID) for unit in units(start, length)])
+    return
+
+
+def release(calendarId, start, length, token=None):
+    """
+    Drop this client's hold on the slot on the calendar, e.g. when booking it failed
+    """
+    token = token or sessionToken()
+    wanted = units(start, length)
+    with _transaction() as db:
+        db.execute(
+            "DELETE FROM reservation WHERE token = ? AND status = 'held' AND calendar_id = ? AND unit_start IN ({})".format(
+                _in(wanted)), [token, calendarId] + wanted
+        )
+    return
+
+
+def releaseAppointment(apptID):
+    """
+    Free every unit booked by an appointment, when it is cancelled or moved
+    """
+    with _transaction() as db:
+        db.execute('DELETE FROM reservation WHERE appt_id = ?', (apptID,))
+    return
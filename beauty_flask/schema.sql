@@ -1,8 +1,109 @@
-DROP TABLE IF EXISTS admin;
+-- Applied by db.migrate_db at startup and by `flask init-db`: every statement only adds what is missing,
+-- so existing data is always kept. Tables made by an older version of this file are upgraded in place
+-- first (see db.UPGRADES)
 
-CREATE TABLE admin (
+CREATE TABLE IF NOT EXISTS admin (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   username TEXT UNIQUE NOT NULL,
   password TEXT NOT NULL
 );
 
+
+-- Local mirror of calendar events, kept current with incremental syncToken listings
+CREATE TABLE IF NOT EXISTS event (
+  id TEXT NOT NULL,
+  calendar_id TEXT NOT NULL,
+  start_time TEXT NOT NULL,
+  end_time TEXT NOT NULL,
+  start_ts INTEGER NOT NULL,
+  end_ts INTEGER NOT NULL,
+  PRIMARY KEY (calendar_id, id)
+);
+
+CREATE INDEX IF NOT EXISTS event_range ON event (calendar_id, start_ts, end_ts);
+
+CREATE TABLE IF NOT EXISTS calendar_sync (
+  calendar_id TEXT PRIMARY KEY,
+  sync_token TEXT,
+  synced_at INTEGER NOT NULL
+);
+
+-- Google Calendar push notification channels, renewed before they expire
+CREATE TABLE IF NOT EXISTS watch_channel (
+  id TEXT PRIMARY KEY,
+  calendar_id TEXT NOT NULL,
+  resource_id TEXT NOT NULL,
+  token TEXT NOT NULL,
+  expiration INTEGER NOT NULL
+);
+
+-- Emails waiting to be delivered by the outbox worker
+CREATE TABLE IF NOT EXISTS outbox (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  subject TEXT NOT NULL,
+  sender TEXT,
+  recipients TEXT NOT NULL,
+  html TEXT,
+  status TEXT NOT NULL DEFAULT 'pending',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_attempt INTEGER NOT NULL,
+  last_error TEXT,
+  created INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt);
+
+-- Appointments booked through the site, so lookups don't need a calendar round trip
+CREATE TABLE IF NOT EXISTS appointment (
+  id TEXT PRIMARY KEY,
+  start_time TEXT NOT NULL,
+  end_time TEXT NOT NULL,
+  tz_name TEXT,
+  calendar_id TEXT,
+  client_name TEXT,
+  client_email TEXT,
+  status TEXT NOT NULL DEFAULT 'booked',
+  etag TEXT,
+  updated TEXT,
+  synced_at INTEGER NOT NULL
+);
+
+-- Holds and confirmed bookings per slot grid unit of each calendar, so two clients can never take the same slot
+CREATE TABLE IF NOT EXISTS reservation (
+  calendar_id TEXT NOT NULL,
+  unit_start INTEGER NOT NULL,
+  token TEXT NOT NULL,
+  status TEXT NOT NULL DEFAULT 'held',
+  appt_id TEXT,
+  expires INTEGER,
+  PRIMARY KEY (calendar_id, unit_start)
+);
+
+CREATE INDEX IF NOT EXISTS reservation_appt ON reservation (appt_id);
+
+-- Server-side session data, keyed by the opaque ID in the session cookie
+CREATE TABLE IF NOT EXISTS session (
+  id TEXT PRIMARY KEY,
+  data TEXT NOT NULL,
+  expires INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS session_expires ON session (expires);
+
+-- Expiring leases, so only one worker process at a time does a shared job
+CREATE TABLE IF NOT EXISTS lease (
+  name TEXT PRIMARY KEY,
+  holder TEXT NOT NULL,
+  expires INTEGER NOT NULL
+);
+
+-- The artists clients can book, each with their own calendar, and optionally their own weekly
+-- schedule (availability JSON, else the shared one) kept in their own timezone
+CREATE TABLE IF NOT EXISTS artist (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  name TEXT NOT NULL,
+  calendar_id TEXT UNIQUE NOT NULL,
+  tz_name TEXT,
+  availability TEXT,
+  active INTEGER NOT NULL DEFAULT 1
+);
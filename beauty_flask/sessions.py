@@ -0,0 +1,266 @@
+#--------------------------------------------------------------------------------------------------#
+#                                         Server Sessions                                          #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Keep session data on the server, so the cookie only carries an opaque random ID
+Data lives in the database (SESSION_BACKEND 'sqlite') or the shared cache ('cache'), serialized the same
+way Flask's cookie session does it, so views see exactly the same values. A session is only written
+when its contents actually changed; otherwise its expiry is pushed back at most every
+SESSION_TOUCH_INTERVAL seconds. Idle sessions expire after SESSION_IDLE_TIMEOUT seconds, and a background
+thread deletes expired rows from the database
+"""
+
+import atexit
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from .db import get_db, migrate_db
+from .extensions import cache
+from . import metrics
+
+serializer = TaggedJSONSerializer() # what the cookie session uses, e.g. datetimes come back aware UTC
+
+_stop = threading.Event()
+_purgers = {} # app -> purge thread
+_purgersLock = threading.Lock()
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """
+    A session whose data is stored on the server under 'sid'
+    """
+    def __init__(self, initial=None, sid=None, stored=None, expires=None):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.stored = stored # serialized data as loaded, to tell whether anything really changed
+        self.expires = expires # unix time the stored copy expires, if there is one
+        self.rotate = False
+        self.modified = False
+
+    def clear(self):
+        """
+        Empty the session and give it a new ID, e.g. on logging in or out, so an old ID is worthless
+        """
+        super().clear()
+        self.rotate = True
+        return
+
+
+#----------------------------------------#
+#                 Stores                 #
+#----------------------------------------#
+
+class SQLiteStore:
+    """
+    Sessions in the database's session table
+    The table is created on first use if the database doesn't have it yet (e.g. DATABASE_MIGRATE is off);
+    until then loading finds no session
+    """
+    def _write(self, sql, args):
+        db = get_db()
+        try:
+            with db:
+                return db.execute(sql, args)
+        except sqlite3.OperationalError as e:
+            if 'no such table' not in str(e):
+                raise
+        migrate_db() # only adds what is missing
+        with db:
+            return db.execute(sql, args)
+
+    def load(self, sid):
+        try:
+            row = get_db().execute('SELECT data, expires FROM session WHERE id = ? AND expires > ?',
+                                   (sid, int(time.time()))).fetchone()
+        except sqlite3.OperationalError as e:
+            if 'no such table' not in str(e):
+                raise
+            return None # nothing has been saved yet
+        return None if row is None else (row['data'], row['expires'])
+
+    def save(self, sid, data, expires):
+        self._write('INSERT OR REPLACE INTO session (id, data, expires) VALUES (?, ?, ?)', (sid, data, expires))
+        return
+
+    def touch(self, sid, data, expires):
+        self._write('UPDATE session SET expires = ? WHERE id = ?', (expires, sid))
+        return
+
+    def delete(self, sid):
+        self._write('DELETE FROM session WHERE id = ?', (sid,))
+        return
+
+    def purge(self):
+        """
+        Delete every expired session; returns how many there were
+        """
+        return self._write('DELETE FROM session WHERE expires <= ?', (int(time.time()),)).rowcount
+
+
+class CacheStore:
+    """
+    Sessions in the cache extension; the cache's own timeouts expire them
+    """
+    def _key(self, sid):
+        return "session_" + sid
+
+    def load(self, sid):
+        found = cache.get(self._key(sid))
+        metrics.cacheLookup('session', hits=int(found is not None), misses=int(found is None))
+        return found
+
+    def save(self, sid, data, expires):
+        cache.set(self._key(sid), (data, expires), timeout=max(1, expires - int(time.time())))
+        return
+
+    touch = save
+
+    def delete(self, sid):
+        cache.delete(self._key(sid))
+        return
+
+    def purge(self):
+        return 0
+
+
+STORES = {'sqlite': SQLiteStore, 'cache': CacheStore}
+
+
+#----------------------------------------#
+#           Session interface            #
+#----------------------------------------#
+
+class ServerSessionInterface(SessionInterface):
+    """
+    Flask session interface using one of the STORES
+    """
+    def __init__(self, store):
+        self.store = store
+
+    def _ttl(self, app, session):
+        if session.permanent:
+            return int(app.permanent_session_lifetime.total_seconds())
+        return app.config['SESSION_IDLE_TIMEOUT']
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            try:
+                found = self.store.load(sid)
+            except Exception as e:
+                app.logger.info("Error while loading the session")
+                app.logger.error(e)
+                found = None
+            if found is not None:
+                data, expires = found
+                return ServerSession(serializer.loads(data), sid=sid, stored=data, expires=expires)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        ## an emptied session is dropped, along with its cookie
+        if not session:
+            if session.sid is not None and (session.modified or session.rotate):
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure, samesite=samesite,
+                                       httponly=httponly)
+                response.vary.add('Cookie')
+            return
+
+        now = int(time.time())
+        ttl = self._ttl(app, session)
+        data = serializer.dumps(dict(session))
+        newID = session.sid is None or session.rotate
+        if newID:
+            if session.sid is not None:
+                self.store.delete(session.sid)
+            session.sid = secrets.token_urlsafe(32)
+        if newID or data != session.stored:
+            self.store.save(session.sid, data, now + ttl)
+        elif session.expires is None or session.expires - ttl <= now - app.config['SESSION_TOUCH_INTERVAL']:
+            self.store.touch(session.sid, data, now + ttl) # unchanged, but still in use
+        else:
+            return # nothing to write, and the cookie the client has is still right
+        startPurger(app)
+
+        if newID or session.permanent:
+            response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                                httponly=httponly, domain=domain, path=path, secure=secure, samesite=samesite)
+            response.vary.add('Cookie')
+        return
+
+
+#----------------------------------------#
+#            Expiring sessions           #
+#----------------------------------------#
+
+def _purge(app):
+    """
+    Purge thread loop: delete expired sessions every SESSION_PURGE_INTERVAL seconds
+    """
+    while not _stop.wait(app.config['SESSION_PURGE_INTERVAL']):
+        with app.app_context():
+            try:
+                purged = app.session_interface.store.purge()
+                app.logger.debug("Purged {} expired sessions".format(purged))
+            except Exception as e:
+                app.logger.info("Error while purging expired sessions")
+                app.logger.error(e)
+    return
+
+
+def startPurger(app):
+    """
+    Start this process's purge thread for the app, if it needs one and it is not already running
+    """
+    if not isinstance(app.session_interface.store, SQLiteStore):
+        return
+    purger = _purgers.get(app)
+    if purger is not None and purger.is_alive():
+        return
+    with _purgersLock:
+        purger = _purgers.get(app)
+        if purger is None or not purger.is_alive():
+            purger = threading.Thread(target=_purge, args=(app,), name='sessions', daemon=True)
+            _purgers[app] = purger
+            purger.start()
+    return
+
+
+@atexit.register
+def stopPurgers():
+    """
+    Ask the purge threads to stop
+    """
+    _stop.set()
+    for purger in list(_purgers.values()):
+        purger.join(timeout=5)
+    return
+
+
+def init_app(app):
+    """
+    Use server-side sessions for the app, unless SESSION_BACKEND is None (Flask's signed cookie)
+    """
+    backend = app.config['SESSION_BACKEND']
+    if backend is not None:
+        app.session_interface = ServerSessionInterface(STORES[backend]())
+    return
@@ -0,0 +1,85 @@
+#--------------------------------------------------------------------------------------------------#
+#                                          Single Flight                                           #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Coalesce concurrent cache misses for the same key into one computation
+The first caller for a key computes; other threads of the process wait for it to finish and then read the
+result back from the cache. With a cache shared between processes the computing caller also holds a lease
+on the key, so callers in other workers poll the cache instead of computing too
+A waiter that gives up after OPENINGS_COALESCE_TIMEOUT seconds, or finds nothing cached once the
+computation is over (e.g. it failed), computes for itself
+"""
+
+import threading
+import time
+
+from flask import current_app
+
+from .extensions import sharedCache
+from . import leases
+from . import metrics
+
+_flights = {} # key -> Event set when this process's computation for it is over
+_flightsLock = threading.Lock()
+
+
+def _timeout():
+    return current_app.config['OPENINGS_COALESCE_TIMEOUT']
+
+
+def _acrossWorkers(key, compute, ready, family):
+    """
+    compute() under the lease on key, or wait for the worker holding it and return ready()
+    """
+    if not sharedCache(current_app):
+        return compute()
+    name = 'flight_' + key
+    deadline = time.monotonic() + _timeout()
+    waited = False
+    while True:
+        if leases.acquire(name, _timeout()):
+            try:
+                result = ready() if waited else None # the holder may have just finished
+                if result is None:
+                    result = compute()
+                return result
+            finally:
+                leases.release(name)
+        waited = True
+        time.sleep(current_app.config['OPENINGS_COALESCE_POLL'])
+        result = ready()
+        if result is not None:
+            metrics.inc('coalesced_total', family=family, scope='worker')
+            return result
+        if time.monotonic() > deadline:
+            current_app.logger.info("Gave up waiting for another worker to compute {}".format(key))
+            return compute()
+
+
+def run(key, compute, ready, family):
+    """
+    Return compute() for key, unless a computation for key is already running, in which case wait for it
+    and return ready(), which reads its result back from the cache (None if it is not there)
+    family labels the coalesced_total metric, e.g. 'openings'
+    """
+    with _flightsLock:
+        done = _flights.get(key)
+        leading = done is None
+        if leading:
+            done = _flights[key] = threading.Event()
+
+    if not leading:
+        if done.wait(_timeout()):
+            result = ready()
+            if result is not None:
+                metrics.inc('coalesced_total', family=family, scope='process')
+                return result
+        return compute()
+
+    try:
+        return _acrossWorkers(key, compute, ready, family)
+    finally:
+        with _flightsLock:
+            del _flights[key]
+        done.set()
@@ -3,28 +3,38 @@
 #--------------------------------------------------------------------------------------------------#
 
 from flask import (
-    Blueprint, flash, render_template, g, session, request, redirect, url_for, jsonify, current_app
+    Blueprint, flash, render_template, session, request, redirect, url_for, jsonify, current_app
 )
 
-import os.path
 from dateutil import tz
 from datetime import datetime, timedelta
-import json
+import hashlib
+import uuid
 
-from google.oauth2 import service_account
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-
-from .extensions import cache, mail
 from flask_mail import Message
-
-# Constants for calculating datetimes
-DAYS = ('Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat')
-TIMEBLOCKS = ('0800', '0830', '0900', '0930', '1000', '1030', '1100', '1130', '1200', '1230', '1300', '1330', '1400', '1430', '1500', '1530', '1600', '1630', '1700', '1730', '1800', '1830', '1900', '1930', '2000')
-BOOKING_LEN = timedelta(hours=1)
+from googleapiclient.errors import HttpError
+
+# Constants for calculating datetimes, plus the engine that finds openings
+from .openings import DAYS
+from . import openings as engine
+from . import artists
+from . import mirror
+from . import busytime
+from . import weekcache
+from . import gcal
+from . import outbox
+from . import ledger
+from . import reservations
+from . import pagecache
+from . import metrics
+from . import slotgrid
 
 # Constants for connecting to Google Calendar
-CAL_ID = 'onspl2i87fputjkjg8h0uhhmno@group.calendar.google.com'
+CAL_ID = artists.DEFAULT_CALENDAR_ID # booked when no artists are registered
+
+# Why a slot could not be held for the client
+SLOT_TAKEN = "Sorry, that session was just booked by someone else. Please choose another time."
+SLOT_ERROR = "Sorry, there was an error while reserving that session. Please try again."
 
 # The Site Blueprint
 bp = Blueprint('site', __name__)
@@ -35,7 +45,7 @@ bp = Blueprint('site', __name__)
 
 @bp.route('/', methods=['GET'])
 def index():
-    return render_template('site/index.html')
+    return pagecache.render('site/index.html')
 
 
 #--------------------------------------------------------------------------------------------------#
@@ -49,7 +59,7 @@ def contactEmail(name, email, message):
     msg.html += "<p> Name:&nbsp;&nbsp;" + name + "</p>"
     msg.html += "<p> Email:&nbsp;&nbsp;" + email + "</p>"
     msg.html += "<p style=\"white-space:pre-wrap;\">Message:&nbsp;&nbsp;<br>" + message + "</p>"
-    mail.send(msg)
+    outbox.enqueue(msg) # delivered in the background
     return
 
 
@@ -65,19 +75,19 @@ def contactPost():
     try:
         contactEmail(name, email, message)
 #        session['sent'] = True
-        flash("Email sent!", 'alert-success')
+        flash("Thank you, your message was received and will be sent shortly!", 'alert-success')
     except Exception as e:
-        current_app.logger.debug("Error while sending contact email")
+        current_app.logger.debug("Error while queuing contact email")
         current_app.logger.error(e)
 #        session['sent'] = False
-        flash("Email failed to send. Please try again soon.", 'alert-danger')
+        flash("Sorry, your message could not be received. Please try again soon.", 'alert-danger')
 
     return redirect(url_for('site.contact'))
 
 
 @bp.route('/contact', methods=['GET'])
 def contact():
-    return render_template('site/contact.html')
+    return pagecache.render('site/contact.html')
 
 
 #--------------------------------------------------------------------------------------------------#
@@ -92,27 +102,64 @@ def contact():
 
 @bp.route('/pay', methods=['GET'])
 def pay():
-    return render_template('site/pay.html')
+    return pagecache.render('site/pay.html')
 
 #--------------------------------------------------------------------------------------------------#
 #                                      Booking Functionality                                       #
 #--------------------------------------------------------------------------------------------------#
 
-def connectToCalendar():
+@metrics.stage('timezone')
+def getCalendarTimezone(service):
+    cal = service.calendars().get(calendarId=CAL_ID).execute()
+    return cal['timeZone']
+
+
+@metrics.stage('events')
+def getEventsForRange(service, start, end):
     """
-    Connect to Google Calendar via the service account
-    Returns the connection Resource service
+    Get busy time from Google Calendar between the provided start and end datetimes
+    Only busy intervals are asked for (see busytime), all-day events included
+    Returns as a list of tuples of (startTime, endTime)
+    Returns an empty list if there are no events in the given time frame
     """
-    SCOPES = ['https://www.googleapis.com/auth/calendar.readonly', 'https://www.googleapis.com/auth/calendar.events']
-    SVC_ACCT_FILE = 'instance/beauty-svc-acct.json'
-    if os.path.exists(SVC_ACCT_FILE):
-        creds = service_account.Credentials.from_service_account_file(SVC_ACCT_FILE, scopes = SCOPES)
-    return build('calendar', 'v3', credentials=creds)
+    return busytime.getBusyTimes(service, CAL_ID, start, end)
 
 
-def getCalendarTimezone(service):
-    cal = service.calendars().get(calendarId=CAL_ID).execute()
-    return cal['timeZone']
+@metrics.stage('events')
+def getEventsForCalendars(service, calendarIds, start, end):
+    """
+    Get busy time from several Google Calendars between the provided start and end datetimes, asking
+    about all of them at once (see busytime)
+    Returns {calendarId: [(startTime, endTime), ...]}
+    """
+    return busytime.getBusyTimesMany(service, calendarIds, start, end)
+
+
+def getBusyEvents(service, calendarIds, start, end):
+    """
+    Get the events between start and end that openings must avoid, for each calendar
+    Reads from the local calendar mirror (calendars due a sync are synced incrementally first, several at
+    a time) when CALENDAR_MIRROR is on, otherwise asks Google Calendar for them directly
+    Returns {calendarId: [(startTime, endTime), ...]}
+    """
+    if current_app.config['CALENDAR_MIRROR']:
+        try:
+            with metrics.stage('mirror_sync'):
+                busytime.fetchEach(service, [c for c in calendarIds if mirror.isDue(c)], mirror.refreshMirror)
+            with metrics.stage('mirror_read'):
+                return mirror.getMirroredEventsMany(calendarIds, start, end)
+        except Exception as e:
+            current_app.logger.info("Error while reading the calendar mirror, listing events directly")
+            current_app.logger.error(e)
+    return getEventsForCalendars(service, calendarIds, start, end)
+
+
+def endOfWeek(start, weeks=1):
+    """
+    The very end of the week containing start, or of the (weeks-1)th week after it
+    """
+    endDate = (start + timedelta(weeks=weeks-1, days=6-int(start.strftime('%w')))).date()
+    return datetime(endDate.year, endDate.month, endDate.day, 23, 59, 59, 999999, start.tzinfo)
 
 
 def getEventsForWeek(service, start):
@@ -121,15 +168,69 @@ def getEventsForWeek(service, start):
     Returns as a list of tuples of (startTime, endTime)
     Returns an empty list if there are no events in the given time frame
     """
-    endDate = (start + timedelta(days=6-int(start.strftime('%w')))).date()
-    end=datetime(endDate.year,endDate.month,endDate.day,23,59,59,999999,tz.gettz('America/Chicago'))
-    events_result = service.events().list(calendarId=CAL_ID, orderBy='startTime', singleEvents=True,
-                                          timeMin=start.isoformat(), timeMax=end.isoformat()).execute()
+    return getEventsForRange(service, start, endOfWeek(start))
+
 
-    return [(e['start']['dateTime'],e['end']['dateTime']) for e in events_result['items']]
+def weekBase(offset, tzInfo, now=None):
+    """
+    The start datetime for the week 'offset' weeks from now
+    Either the current datetime for this week, or the very beginning of a future week
+    """
+    if now is None:
+        now = datetime.now(tzInfo)
+    if offset == 0: # this week
+        return now
+    # a future week
+    futureDate = (now + timedelta(weeks=offset, days=-int(now.strftime('%w')))).date()
+    return datetime(futureDate.year, futureDate.month, futureDate.day, 00, 00, 00, 000000, tzInfo)
 
 
-def getOpeningsForWeek(service):
+def getArtistOpenings(service, bases, end, duration):
+    """
+    For each week's start datetime in bases, compare every artist's availability versus event conflicts
+    from their calendar, for sessions of 'duration' minutes
+    The busy time of all the artists' calendars for the whole span up to end is got at once
+    Returns a list of (week, {artistID: openings}) pairs, one per week
+    """
+    grid = slotgrid.currentGrid()
+    roster = artists.getArtists()
+
+    ## get potential conflicting events for the whole span, for every calendar
+    events = getBusyEvents(service, [artist.calendarId for artist in roster], bases[0], end)
+
+    ## merge them into busy intervals and find each artist's openings
+    with metrics.stage('conflicts'):
+        schedules = []
+        for artist in roster:
+            masks = artists.getMasks(artist) # basic availability, compiled to day bitmasks
+            busy = engine.busyIntervals(events[artist.calendarId])
+            artistTz = tz.gettz(artist.tzName) if artist.tzName else None
+            if artistTz is not None and artistTz != bases[0].tzinfo: # schedule kept in another timezone
+                busy = engine.mergeIntervals(busy, engine.offSchedule(masks, grid, artistTz, bases[0], end))
+                masks = ((1 << grid.size) - 1,) * 7
+            schedules.append((artist.id, masks, busy))
+        return [(engine.weekInfo(base), {artistID: engine.findOpenings(base, masks, busy, grid, duration)
+                                         for artistID, masks, busy in schedules}) for base in bases]
+
+
+def getOpeningsForWeeks(service, first, count, duration=None, artistID=None):
+    """
+    For 'count' weeks starting 'first' weeks from now, compare availability versus event conflicts
+    from the calendar, for sessions of 'duration' minutes (by default the default session length)
+    Openings are the artist's with artistID, or with None those of any artist
+    All busy time for the whole span comes from a single calendar query
+    Returns a list of (week, openings) pairs, one per week, as getOpeningsForWeek does
+    """
+    duration = duration or slotgrid.defaultDuration()
+    grid = slotgrid.currentGrid()
+    tzInfo = tz.gettz(session['tzName']) # the tzinfo type of timezone information for use with datetime
+    now = datetime.now(tzInfo)
+    bases = [weekBase(offset, tzInfo, now) for offset in range(first, first + count)]
+    weeks = getArtistOpenings(service, bases, endOfWeek(bases[0], count), duration)
+    return [(week, engine.pickOpenings(grid, byArtist, artistID)) for week, byArtist in weeks]
+
+
+def getOpeningsForWeek(service, duration=None):
     """
     From a start datetime through the end of that week, compare availability versus event conflicts
     from the calendar
@@ -137,74 +238,305 @@ def getOpeningsForWeek(service):
     The start datetime is either the current datetime or the very beginning of a future week,
     depending on the session 'offset' variable
     """
-    # Create the week's info
-    week = {d:[] for d in DAYS} # will store {'day': ['Mon', 'dd', 'yyyy']} e.g. {'Sun': ['May', '09', '2021']}
-    tzInfo = tz.gettz(session['tzName']) # the tzinfo type of timezone information for use with datetime
+    return getOpeningsForWeeks(service, session['offset'], 1, duration)[0]
 
+
+def computeWeeks(service, sunday, weeks, duration):
+    """
+    Whole weeks of (week, {artistID: openings}) for sessions of 'duration' minutes from the Sunday midnight
+    datetime sunday, from one calendar query
+    The past is not filtered out; weekcache does that when reading
+    """
+    bases = [sunday + timedelta(weeks=i) for i in range(weeks)]
+    return getArtistOpenings(service, bases, endOfWeek(sunday, weeks), duration)
+
+
+def getCachedOpenings(service, first, count, duration=None, artistID=None):
+    """
+    Get (week, openings) for 'count' weeks starting at offset 'first', using cached weeks where possible
+    Weeks are cached whole under the session timezone and their Sunday; any missing weeks are computed
+    together from one calendar query, or served from their last known good copies while that happens
+    in the background
+    With service None, a service is only got if something has to be computed
+    Openings are for sessions of 'duration' minutes, by default the default session length, and are
+    the artist's with artistID, or with None those of any artist
+    """
+    duration = duration or slotgrid.defaultDuration()
+    tzName = session['tzName']
+    tzInfo = tz.gettz(tzName)
     now = datetime.now(tzInfo)
-#    if session.get('offset') is None:
-#        flash("Unexpected error while trying to get available sessions")
-    if session['offset'] == 0: # this week
-        baseDateTime = now
-    else: # a future week
-        futureDate = (now + timedelta(weeks=session['offset'], days=-int(now.strftime('%w')))).date()
-        baseDateTime = datetime(futureDate.year, futureDate.month, futureDate.day, 00, 00, 00, 000000, tzInfo)
-    baseDateTimew = int(baseDateTime.strftime('%w'))
-
-    ## process days from baseDateTime back through beginning of week
-    for i in range(baseDateTimew, -1, -1):
-        currday = baseDateTime - timedelta(days=baseDateTimew-i)
-        week[currday.strftime('%a')] = currday.strftime('%b %d %Y').split()
-
-    ## process days after baseDateTime through end of week
-    for i in range(baseDateTimew + 1, 7):
-        currday = baseDateTime + timedelta(days=i-baseDateTimew)
-        week[currday.strftime('%a')] = currday.strftime('%b %d %Y').split()
-
-    # Populate the week's openings
-    ## get basic availability
-    avail = {d:{t:False for t in TIMEBLOCKS} for d in DAYS} # initialize empty schedule
-    if os.path.exists('instance/availability.json'): # load saved schedule
-        with open('instance/availability.json', 'r') as f:
-            avail = json.load(f)
-#    flash("Availability:")
-#    flash(avail)
-
-    ## get potential conflicting events from schedule
-    events = getEventsForWeek(service, baseDateTime) # get the events from the week in question
-    events = [tuple(map(datetime.fromisoformat,e)) for e in events] # convert all to datetimes
-#    flash("Events:")
-#    flash(events)
-
-    ## find openings
-    openings = {} # initialize
-    for i in range(baseDateTimew, 7): # from baseDateTime through the end of the week
-        currDate = (baseDateTime + timedelta(days=i-baseDateTimew)).date()
-        openings[currDate.strftime('%a')] = [] # initialize
-        for tb in TIMEBLOCKS: # for each timeblock
-            currDateTime = datetime(currDate.year, currDate.month, currDate.day,
-                                    int(tb[:2]), int(tb[2:]), 00, 000000, tzInfo)
-            cDTEnd = currDateTime+BOOKING_LEN # ensure the length of a booking is free
-
-            if currDateTime <= baseDateTime: # in the past
-                continue # move on to next timeblock
-            if not avail[DAYS[i]][tb]: # not available
-                continue # move on to next timeblock
-
-            conflict = False
-            for eStart,eEnd in events: # check for conflicts
-                if cDTEnd <= eStart: # event in the future
-                    continue # not a conflict, go to next event
-                elif eEnd <= currDateTime: # event in the past
-                    continue # not a conflict, move on
-                else: # there's a conflict
-                    conflict = True
-                    break
-
-            if not conflict: # we have an opening!
-                openings[currDate.strftime('%a')].append(tb)
-
-    return week, openings
+    sundays = [weekcache.startOfWeek(weekBase(offset, tzInfo, now)) for offset in range(first, first + count)]
+
+    def compute(sunday, weeks):
+        return computeWeeks(service if service is not None else gcal.getService(), sunday, weeks, duration)
+
+    def revalidate(sunday, weeks): # in a background thread, with a service of its own
+        return computeWeeks(gcal.getService(), sunday, weeks, duration)
+
+    return weekcache.getWeeks(tzName, duration, sundays, compute, now, revalidate, artistID)
+
+
+def openingsETag(first, weeks, ranged, duration, artistID):
+    """
+    Strong validator for an /openings response, worked out without computing any openings
+    It covers the generation of the openings cache, the timezone, the session length, the artist, the
+    weeks asked for and the current week; when this week is included its past timeblocks are dropped, so
+    the current grid block too
+    """
+    tzName = session['tzName']
+    now = datetime.now(tz.gettz(tzName))
+    parts = [weekcache.generation(), tzName, duration, artistID, first, weeks, ranged,
+             weekcache.startOfWeek(now).date().isoformat()]
+    if first == 0:
+        parts.append(now.strftime('%Y%m%d') + str((now.hour*60 + now.minute) // slotgrid.currentGrid().step))
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def noteBooked(event, oldTimes=None, calendarId=CAL_ID):
+    """
+    Keep the calendar mirror and cached openings current after this app inserts or updates an event
+    on calendarId
+    The event's old times (if moved) are invalidated and its new times are patched out of the cache
+    oldTimes is the (start, end) the event had before an update, if known
+    Errors are only logged; the booking itself has already succeeded
+    """
+    times = (event['start']['dateTime'], event['end']['dateTime'])
+    try:
+        spans = []
+        if current_app.config['CALENDAR_MIRROR']:
+            try:
+                spans = mirror.recordEvent(calendarId, event)
+            except Exception as e:
+                current_app.logger.info("Error while recording the event in the calendar mirror")
+                current_app.logger.error(e)
+        moved = [span for span in spans + [oldTimes] if span is not None and span != times]
+        if moved:
+            weekcache.invalidate(moved)
+        artist = artists.forCalendar(calendarId)
+        if artist is not None:
+            weekcache.markBooked(*times, artistID=artist.id)
+    except Exception as e:
+        current_app.logger.info("Error while updating cached openings after a booking")
+        current_app.logger.error(e)
+    return
+
+
+def noteCancelled(apptID, calendarId=CAL_ID):
+    """
+    Keep the calendar mirror and cached openings current after this app deletes an event from calendarId
+    The event's times come from the mirror, or from the session if it was not mirrored
+    """
+    try:
+        spans = []
+        if current_app.config['CALENDAR_MIRROR']:
+            try:
+                spans = mirror.forgetEvent(calendarId, apptID)
+            except Exception as e:
+                current_app.logger.info("Error while removing the event from the calendar mirror")
+                current_app.logger.error(e)
+        if not spans and session.get('apptID') == apptID and session.get('apptDT') is not None:
+            spans = [(session['apptDT'], session['apptDT'] + apptLength())]
+        weekcache.invalidate(spans or None) # with no known times, drop every cached week
+    except Exception as e:
+        current_app.logger.info("Error while updating cached openings after a cancellation")
+        current_app.logger.error(e)
+    return
+
+
+def slotStart(apptDT):
+    """
+    The aware start of a slot picked on the booking page
+    Its wall-clock digits are in the session timezone, whatever tzinfo the session cookie gave it
+    """
+    return apptDT.replace(tzinfo=tz.gettz(session['tzName']))
+
+
+def pickedSlot(appt, offset, tzInfo, now=None):
+    """
+    The wall-clock datetime of a slot picked on the 'book' page as 'Mon_dd_hhmm' (e.g. 'May_10_1000'),
+    in the year its day has in the week 'offset' weeks from now that the page shows (it may span New Year)
+    """
+    month, date = appt.split('_')[:2]
+    base = weekBase(offset, tzInfo, now)
+    year = next((y for m, d, y in engine.weekInfo(base).values() if (m, d) == (month, date)), base.year)
+    return datetime.strptime("{}_{}_{}".format(year, appt, '00'), '%Y_%b_%d_%H%M_%S')
+
+
+def apptLength():
+    """
+    Length of the session's appointment: as picked on the booking page, or as found on the calendar
+    """
+    return timedelta(minutes=session.get('apptMinutes') or slotgrid.defaultDuration())
+
+
+def sessionDuration():
+    """
+    The session length in minutes the client is looking for openings for
+    """
+    duration = session.get('duration')
+    if duration not in slotgrid.durations():
+        duration = slotgrid.defaultDuration()
+    return duration
+
+
+def sessionArtist():
+    """
+    The ID of the artist the client is looking for openings with, or None for any artist
+    """
+    artistID = session.get('artist')
+    if artistID is not None and artists.getArtist(artistID) is None: # since removed
+        artistID = session['artist'] = None
+    return artistID
+
+
+def appointmentCalendar(apptID):
+    """
+    The calendar an appointment is on: as recorded in the ledger, else as found by this session, else
+    the default calendar
+    """
+    try:
+        row = ledger.getAppointment(apptID)
+        if row is not None and row['calendar_id']:
+            return row['calendar_id']
+    except Exception as e:
+        current_app.logger.info("Error while reading the appointment ledger")
+        current_app.logger.error(e)
+    if session.get('apptID') == apptID and session.get('calendarId'):
+        return session['calendarId']
+    return CAL_ID
+
+
+def freeArtists(apptDT, duration):
+    """
+    The artists, in the order they were added, whose cached openings for the week on the 'book' page
+    offer sessions of 'duration' minutes at apptDT
+    The day is matched by its month and date, as apptDT's year is not known
+    """
+    roster = artists.getArtists()
+    if len(roster) == 1:
+        return roster
+    month, date, label = apptDT.strftime('%b'), apptDT.strftime('%d'), apptDT.strftime('%H%M')
+    free = []
+    for artist in roster:
+        week, openings = getCachedOpenings(None, session.get('offset') or 0, 1, duration, artist.id)[0]
+        days = [d for d, (m, dd, *year) in week.items() if (m, dd) == (month, date)]
+        if any(label in openings.get(d, []) for d in days):
+            free.append(artist)
+    return free
+
+
+def holdWithArtist(apptDT, duration, rescheduling=None):
+    """
+    Hold the slot picked on the 'book' page with the session's artist, or with the first artist free
+    then when looking at any artist; an appointment being rescheduled stays with its artist
+    Returns the artist the slot is held with and None, or None and why it could not be held with any
+    """
+    start = slotStart(apptDT)
+    length = timedelta(minutes=duration)
+    if rescheduling is not None:
+        candidates = [artists.forCalendar(appointmentCalendar(rescheduling)) or artists.DEFAULT_ARTIST]
+    elif sessionArtist() is not None:
+        candidates = [artists.getArtist(sessionArtist())]
+    else:
+        try:
+            candidates = freeArtists(apptDT, duration)
+        except Exception as e: # try them all, the holds still keep out taken slots
+            current_app.logger.info("Error while finding the artists free for the slot")
+            current_app.logger.error(e)
+            candidates = artists.getArtists()
+    refused = SLOT_TAKEN
+    for artist in candidates:
+        refused = holdSlot(artist.calendarId, start, length, rescheduling)
+        if refused is None:
+            return artist, None
+        if refused != SLOT_TAKEN: # the reservations can't be trusted, so don't try the others
+            break
+    return None, refused
+
+
+def holdSlot(calendarId, start, length, rescheduling=None):
+    """
+    Reserve the slot of 'length' from start on calendarId for this client while they confirm it
+    Returns None once it is held, else the message to refuse the booking with: SLOT_TAKEN if another
+    client already holds or has booked any of it, SLOT_ERROR if the reservation could not be made
+    """
+    return reserveSlot(reservations.hold, calendarId, start, length, rescheduling=rescheduling)
+
+
+def bookSlot(calendarId, start, length, apptID):
+    """
+    Turn this client's hold on the slot on calendarId into apptID's booking, before the calendar is
+    written to
+    Returns None once it is booked, else the message to refuse the booking with, as holdSlot does
+    """
+    return reserveSlot(reservations.confirm, calendarId, start, length, apptID)
+
+
+def reserveSlot(fn, calendarId, start, *args, **kwargs):
+    """
+    Hold or book the slot from start on calendarId with fn, turning a failure into the message to refuse
+    the booking with
+    """
+    try:
+        fn(calendarId, start, *args, **kwargs)
+    except reservations.SlotTaken:
+        current_app.logger.debug("Slot {} is already taken".format(start))
+        return SLOT_TAKEN
+    except Exception as e: # without a reservation two clients could book the same slot, so refuse it
+        current_app.logger.info("Error while reserving the slot")
+        current_app.logger.error(e)
+        return SLOT_ERROR
+    return None
+
+
+def updateReservation(fn, *args):
+    """
+    Release or restore a reservation, only logging any error
+    """
+    try:
+        fn(*args)
+    except Exception as e:
+        current_app.logger.info("Error while updating the slot reservation")
+        current_app.logger.error(e)
+    return
+
+
+def recordAppointment(event, tzName=None, clientName=None, clientEmail=None, calendarId=None):
+    """
+    Record a just booked or rescheduled appointment in the ledger
+    Errors are only logged; the calendar is still the source of truth
+    """
+    try:
+        ledger.recordAppointment(event, tzName, clientName, clientEmail, calendarId)
+    except Exception as e:
+        current_app.logger.info("Error while recording the appointment in the ledger")
+        current_app.logger.error(e)
+    return
+
+
+def appointmentETag(apptID, version, start, end):
+    """
+    Strong validator for an /appointment/<apptID> response
+    version is the calendar event's etag (or 'updated' time) as last seen by the site
+    """
+    return hashlib.sha1(repr([apptID, version, start, end]).encode()).hexdigest()
+
+
+def notModified(etag):
+    """
+    Whether the client already has the response identified by etag
+    """
+    return etag in request.if_none_match
+
+
+def validated(response, etag):
+    """
+    Mark a fetched JSON response with its validator; the browser may keep it but must check back each time
+    """
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 
 def confirmationEmail():
@@ -220,7 +552,7 @@ def confirmationEmail():
     msg.html += "<p>" + session['apptTime']['start'] + " &ndash; " + session['apptTime']['end'] + "</p>"
     msg.html += "<p><a href=\"" + url_for('site.booked') + '/' + session['apptID'] + "\">"
     msg.html += "To cancel or reschedule, use this link</a></p></body>"
-    mail.send(msg)
+    outbox.enqueue(msg) # delivered in the background
     return
 
 
@@ -237,7 +569,7 @@ def cancelEmail():
     msg.html += "<p>" + session['apptTime']['start'] + " &ndash; " + session['apptTime']['end'] + "</p>"
     msg.html += "<p><a href=\"" + url_for('site.book')  + "\">"
     msg.html += "Use this link to book a different session</a></p></body>"
-    mail.send(msg)
+    outbox.enqueue(msg) # delivered in the background
     return
 
 
@@ -254,7 +586,7 @@ def rescheduleEmail():
     msg.html += "<p>" + session['apptTime']['start'] + " &ndash; " + session['apptTime']['end'] + "</p>"
     msg.html += "<p><a href=\"" + url_for('site.booked') + '/' + session['apptID'] + "\">"
     msg.html += "To cancel or reschedule, use this link</a></p></body>"
-    mail.send(msg)
+    outbox.enqueue(msg) # delivered in the background
     return
 
 
@@ -267,24 +599,26 @@ def fetchOpenings():
     """
     This view is only ever accessed by JavaScript fetch from the 'book' page
     Gets the available openings for a week and sends them JSONed
+    With ?from=<offset>&weeks=<n> it sends a list of n weeks' openings instead
+    With ?duration=<minutes> the openings are for sessions of that length, rather than the one picked on
+    the 'book' page, and with ?artist=<id> (or ?artist=any) they are that artist's (or any artist's)
     """
     # Connect to calendar or fail gracefully (directing user to Contact Me page)
-    ## Get service from cache, or renew
-    service = cache.get("service")
-    if service is None: # service not created yet or is expired
+    ## Get this worker's service, connecting if needed
+    ## (not until it is needed, so a client that already has the openings costs nothing)
+    service = None
+    def connect():
         try:
-            service = connectToCalendar()
-            cache.set("service", service)
-            current_app.logger.debug("Successfully connected to service")
+            return gcal.getService()
         except Exception as e:
 #            return jsonify(error = e);
             current_app.logger.info("Error while connecting to calendar to get service")
             current_app.logger.error(e)
-    else:
-        current_app.logger.debug("Got service from cache")
+        return None
 
      # Get the calendar's timezone and save in the various forms needed
     if session.get('tzStr') is None or session.get('tzName') is None:
+        service = connect()
         try: # try to query calendar
             tzName = getCalendarTimezone(service) # the IANA timezone name e.g. 'America/Chicago'
             session['tzName'] = tzName
@@ -302,28 +636,53 @@ def fetchOpenings():
         else:
             session['tzStr'] = "the " + tzName + " timezone"
 
-    # Get offset from session
-    offset = session.get('offset')
-    ## Default to 0 if this fails
-    if offset is None:
-        offset = 0
-        session['offset'] = 0
+    # Get the requested range of weeks, defaulting to the session's offset
+    first = request.args.get('from', type=int)
+    weeks = request.args.get('weeks', type=int)
+    if first is None:
+        ## Get offset from session, defaulting to 0 if this fails
+        first = session.get('offset')
+        if first is None:
+            first = 0
+            session['offset'] = 0
+    first = max(first, 0)
+    weeks = min(max(weeks or 1, 1), current_app.config['OPENINGS_MAX_WEEKS'])
+    ranged = request.args.get('weeks') is not None
+    duration = request.args.get('duration', type=int) or sessionDuration()
+    if duration not in slotgrid.durations():
+        return jsonify(error="Sessions of {} minutes can't be booked".format(duration)), 400
+    artistArg = request.args.get('artist')
+    if artistArg is None:
+        artistID = sessionArtist()
+    elif artistArg == 'any':
+        artistID = None
+    else:
+        artistID = request.args.get('artist', type=int)
+        if artistID is None or artists.getArtist(artistID) is None:
+            return jsonify(error="There is no artist {}".format(artistArg)), 400
 
-    # Get the week's information and its openings
+    # If the client already has these openings, tell it so without working them out again
+    ## The validator is taken before computing, so a change made meanwhile is never hidden by it
+    etag = openingsETag(first, weeks, ranged, duration, artistID)
+    if notModified(etag):
+        return validated(current_app.response_class(status=304), etag)
+
+    # Get each week's information and its openings
     ## Use cached values if available, otherwise query again and save
-    week = cache.get("week_{}".format(offset))
-    openings = cache.get("openings_{}".format(offset))
-    if week is None or openings is None:
-        try:
-            week, openings = getOpeningsForWeek(service)
-        except Exception as e:
-#            g.error = True
-            current_app.logger.info("Error while getting the openings")
-            current_app.logger.error(e)
-            return jsonify(error="Error while getting the openings: {}".format(e));
-        else:
-            cache.set("week_{}".format(offset), week)
-            cache.set("openings_{}".format(offset), openings)
+    ## (connecting only then; a failed connection earlier leaves service None to try again)
+    try:
+        results = getCachedOpenings(service, first, weeks, duration, artistID)
+    except Exception as e:
+#        g.error = True
+        current_app.logger.info("Error while getting the openings")
+        current_app.logger.error(e)
+        return jsonify(error="Error while getting the openings: {}".format(e));
+
+    ## A range was asked for, so send every week
+    if ranged:
+        return validated(jsonify(weeks=[{'offset': first + i, 'week': week, 'openings': openings}
+                                        for i, (week, openings) in enumerate(results)]), etag)
+    week, openings = results[0]
 
 ### Practice values ###
 #     g.error = False
@@ -333,7 +692,7 @@ def fetchOpenings():
 ## week = {'Sun': ['May', '09', '2021'], 'Mon': ['May', '10', '2021']}
 ## ... etc. with the year as part of the data
 
-    return jsonify(week=week, openings=openings)
+    return validated(jsonify(week=week, openings=openings), etag)
 
 
 @bp.route('/appointment', methods=['GET'])
@@ -344,27 +703,48 @@ def fetchAppt(apptID=None):
     Book appointment on calendar for given date and time
     Or if an appointment ID is provided, just fetch that information
     """
-    # Get the service to connect to calendar
-    service = cache.get("service")
-    if service is None: # service not created yet or is expired
+    # If an apptID has been provided, fetch that appointment's information
+    if apptID is not None:
+        ## Read it from the ledger, checking it against the calendar in the background if due
         try:
-            service = connectToCalendar()
-            cache.set("service", service)
-            current_app.logger.debug("Successfully connected to service")
+            row = ledger.getAppointment(apptID)
         except Exception as e:
-            current_app.logger.info("Error while connecting to calendar to get service")
+            current_app.logger.info("Error while reading the appointment ledger")
             current_app.logger.error(e)
-            return jsonify(error="Sorry, there was an error while connecting to the calendar.")
-            pass
-    else:
-        current_app.logger.debug("Got service from cache")
-
-    # If an apptID has been provided, fetch that appointment's information
-    if apptID is not None:
-        event = service.events().get(calendarId=CAL_ID, eventId=apptID).execute()
-    #    event['start']['timeZone']
-        eventStart = datetime.fromisoformat(event['start']['dateTime'])
-        eventEnd = datetime.fromisoformat(event['end']['dateTime'])
+            row = None
+        if row is not None:
+            if row['status'] == 'cancelled':
+                return jsonify(error="Sorry, there was an error while looking up your booking.")
+            eventStart = datetime.fromisoformat(row['start_time'])
+            eventEnd = datetime.fromisoformat(row['end_time'])
+            version = row['etag'] or row['updated']
+            session['clientName'] = row['client_name']
+            session['clientEmail'] = row['client_email']
+            calendarId = row['calendar_id'] or CAL_ID
+            if ledger.isStale(row):
+                ledger.reconcileLater(calendarId, apptID)
+        ## Not booked through the site (or not since the ledger was added), so ask Google,
+        ## trying each artist's calendar in turn
+        else:
+            event = None
+            try:
+                service = gcal.getService()
+                calendarIds = [artist.calendarId for artist in artists.getArtists()]
+                for calendarId in calendarIds + [CAL_ID] * (CAL_ID not in calendarIds):
+                    try:
+                        event = service.events().get(calendarId=calendarId, eventId=apptID).execute()
+                        break
+                    except HttpError as e:
+                        if e.resp.status != 404:
+                            raise
+            except Exception as e:
+                current_app.logger.info("Error while getting the event from the calendar")
+                current_app.logger.error(e)
+            if event is None:
+                return jsonify(error="Sorry, there was an error while looking up your booking.")
+            eventStart = datetime.fromisoformat(event['start']['dateTime'])
+            eventEnd = datetime.fromisoformat(event['end']['dateTime'])
+            version = event.get('etag') or event.get('updated')
         current_app.logger.debug("Got event start: {}".format(eventStart))
         current_app.logger.debug("Got event end: {}".format(eventEnd))
 
@@ -379,35 +759,63 @@ def fetchAppt(apptID=None):
         session['apptDate'] = apptDate
         session['apptTime'] = apptTime
         session['apptDT'] = eventStart
+        session['apptMinutes'] = int((eventEnd - eventStart).total_seconds() // 60)
+        session['calendarId'] = calendarId
+        artist = artists.forCalendar(calendarId)
+        session['artistName'] = artist.name if artist is not None else None
 #        Do I need these? (I have the apptID and to reschedule just need to get new DT, Date, Time)
 #        session['clientName'] = event['description'].split(';')[0].replace('Session with ','')
 #        session['clientEmail'] = event['description'].split(';')[1].lstrip()
         session.modified = True # be sure to catch apptTime dict modification
 
-        ## Return the info or an error message
-        if event:
-            return jsonify(apptDate=apptDate, apptTime=apptTime)
-        else:
-            return jsonify(error="Sorry, there was an error while looking up your booking.")
+        ## The session is kept current either way, but the body is only sent if the client lacks it
+        etag = appointmentETag(apptID, version, eventStart.isoformat(), eventEnd.isoformat())
+        if notModified(etag):
+            return validated(current_app.response_class(status=304), etag)
+        return validated(jsonify(apptDate=apptDate, apptTime=apptTime), etag)
 
     # If no apptID, it means a new event is being created and added to the calendar
+    ## Make sure the slot is still ours before spending a calendar insert on it
+    start = slotStart(session.get('apptDT'))
+    length = apptLength()
+    calendarId = session.get('calendarId') or CAL_ID # the artist's, from /bookPost
+    refused = holdSlot(calendarId, start, length)
+    ## then book it before writing to the calendar, under the ID the event will be created with
+    eventID = uuid.uuid4().hex # Google accepts IDs of our own in base32hex, which hex digits are
+    if refused is None:
+        refused = bookSlot(calendarId, start, length, eventID)
+    if refused is not None:
+        return jsonify(error=refused, slotTaken=refused == SLOT_TAKEN)
+
     ## Craft the event
     event = {
+        'id': eventID,
         'summary': "Session with {}".format(session.get('clientName')),
         'description': "Session with {}; {}".format(session.get('clientName'), session.get('clientEmail')),
-        'start': { 'dateTime': session.get('apptDT').isoformat(), 'timeZone': session.get('tzName') },
-        'end': { 'dateTime': (session.get('apptDT')+BOOKING_LEN).isoformat(), 'timeZone': session.get('tzName') }
+        'start': { 'dateTime': start.isoformat(), 'timeZone': session.get('tzName') },
+        'end': { 'dateTime': (start+length).isoformat(), 'timeZone': session.get('tzName') }
     }
 
     ## Connect to calendar and create the event
     try:
-        event = service.events().insert(calendarId=CAL_ID, body=event).execute()
+        service = gcal.getService()
+    except Exception as e:
+        current_app.logger.info("Error while connecting to calendar to get service")
+        current_app.logger.error(e)
+        updateReservation(reservations.releaseAppointment, eventID)
+        return jsonify(error="Sorry, there was an error while connecting to the calendar.")
+    try:
+        event = service.events().insert(calendarId=calendarId, body=event).execute()
     except Exception as e:
         current_app.logger.error(e)
+        updateReservation(reservations.releaseAppointment, eventID)
         return jsonify(error="Sorry, there was an error while booking the appointment.")
 
     ## If event was successfully created, send confirmation email and show confirmation on page
     if event.get('id'):
+        noteBooked(event, calendarId=calendarId) # so the slot is not offered again
+        recordAppointment(event, session.get('tzName'), session.get('clientName'), session.get('clientEmail'),
+                          calendarId)
         ### Save the info for rescheduling or cancelling later
         session['apptID'] = event['id']
         ### /bookPost saved apptDT to session
@@ -419,6 +827,7 @@ def fetchAppt(apptID=None):
             current_app.logger.error(e)
             return jsonify(apptID=session['apptID'], emailError="Sorry, there was an error while sending your confirmation email.")
     else:
+        updateReservation(reservations.releaseAppointment, eventID)
         return jsonify(error="Sorry, there was an error while booking the appointment.")
 
 
@@ -429,63 +838,89 @@ def fetchCancel(apptID):
     Cancels an appointment given the ID
     """
     # Get the service to connect to calendar
-    service = cache.get("service")
-    if service is None: # service not created yet or is expired
-        try:
-            service = connectToCalendar()
-            cache.set("service", service)
-            current_app.logger.debug("Successfully connected to service")
-        except Exception as e:
-            current_app.logger.info("Error while connecting to calendar to get service")
-            current_app.logger.error(e)
-            return jsonify(error="Sorry, there was an error while connecting to the calendar.")
-    else:
-        current_app.logger.debug("Got service from cache")
+    try:
+        service = gcal.getService()
+    except Exception as e:
+        current_app.logger.info("Error while connecting to calendar to get service")
+        current_app.logger.error(e)
+        return jsonify(error="Sorry, there was an error while connecting to the calendar.")
 
-    # Cancel the appointment
+    # Cancel the appointment, on whichever artist's calendar it is
+    calendarId = appointmentCalendar(apptID)
     try:
-        service.events().delete(calendarId=CAL_ID, eventId=apptID).execute()
+        service.events().delete(calendarId=calendarId, eventId=apptID).execute()
     except Exception as e:
         current_app.logger.info("Error while cancelling the event.")
         current_app.logger.error(e)
         return jsonify(error="Sorry, there was an error while cancelling the event.")
+    noteCancelled(apptID, calendarId) # so the slot is offered again
+    updateReservation(reservations.releaseAppointment, apptID)
+    try:
+        ledger.markCancelled(apptID)
+    except Exception as e:
+        current_app.logger.info("Error while recording the cancellation in the appointment ledger")
+        current_app.logger.error(e)
 
     # Send email
     try:
         cancelEmail()
         return jsonify(success=True)
     except Exception as e:
+        current_app.logger.error(e)
         return jsonify(emailError="Sorry, there was an error while sending your confirmation email.")
 
 
 @bp.route('/reschedule/<apptID>', methods=['GET'])
 def fetchReschedule(apptID):
     # Get the service to connect to calendar
-    service = cache.get("service")
-    if service is None: # service not created yet or is expired
-        try:
-            service = connectToCalendar()
-            cache.set("service", service)
-            current_app.logger.debug("Successfully connected to service")
-        except Exception as e:
-            current_app.logger.info("Error while connecting to calendar to get service")
-            current_app.logger.error(e)
-            return jsonify(error="Sorry, there was an error while connecting to the calendar.")
-    else:
-        current_app.logger.debug("Got service from cache")
+    try:
+        service = gcal.getService()
+    except Exception as e:
+        current_app.logger.info("Error while connecting to calendar to get service")
+        current_app.logger.error(e)
+        return jsonify(error="Sorry, there was an error while connecting to the calendar.")
 
     # Update appointment
     try:
-        ## Get the event
-        event = service.events().get(calendarId=CAL_ID, eventId=apptID).execute()
-
-        ## Set updated times
-        event['start'] = { 'dateTime': session['apptDT'].isoformat(), 'timeZone': session['tzName'] }
-        event['end'] = { 'dateTime': (session['apptDT']+BOOKING_LEN).isoformat(), 'timeZone': session['tzName'] }
-
-        ## Update event
-        updated_event = service.events().update(calendarId=CAL_ID, eventId=apptID, body=event).execute()
+        ## Get the old times from the ledger, if it has them
+        oldTimes = None
+        try:
+            row = ledger.getAppointment(apptID)
+            if row is not None:
+                oldTimes = (row['start_time'], row['end_time'])
+        except Exception as e:
+            current_app.logger.info("Error while reading the appointment ledger")
+            current_app.logger.error(e)
+        if oldTimes is None and session.get('oldDT') is not None:
+            oldMinutes = session.get('oldMinutes') or slotgrid.defaultDuration()
+            oldTimes = (session['oldDT'], session['oldDT'] + timedelta(minutes=oldMinutes))
+
+        ## Make sure the new slot is still ours, with the same artist
+        calendarId = appointmentCalendar(apptID)
+        start = slotStart(session['apptDT'])
+        length = apptLength()
+        refused = holdSlot(calendarId, start, length, rescheduling=apptID)
+        ## then move its booking there before the calendar
+        if refused is None:
+            refused = bookSlot(calendarId, start, length, apptID)
+        if refused is not None:
+            return jsonify(error=refused, slotTaken=refused == SLOT_TAKEN)
+
+        ## Update just the event's times with a single patch
+        times = {
+            'start': { 'dateTime': start.isoformat(), 'timeZone': session['tzName'] },
+            'end': { 'dateTime': (start+length).isoformat(), 'timeZone': session['tzName'] }
+        }
+        try:
+            updated_event = service.events().patch(calendarId=calendarId, eventId=apptID, body=times).execute()
+        except Exception:
+            if oldTimes is not None: # it is still at its old times, so its booking goes back there
+                oldStart, oldEnd = (datetime.fromisoformat(t) if isinstance(t, str) else t for t in oldTimes)
+                updateReservation(reservations.rebook, calendarId, oldStart, oldEnd - oldStart, apptID)
+            raise
         current_app.logger.debug("Updated event.")
+        noteBooked(updated_event, oldTimes, calendarId) # frees the old slot and takes the new one
+        recordAppointment(updated_event, session.get('tzName'), calendarId=calendarId)
 
     except Exception as e:
         current_app.logger.debug("Error updating the event.")
@@ -496,6 +931,9 @@ def fetchReschedule(apptID):
     try:
         rescheduleEmail()
         return jsonify(success=True)
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(emailError="Sorry, there was an error while sending your confirmation email.")
 
 #--------------------------------------------------------------------------------------------------#
 #                                          Booking Views                                           #
@@ -510,7 +948,17 @@ def book():
     # Initialize 'offset'; needed if very first time navigating to page
     if session.get('offset') is None:
         session['offset'] = 0
-    return render_template('site/book.html', days=DAYS, timeblocks=TIMEBLOCKS)
+    # Pick the session length to show openings for, with ?duration=<minutes>
+    duration = request.args.get('duration', type=int)
+    session['duration'] = duration if duration in slotgrid.durations() else sessionDuration()
+    # Pick the artist to show openings for, with ?artist=<id> or ?artist=any
+    ## (not while rescheduling; an appointment stays with its artist)
+    if request.args.get('artist') is not None and not session.get('reschedule'):
+        session['artist'] = request.args.get('artist', type=int) # 'any' gives None
+    session['artist'] = sessionArtist()
+    roster = [artist for artist in artists.getArtists() if artist.id is not None]
+    return render_template('site/book.html', days=DAYS, timeblocks=slotgrid.currentGrid().labels,
+                           durations=slotgrid.durations(), artists=roster)
 
 
 @bp.route('/book', methods=['POST'])
@@ -518,9 +966,24 @@ def bookPost():
     # 'POST' was to book an appointment
     if request.form.get('booking'):
         appt = request.form.get('booking')
-        #*** update 2021 to get a Year
-        apptDT = datetime.strptime("{}_{}_{}".format('2021', appt, '00'), '%Y_%b_%d_%H%M_%S')
+        tzInfo = tz.gettz(session['tzName']) if session.get('tzName') is not None else None
+        apptDT = pickedSlot(appt, session.get('offset') or 0, tzInfo)
+        ## Hold the slot while the client confirms it, with the artist they picked or the first one free,
+        ## unless someone else just took it
+        rescheduling = session.get('apptID') if session.get('reschedule') else None
+        if session.get('tzName') is not None:
+            artist, refused = holdWithArtist(apptDT, sessionDuration(), rescheduling)
+            if artist is None:
+                flash(refused, 'alert-danger')
+                return redirect(url_for('site.book'))
+        elif rescheduling is not None:
+            artist = artists.forCalendar(appointmentCalendar(rescheduling)) or artists.DEFAULT_ARTIST
+        else:
+            artist = artists.getArtist(sessionArtist()) or artists.getArtists()[0]
+        session['calendarId'] = artist.calendarId
+        session['artistName'] = artist.name
         session['apptDT'] = apptDT # save to session
+        session['apptMinutes'] = sessionDuration()
         return redirect(url_for('site.booking'))
 
     # 'POST' was to scroll through the schedule
@@ -548,13 +1011,13 @@ def booking():
     """
     # Datetime object for the appointment
     apptDT = session['apptDT']
+    apptEnd = apptDT + apptLength()
 
     # Craft human-friendly appointment date and times
     dStr = {1: 'st', 2: 'nd', 3: 'rd', 4: 'th', 5: 'th', 6: 'th', 7: 'th', 8: 'th', 9: 'th', 0: 'th'}
     apptDate = apptDT.strftime("%A, %B %d") + dStr[int(apptDT.strftime("%d")[1])]
     apptTime = {'start' : apptDT.strftime("%I:%M").lstrip('0')+apptDT.strftime("%p").lower(),
-                'end': (apptDT + BOOKING_LEN).strftime("%I:%M").lstrip('0') +
-                       (apptDT + BOOKING_LEN).strftime("%p").lower()}
+                'end': apptEnd.strftime("%I:%M").lstrip('0') + apptEnd.strftime("%p").lower()}
     session['apptDate'] = apptDate
     session['apptTime'] = apptTime
     session.modified = True # be sure to catch apptTime dict modification
@@ -611,8 +1074,12 @@ def rescheduleStart():
     session['reschedule'] = True
     # Save these in case I need them? ***
     session['oldDT'] = session['apptDT']
+    session['oldMinutes'] = session.get('apptMinutes')
+    session['duration'] = session.get('apptMinutes') or sessionDuration() # offer the same length by default
     session['oldDate'] = session['apptDate']
     session['oldTime'] = session['apptTime']
+    artist = artists.forCalendar(appointmentCalendar(session['apptID']))
+    session['artist'] = artist.id if artist is not None else None # show their openings
     return redirect(url_for('site.book'))
 
 
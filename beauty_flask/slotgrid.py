@@ -0,0 +1,164 @@
+#--------------------------------------------------------------------------------------------------#
+#                                            Slot Grid                                             #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Model a day as a grid of SLOT_MINUTES blocks, from SLOT_DAY_START to SLOT_DAY_END
+Blocks are integer minute offsets from midnight, and a day's free time is a bitmask with bit k standing
+for block k, so a whole day is checked with a few integer operations. A session of any length fits at
+every block where a sliding window of its blocks is all free, found by ANDing the mask with shifted
+copies of itself (doubling the window each time) rather than checking each start separately
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+
+from flask import current_app
+
+
+class Grid(namedtuple('Grid', ['step', 'start', 'end'])):
+    """
+    A day as blocks of 'step' minutes, from minute 'start' up to minute 'end' after midnight
+    """
+    __slots__ = ()
+
+    @property
+    def size(self):
+        return (self.end - self.start) // self.step
+
+    @property
+    def minutes(self):
+        """
+        Minute after midnight each block starts at, e.g. (480, 495, ...)
+        """
+        return _minutes(self)
+
+    @property
+    def labels(self):
+        """
+        Each block as 'hhmm', e.g. ('0800', '0815', ...), as the booking page and admin grid show them
+        """
+        return _labels(self)
+
+    @property
+    def index(self):
+        """
+        Block number of each label, e.g. {'0800': 0, '0815': 1, ...}
+        """
+        return _index(self)
+
+    def blocks(self, minutes):
+        """
+        Number of blocks a session of 'minutes' takes up
+        """
+        return -(-minutes // self.step)
+
+
+@lru_cache(maxsize=None)
+def _minutes(grid):
+    return tuple(range(grid.start, grid.start + grid.size * grid.step, grid.step))
+
+
+@lru_cache(maxsize=None)
+def _labels(grid):
+    return tuple('{:02d}{:02d}'.format(m // 60, m % 60) for m in _minutes(grid))
+
+
+@lru_cache(maxsize=None)
+def _index(grid):
+    return {label: k for k, label in enumerate(_labels(grid))}
+
+
+def parseTime(hhmm):
+    """
+    Minutes after midnight of an 'hhmm' string, e.g. '0830' -> 510
+    """
+    return int(hhmm[:2]) * 60 + int(hhmm[2:])
+
+
+def currentGrid():
+    """
+    The grid configured for the current app
+    """
+    config = current_app.config
+    return Grid(config['SLOT_MINUTES'], parseTime(config['SLOT_DAY_START']), parseTime(config['SLOT_DAY_END']))
+
+
+def durations():
+    """
+    The session lengths in minutes clients can book, e.g. (30, 60, 90, 120)
+    """
+    return tuple(current_app.config['SESSION_DURATIONS'])
+
+
+def defaultDuration():
+    return current_app.config['SESSION_DEFAULT_DURATION']
+
+
+#----------------------------------------#
+#               Day masks                #
+#----------------------------------------#
+
+def spanMask(grid, start, end):
+    """
+    Mask of every block overlapping the minutes [start, end), counted from the grid's first block
+    """
+    first = max(start // grid.step, 0)
+    last = min(-(-end // grid.step), grid.size)
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def dayMask(grid, spans):
+    """
+    Mask of the blocks lying entirely within the given (start, end) spans of minutes after midnight
+    """
+    mask = 0
+    for start, end in spans:
+        first = max(-(-(start - grid.start) // grid.step), 0)
+        last = min((end - grid.start) // grid.step, grid.size)
+        if last > first:
+            mask |= ((1 << (last - first)) - 1) << first
+    return mask
+
+
+def fits(mask, blocks):
+    """
+    Mask of every block at which 'blocks' blocks in a row are set in mask: a sliding window of that
+    width, worked out in O(log blocks) shifts
+    """
+    if blocks <= 0:
+        return mask
+    width = 1
+    while width < blocks and mask:
+        shift = min(width, blocks - width)
+        mask &= mask >> shift # now each bit stands for a window of width + shift blocks
+        width += shift
+    return mask
+
+
+def maskLabels(grid, mask):
+    """
+    The 'hhmm' labels of the blocks set in mask, in order
+    """
+    labels = grid.labels
+    found = []
+    while mask:
+        low = mask & -mask
+        found.append(labels[low.bit_length() - 1])
+        mask ^= low
+    return found
+
+
+def labelsMask(grid, labels):
+    """
+    Mask of the blocks with the given 'hhmm' labels; labels not on the grid are left out
+    """
+    index = grid.index
+    mask = 0
+    for label in labels:
+        k = index.get(label)
+        if k is not None:
+            mask |= 1 << k
+    return mask
@@ -0,0 +1,141 @@
+#--------------------------------------------------------------------------------------------------#
+#                                   Calendar Push Notifications                                    #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Receive Google Calendar push notifications (events().watch) and invalidate exactly the cached weeks
+that changed, so the openings cache can keep a long timeout and still be correct
+"""
+
+import secrets
+import time
+import uuid
+
+import click
+from flask import Blueprint, current_app, request
+from flask.cli import with_appcontext
+
+from .db import get_db
+from . import artists
+from . import gcal
+from . import mirror
+from . import weekcache
+
+# Create a blueprint named 'webhook'
+bp = Blueprint('webhook', __name__, url_prefix='/webhook')
+
+
+#--------------------------------------------------------------------------------------------------#
+#                                          Watch Channels                                          #
+#--------------------------------------------------------------------------------------------------#
+
+def watchCalendar(service, calendarId):
+    """
+    Open a new push notification channel for the calendar's events and record it
+    Returns the channel row's values as a dict
+    """
+    channel = {
+        'id': str(uuid.uuid4()),
+        'type': 'web_hook',
+        'address': current_app.config['CALENDAR_WEBHOOK_URL'],
+        'token': secrets.token_urlsafe(32),
+        'params': {'ttl': str(current_app.config['CALENDAR_WATCH_TTL'])}
+    }
+    result = service.events().watch(calendarId=calendarId, body=channel).execute()
+
+    row = {'id': result['id'], 'calendar_id': calendarId, 'resource_id': result['resourceId'],
+           'token': channel['token'], 'expiration': int(result['expiration']) // 1000} # ms -> s
+    db = get_db()
+    with db:
+        db.execute('INSERT INTO watch_channel (id, calendar_id, resource_id, token, expiration)'
+                   ' VALUES (:id, :calendar_id, :resource_id, :token, :expiration)', row)
+    current_app.logger.debug("Opened watch channel {} for {}".format(row['id'], calendarId))
+    return row
+
+
+def stopChannel(service, channel):
+    """
+    Stop a push notification channel and forget it
+    """
+    try:
+        service.channels().stop(body={'id': channel['id'], 'resourceId': channel['resource_id']}).execute()
+    except Exception as e: # it may have already expired on Google's side
+        current_app.logger.info("Error while stopping watch channel {}".format(channel['id']))
+        current_app.logger.error(e)
+    db = get_db()
+    with db:
+        db.execute('DELETE FROM watch_channel WHERE id = ?', (channel['id'],))
+    return
+
+
+def renewChannels(service, calendarId):
+    """
+    Make sure the calendar has a channel that outlives CALENDAR_WATCH_RENEW_BEFORE seconds
+    A replacement is opened before the old channel is stopped so no notification is missed
+    Returns True if a new channel was opened
+    """
+    db = get_db()
+    channels = db.execute('SELECT * FROM watch_channel WHERE calendar_id = ? ORDER BY expiration DESC',
+                          (calendarId,)).fetchall()
+    renewBy = time.time() + current_app.config['CALENDAR_WATCH_RENEW_BEFORE']
+    if channels and channels[0]['expiration'] > renewBy:
+        return False
+
+    watchCalendar(service, calendarId)
+    for channel in channels:
+        stopChannel(service, channel)
+    return True
+
+
+# define a command line command 'renew-watch' to run from a scheduler such as cron
+@click.command('renew-watch')
+@with_appcontext
+def renew_watch_command():
+    """
+    Open or renew the Google Calendar push notification channel of each artist's calendar
+    """
+    if not current_app.config['CALENDAR_WEBHOOK_URL']:
+        raise click.ClickException('CALENDAR_WEBHOOK_URL is not configured.')
+    service = gcal.getService()
+    for artist in artists.getArtists():
+        if renewChannels(service, artist.calendarId):
+            click.echo('Renewed the watch channel for {}.'.format(artist.calendarId))
+        else:
+            click.echo('Watch channel for {} is still current.'.format(artist.calendarId))
+    return
+
+
+#--------------------------------------------------------------------------------------------------#
+#                                          Webhook Views                                           #
+#--------------------------------------------------------------------------------------------------#
+
+@bp.route('/calendar', methods=['POST'])
+def calendarNotify():
+    """
+    Google Calendar posts here when the watched calendar changes
+    The notification is all headers; the changed events are found with an incremental mirror sync
+    """
+    channelId = request.headers.get('X-Goog-Channel-ID')
+    channel = get_db().execute('SELECT * FROM watch_channel WHERE id = ?', (channelId,)).fetchone()
+    if channel is None or not secrets.compare_digest(
+            channel['token'], request.headers.get('X-Goog-Channel-Token', '')):
+        current_app.logger.info("Ignoring notification for unknown channel {}".format(channelId))
+        return '', 404 # tells Google to stop sending for this channel
+
+    state = request.headers.get('X-Goog-Resource-State')
+    if state == 'sync': # the handshake sent when a channel opens
+        return '', 204
+
+    # Find what changed and invalidate just those weeks
+    try:
+        if current_app.config['CALENDAR_MIRROR']:
+            spans = mirror.syncCalendar(gcal.getService(), channel['calendar_id'])
+        else:
+            spans = None # no way to tell which events changed
+        weekcache.invalidate(spans)
+    except Exception as e:
+        current_app.logger.info("Error while handling calendar notification, invalidating all openings")
+        current_app.logger.error(e)
+        weekcache.invalidate()
+    return '', 204
+
@@ -0,0 +1,296 @@
+#--------------------------------------------------------------------------------------------------#
+#                                          Openings Cache                                          #
+#--------------------------------------------------------------------------------------------------#
+
+"""
+Cache each week's openings under its timezone, session length and absolute start date, not the relative
+session offset
+Whole weeks are cached and the "now" cutoff is applied when reading, so this week's entry stays valid
+as time passes; bookings patch the affected day and cancellations drop just the affected week
+A week's entry holds every artist's openings, {artistID: openings}; one artist's are picked, or all are
+merged for "any artist", when reading, so a booking only patches its own artist's openings
+Every write also changes a generation token, which /openings uses to validate conditional requests
+Each week also keeps a last known good copy for OPENINGS_STALE_TIMEOUT, served straight away once the
+fresh entry has expired (or can't be recomputed, e.g. while Google is down) as a background thread
+brings it up to date
+"""
+
+import secrets
+import threading
+from datetime import datetime, timedelta
+
+from dateutil import tz
+from flask import current_app
+
+from .extensions import cache
+from .openings import DAYS, pickOpenings
+from . import metrics
+from . import slotgrid
+from . import singleflight
+
+TZNAMES_KEY = "openings_tznames" # every timezone that has cached weeks, so they can all be invalidated
+GENERATION_KEY = "openings_generation" # changes whenever any cached week is written or dropped
+
+_revalidating = set() # first week keys this process is recomputing in the background
+_revalidatingLock = threading.Lock()
+
+
+def cacheKey(tzName, duration, sunday):
+    """
+    Cache key for the week starting on the given Sunday (date or datetime) in the given timezone,
+    with openings for sessions of 'duration' minutes
+    """
+    if isinstance(sunday, datetime):
+        sunday = sunday.date()
+    return "openings_{}_{}_{}".format(tzName, duration, sunday.isoformat())
+
+
+def staleKey(key):
+    """
+    Cache key for the last known good copy of the week cached under key
+    """
+    return "stale_" + key
+
+
+def startOfWeek(dt):
+    """
+    Midnight at the start of the Sunday of dt's week, in dt's timezone
+    """
+    sunday = dt.date() - timedelta(days=int(dt.strftime('%w')))
+    return datetime(sunday.year, sunday.month, sunday.day, 00, 00, 00, 000000, dt.tzinfo)
+
+
+def filterPast(openings, sunday, now):
+    """
+    Drop the days and timeblocks of a whole week's openings that are already in the past at 'now'
+    """
+    if now < sunday: # a future week
+        return openings
+    today = int(now.strftime('%w'))
+    nowTb = now.strftime('%H%M')
+    filtered = {}
+    for i in range(today, 7): # days before today are left out entirely, as for the current week
+        d = DAYS[i]
+        if d not in openings:
+            continue
+        if i == today:
+            filtered[d] = [tb for tb in openings[d] if tb > nowTb]
+        else:
+            filtered[d] = openings[d]
+    return filtered
+
+
+def _timeout():
+    return current_app.config['OPENINGS_CACHE_TIMEOUT']
+
+
+def _staleTimeout():
+    return current_app.config['OPENINGS_STALE_TIMEOUT']
+
+
+def _bump():
+    """
+    Start a new generation of cached openings
+    It expires like a cached week does, so once nothing has been written for that long it changes anyway
+    """
+    token = secrets.token_hex(8)
+    cache.set(GENERATION_KEY, token, timeout=_timeout())
+    return token
+
+
+def generation():
+    """
+    A token identifying the current contents of the openings cache
+    Any change to a cached week (or the expiry of everything cached) gives a new token
+    """
+    return cache.get(GENERATION_KEY) or _bump()
+
+
+def _registerTz(tzName):
+    """
+    Remember that this timezone has cached weeks
+    """
+    tzNames = cache.get(TZNAMES_KEY) or []
+    if tzName not in tzNames:
+        cache.set(TZNAMES_KEY, tzNames + [tzName], timeout=0)
+    return
+
+
+def putWeeks(tzName, duration, sunday, computed):
+    """
+    Cache whole weeks of (week, {artistID: openings}) in order from the given Sunday, for a fresh
+    OPENINGS_CACHE_TIMEOUT
+    The generation only changes if a week's openings did, so clients' validators survive a refresh
+    Returns whether any cached week changed
+    """
+    if isinstance(sunday, datetime):
+        sunday = sunday.date()
+    entries = {cacheKey(tzName, duration, sunday + timedelta(weeks=i)): entry for i, entry in enumerate(computed)}
+    stale = {staleKey(key): entry for key, entry in entries.items()}
+    changed = cache.get_many(*stale) != list(entries.values())
+    cache.set_many(entries, timeout=_timeout())
+    cache.set_many(stale, timeout=_staleTimeout())
+    _registerTz(tzName)
+    if changed:
+        _bump()
+    else:
+        cache.set(GENERATION_KEY, generation(), timeout=_timeout()) # keep the current one alive as long
+    return changed
+
+
+def _revalidate(tzName, duration, sunday, count, revalidate):
+    """
+    Recompute and cache 'count' weeks from sunday in a background thread, unless one already is
+    """
+    key = cacheKey(tzName, duration, sunday)
+    with _revalidatingLock:
+        if key in _revalidating:
+            return
+        _revalidating.add(key)
+    app = current_app._get_current_object()
+
+    def work():
+        try:
+            with app.app_context():
+                try:
+                    singleflight.run(key, lambda: putWeeks(tzName, duration, sunday, revalidate(sunday, count)),
+                                     lambda: cache.get(key), 'openings')
+                except Exception as e:
+                    app.logger.info("Error while revalidating stale openings")
+                    app.logger.error(e)
+        finally:
+            with _revalidatingLock:
+                _revalidating.discard(key)
+        return
+
+    threading.Thread(target=work, name='revalidate', daemon=True).start()
+    return
+
+
+def getWeeks(tzName, duration, sundays, compute, now, revalidate=None, artistID=None):
+    """
+    Get (week, openings) for sessions of 'duration' minutes for each Sunday-midnight datetime in sundays,
+    filtered for 'now': the openings of the artist with artistID, or with None those of any artist
+    On a miss, compute(firstSunday, count) must return 'count' whole weeks of (week, {artistID: openings});
+    the missing weeks and the next OPENINGS_PREFETCH_WEEKS are computed together and cached, once however
+    many requests miss them at the same time
+    If every missing week has a last known good copy, those are served instead, and are brought up to
+    date by revalidate(firstSunday, count) in a background thread (with no revalidate, they are only
+    served if compute fails); revalidate works like compute but must not rely on the request
+    """
+    keys = [cacheKey(tzName, duration, s) for s in sundays]
+    with metrics.stage('cache'):
+        entries = cache.get_many(*keys)
+    missing = [i for i, entry in enumerate(entries) if entry is None]
+    metrics.cacheLookup('openings', hits=len(entries) - len(missing), misses=len(missing))
+    if missing:
+        ## prefetch ahead on a miss so paging with 'Next' is served from the cache
+        first = missing[0]
+        count = max(missing[-1] + 1, first + current_app.config['OPENINGS_PREFETCH_WEEKS']) - first
+        stale = cache.get_many(*(staleKey(keys[i]) for i in missing))
+        haveStale = None not in stale
+
+        def computeAndPut():
+            computed = compute(sundays[first], count)
+            putWeeks(tzName, duration, sundays[first], computed)
+            return computed
+
+        def cached():
+            found = cache.get_many(*keys[first:])
+            return None if None in found else found
+
+        if haveStale and revalidate is not None:
+            _revalidate(tzName, duration, sundays[first], count, revalidate)
+        else:
+            try:
+                ## concurrent misses from the same first week wait for one computation
+                computed = singleflight.run(keys[first], computeAndPut, cached, 'openings')
+            except Exception as e:
+                if not haveStale:
+                    raise
+                current_app.logger.info("Error while computing openings, serving the last known good ones")
+                current_app.logger.error(e)
+            else:
+                stale = None
+                for i, entry in enumerate(computed[:len(sundays) - first], start=first):
+                    entries[i] = entry
+        if stale is not None:
+            metrics.cacheLookup('openings_stale', hits=len(missing))
+            for i, entry in zip(missing, stale):
+                entries[i] = entry
+
+    grid = slotgrid.currentGrid()
+    return [(week, filterPast(pickOpenings(grid, byArtist, artistID), sunday, now))
+            for sunday, (week, byArtist) in zip(sundays, entries)]
+
+
+def invalidate(spans=None):
+    """
+    Drop the cached weeks covering the given (start, end) spans, in every cached timezone
+    Spans are ISO strings or aware datetimes; with None, drop every week up to the booking horizon
+    """
+    horizon = current_app.config['OPENINGS_MAX_WEEKS'] + current_app.config['OPENINGS_PREFETCH_WEEKS']
+    durations = slotgrid.durations()
+    keys = set()
+    for tzName in cache.get(TZNAMES_KEY) or []:
+        tzInfo = tz.gettz(tzName)
+        if spans is None:
+            sunday = startOfWeek(datetime.now(tzInfo)).date()
+            keys.update(cacheKey(tzName, duration, sunday + timedelta(weeks=i))
+                        for i in range(-1, horizon) for duration in durations)
+            continue
+        for start, end in spans:
+            if isinstance(start, str):
+                start = datetime.fromisoformat(start)
+            if isinstance(end, str):
+                end = datetime.fromisoformat(end)
+            sunday = startOfWeek(start.astimezone(tzInfo)).date()
+            last = startOfWeek(end.astimezone(tzInfo)).date()
+            while sunday <= last:
+                keys.update(cacheKey(tzName, duration, sunday) for duration in durations)
+                sunday += timedelta(weeks=1)
+    if keys:
+        cache.delete_many(*keys, *(staleKey(key) for key in keys)) # known to be out of date, so never served stale
+        _bump()
+    current_app.logger.debug("Invalidated cached openings {}".format(sorted(keys)))
+    return
+
+
+def markBooked(start, end, artistID=None):
+    """
+    Patch the cached weeks so no opening of the artist overlapping the new booking from start to end is
+    offered, for any session length
+    """
+    if isinstance(start, str):
+        start = datetime.fromisoformat(start)
+    if isinstance(end, str):
+        end = datetime.fromisoformat(end)
+    grid = slotgrid.currentGrid()
+    durations = slotgrid.durations()
+    for tzName in cache.get(TZNAMES_KEY) or []:
+        tzInfo = tz.gettz(tzName)
+        currDate = start.astimezone(tzInfo).date()
+        while currDate <= end.astimezone(tzInfo).date(): # every day the booking touches
+            sunday = currDate - timedelta(days=int(currDate.strftime('%w')))
+            d = currDate.strftime('%a')
+            midnight = datetime(currDate.year, currDate.month, currDate.day, 00, 00, 00, 000000, tzInfo)
+            patched = False
+            for duration in durations:
+                blocked = set()
+                for tb, tbMin in zip(grid.labels, grid.minutes):
+                    slotStart = midnight + timedelta(minutes=tbMin)
+                    if slotStart < end and slotStart + timedelta(minutes=duration) > start: # overlaps the booking
+                        blocked.add(tb)
+                key = cacheKey(tzName, duration, sunday)
+                for entryKey, timeout in ((key, _timeout()), (staleKey(key), _staleTimeout())):
+                    entry = cache.get(entryKey)
+                    if entry is not None and artistID in entry[1]:
+                        week, byArtist = entry
+                        openings = byArtist[artistID]
+                        openings[d] = [tb for tb in openings.get(d, []) if tb not in blocked]
+                        cache.set(entryKey, (week, byArtist), timeout=timeout)
+                        patched = True
+            if patched:
+                _bump()
+            currDate += timedelta(days=1)
+    return
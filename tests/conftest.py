@@ -0,0 +1,93 @@
+import threading
+from collections import Counter
+from datetime import datetime
+
+import pytest
+from dateutil import tz
+
+from beauty_flask import create_app, gcal
+
+
+class FakeRequest:
+    def __init__(self, run):
+        self.run = run
+
+    def execute(self):
+        return self.run()
+
+
+class FakeCalendar:
+    """
+    A stand-in for the calendar service the booking views use: events inserted, got, patched and deleted
+    in a dict, counting each call; methods named in 'failing' (e.g. 'events.patch') raise instead
+    """
+    def __init__(self):
+        self.store = {}
+        self.calls = Counter()
+        self.failing = set()
+        self.lock = threading.Lock()
+
+    def events(self):
+        return self
+
+    def _request(self, method, run):
+        with self.lock:
+            self.calls[method] += 1
+
+        def execute():
+            if method in self.failing:
+                raise ConnectionError("{} failed".format(method))
+            with self.lock:
+                return run()
+        return FakeRequest(execute)
+
+    def _changed(self, event):
+        event.update(etag='"{}"'.format(sum(self.calls.values())), updated=datetime.now(tz.UTC).isoformat())
+        self.store[event['id']] = event
+        return dict(event)
+
+    def insert(self, calendarId, body):
+        eventID = body.get('id') or 'event{}'.format(len(self.store) + 1)
+        return self._request('events.insert', lambda: self._changed(dict(body, id=eventID, status='confirmed')))
+
+    def get(self, calendarId, eventId):
+        return self._request('events.get', lambda: dict(self.store[eventId]))
+
+    def patch(self, calendarId, eventId, body):
+        return self._request('events.patch', lambda: self._changed(dict(self.store[eventId], **body)))
+
+    def delete(self, calendarId, eventId):
+        return self._request('events.delete', lambda: self.store.pop(eventId) and '')
+
+
+@pytest.fixture
+def app(tmp_path):
+    """
+    An app on a fresh database in a temporary instance folder, which startup migrates to the current schema
+    """
+    app = create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'test',
+        'DATABASE': str(tmp_path / 'test.sqlite'),
+        'CACHE_TYPE': 'SimpleCache',
+        'MAIL_OUTBOX_WORKER': False,
+        'OPENINGS_REFRESH': False,
+        'PAGE_CACHE': False,
+    })
+    app.instance_path = str(tmp_path)
+    yield app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def calendar(monkeypatch):
+    """
+    A FakeCalendar handed out by gcal.getService
+    """
+    calendar = FakeCalendar()
+    monkeypatch.setattr(gcal, 'getService', lambda: calendar)
+    return calendar
@@ -0,0 +1,33 @@
+"""
+Busy time listed from a calendar, against googleapiclient's own HTTP mock
+"""
+
+import json
+from datetime import datetime
+
+from dateutil import tz
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpMockSequence
+
+from beauty_flask import busytime
+
+CAL_ID = 'artist@example.com'
+OK = {'status': '200'}
+
+
+def test_listed_all_day_events_span_days_in_the_calendars_timezone(app):
+    pages = [
+        {'items': [{'start': {'dateTime': '2030-01-07T10:00:00-06:00'}, 'end': {'dateTime': '2030-01-07T11:00:00-06:00'}}],
+         'nextPageToken': 'page2', 'timeZone': 'America/Chicago'},
+        {'items': [{'start': {'date': '2030-01-10'}, 'end': {'date': '2030-01-11'}},
+                   {'start': {'date': '2030-01-11'}, 'end': {'date': '2030-01-12'}, 'transparency': 'transparent'}],
+         'timeZone': 'America/Chicago'},
+    ]
+    http = HttpMockSequence([(OK, json.dumps(page)) for page in pages])
+    service = build('calendar', 'v3', http=http, static_discovery=True)
+    viewer = tz.gettz('Asia/Tokyo') # the client looking at openings is far from the artist
+    with app.app_context():
+        spans = busytime.listBusy(service, CAL_ID, datetime(2030, 1, 6, tzinfo=viewer), datetime(2030, 1, 13, tzinfo=viewer))
+    chicago = tz.gettz('America/Chicago')
+    assert spans == [('2030-01-07T10:00:00-06:00', '2030-01-07T11:00:00-06:00'),
+                     (datetime(2030, 1, 10, tzinfo=chicago), datetime(2030, 1, 11, tzinfo=chicago))] # not Tokyo's midnight
@@ -0,0 +1,66 @@
+"""
+Migrating the database keeps existing data and upgrades tables made by an older schema
+"""
+
+import sqlite3
+
+from beauty_flask import artists, create_app, db
+
+
+def test_migrating_again_keeps_existing_data(app):
+    with app.app_context():
+        conn = db.get_db()
+        with conn:
+            conn.execute("INSERT INTO admin (username, password) VALUES ('admin', 'hash')")
+        db.init_db()
+        db.migrate_db()
+        assert conn.execute('SELECT username FROM admin').fetchall()[0]['username'] == 'admin'
+
+
+def test_startup_creates_missing_tables(app):
+    with app.app_context():
+        conn = db.get_db()
+        with conn:
+            conn.execute('DROP TABLE outbox')
+    create_app({'TESTING': True, 'DATABASE': app.config['DATABASE'], 'MAIL_OUTBOX_WORKER': False,
+                'OPENINGS_REFRESH': False}) # a restart
+    with app.app_context():
+        assert 'subject' in db.columns(db.get_db(), 'outbox')
+
+
+def test_startup_upgrades_tables_made_before_artists(tmp_path):
+    database = str(tmp_path / 'old.sqlite')
+    conn = sqlite3.connect(database)
+    conn.executescript("""
+        CREATE TABLE appointment (id TEXT PRIMARY KEY, start_time TEXT NOT NULL, end_time TEXT NOT NULL, tz_name TEXT,
+          client_name TEXT, client_email TEXT, status TEXT NOT NULL DEFAULT 'booked', etag TEXT, updated TEXT,
+          synced_at INTEGER NOT NULL);
+        CREATE TABLE reservation (unit_start INTEGER PRIMARY KEY, token TEXT NOT NULL,
+          status TEXT NOT NULL DEFAULT 'held', appt_id TEXT, expires INTEGER);
+        CREATE INDEX reservation_appt ON reservation (appt_id);
+        INSERT INTO appointment (id, start_time, end_time, synced_at)
+          VALUES ('appt1', '2030-01-07T10:00:00-06:00', '2030-01-07T11:00:00-06:00', 0);
+        INSERT INTO reservation (unit_start, token, status, appt_id) VALUES (1894032000, 'token', 'booked', 'appt1');
+    """)
+    conn.close()
+
+    app = create_app({'TESTING': True, 'DATABASE': database, 'MAIL_OUTBOX_WORKER': False, 'OPENINGS_REFRESH': False})
+    with app.app_context():
+        conn = db.get_db()
+        assert 'calendar_id' in db.columns(conn, 'appointment')
+        assert [tuple(row) for row in conn.execute('SELECT id, calendar_id FROM appointment')] == [('appt1', None)]
+        assert [tuple(row) for row in conn.execute('SELECT calendar_id, unit_start, appt_id FROM reservation')] == [
+            (artists.DEFAULT_CALENDAR_ID, 1894032000, 'appt1')]
+        assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'reservation_appt'").fetchone()[0] == 1
+        assert artists.getArtists() == [artists.DEFAULT_ARTIST]
+        db.migrate_db() # a no-op now
+        assert conn.execute('SELECT COUNT(*) FROM reservation').fetchone()[0] == 1
+
+
+def test_artists_default_without_an_artist_table(tmp_path):
+    app = create_app({'TESTING': True, 'DATABASE': str(tmp_path / 'empty.sqlite'), 'DATABASE_MIGRATE': False,
+                      'MAIL_OUTBOX_WORKER': False, 'OPENINGS_REFRESH': False})
+    with app.app_context():
+        assert artists.getArtists() == [artists.DEFAULT_ARTIST]
+        assert artists.forCalendar(artists.DEFAULT_CALENDAR_ID) == artists.DEFAULT_ARTIST
+        assert artists.forCalendar('someone@example.com') is None
@@ -0,0 +1,79 @@
+"""
+Conditional GETs of openings and appointments: a client that already has the response gets a 304
+without anything being worked out again, until the weeks asked for, the openings or the event change
+"""
+
+from datetime import timedelta
+
+from beauty_flask import site, slotgrid, weekcache
+from beauty_flask import openings as engine
+from beauty_flask.openings import DAYS
+
+
+def openingsClient(app, monkeypatch):
+    """
+    A client with a timezone in its session, and openings computed without a calendar, counting each time
+    """
+    calls = []
+
+    def computeWeeks(service, sunday, weeks, duration):
+        calls.append(sunday)
+        grid = slotgrid.currentGrid()
+        return [(engine.weekInfo(sunday + timedelta(weeks=i)), {None: {d: list(grid.labels) for d in DAYS}})
+                for i in range(weeks)]
+    monkeypatch.setattr(site, 'computeWeeks', computeWeeks)
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess.update(tzName='America/Chicago', tzStr='Central Time', offset=1)
+    return client, calls
+
+
+def test_openings_already_fetched_are_not_modified(app, calendar, monkeypatch):
+    client, calls = openingsClient(app, monkeypatch)
+    client.get('/openings') # its validator predates the weeks it cached, so it is never matched
+    first = client.get('/openings')
+    assert first.status_code == 200 and first.headers['ETag']
+    assert 'no-cache' in first.headers['Cache-Control'] and 'private' in first.headers['Cache-Control']
+    computed = len(calls)
+
+    again = client.get('/openings', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304 and not again.get_data()
+    assert again.headers['ETag'] == first.headers['ETag']
+    assert len(calls) == computed
+
+    ## another week shown is another response
+    other = client.get('/openings?from=2', headers={'If-None-Match': first.headers['ETag']})
+    assert other.status_code == 200 and other.headers['ETag'] != first.headers['ETag']
+    assert other.get_json()['week'] != first.get_json()['week']
+
+
+def test_openings_are_sent_again_once_a_booking_changes_them(app, calendar, monkeypatch):
+    client, calls = openingsClient(app, monkeypatch)
+    client.get('/openings')
+    first = client.get('/openings')
+    computed = len(calls)
+    with app.app_context():
+        weekcache.invalidate()
+
+    changed = client.get('/openings', headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200 and changed.headers['ETag'] != first.headers['ETag']
+    assert len(calls) > computed
+
+
+def test_an_appointment_already_fetched_is_not_modified_until_its_event_changes(app, calendar):
+    calendar.store['appt1'] = {'id': 'appt1', 'etag': '"1"', 'status': 'confirmed',
+                               'start': {'dateTime': '2030-01-07T10:00:00-06:00'},
+                               'end': {'dateTime': '2030-01-07T11:00:00-06:00'}}
+    client = app.test_client()
+    first = client.get('/appointment/appt1')
+    assert first.status_code == 200 and first.get_json()['apptTime'] == {'start': '10:00am', 'end': '11:00am'}
+
+    again = client.get('/appointment/appt1', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    with client.session_transaction() as sess:
+        assert sess['apptID'] == 'appt1' # the session is kept current all the same
+
+    calendar.store['appt1'].update(etag='"2"', end={'dateTime': '2030-01-07T11:30:00-06:00'})
+    moved = client.get('/appointment/appt1', headers={'If-None-Match': first.headers['ETag']})
+    assert moved.status_code == 200 and moved.get_json()['apptTime']['end'] == '11:30am'
@@ -0,0 +1,93 @@
+"""
+The calendar circuit breaker, against googleapiclient's own HTTP mock: opening after failures in a row,
+letting one probe through after the backoff, and closing again once a probe succeeds
+"""
+
+import json
+import time
+
+import pytest
+from googleapiclient.discovery import build_from_document
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpMockSequence
+
+from beauty_flask import gcal, metrics
+
+CAL_ID = 'artist@example.com'
+OK = ({'status': '200'}, json.dumps({'id': 'event1'}))
+DOWN = ({'status': '503'}, json.dumps({'error': {'code': 503, 'message': 'Backend Error'}}))
+NOT_FOUND = ({'status': '404'}, json.dumps({'error': {'code': 404, 'message': 'Not Found'}}))
+
+
+@pytest.fixture
+def breaker(app, monkeypatch):
+    """
+    A fresh breaker, opening after 2 failures for 5s, then 8s at most, on a clock the test moves
+    """
+    app.config.update(CALENDAR_BREAKER_THRESHOLD=2, CALENDAR_BREAKER_BACKOFF=5, CALENDAR_BREAKER_MAX_BACKOFF=8)
+    clock = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: clock[0])
+    breaker = gcal.CircuitBreaker()
+    monkeypatch.setattr(gcal, 'circuitBreaker', lambda: breaker)
+    breaker.clock = clock
+    return breaker
+
+
+def calendarService(*responses):
+    return build_from_document(gcal.discoveryDocument(), http=HttpMockSequence(list(responses)),
+                               requestBuilder=gcal.CalendarHttpRequest)
+
+
+def getEvent(service):
+    return service.events().get(calendarId=CAL_ID, eventId='event1').execute()
+
+
+def test_breaker_opens_probes_and_closes(app, breaker):
+    metrics.reset()
+    with app.app_context():
+        service = calendarService(DOWN, DOWN, DOWN, OK, OK)
+        for i in range(2):
+            with pytest.raises(HttpError):
+                getEvent(service)
+        assert breaker.openUntil == 1005.0
+
+        ## open: calls fail fast without reaching Google
+        with pytest.raises(gcal.CalendarUnavailable):
+            getEvent(service)
+        assert 'beauty_google_api_rejected_total{method="calendar.events.get"} 1' in metrics.render()
+
+        ## half open: one probe goes through, and failing it doubles the backoff, up to the most
+        breaker.clock[0] = 1005.0
+        with pytest.raises(HttpError):
+            getEvent(service)
+        assert breaker.openUntil == 1013.0
+        breaker.clock[0] = 1012.0
+        with pytest.raises(gcal.CalendarUnavailable):
+            getEvent(service)
+
+        ## a probe that succeeds closes it
+        breaker.clock[0] = 1013.0
+        assert getEvent(service) == {'id': 'event1'}
+        assert breaker.openUntil is None and breaker.failures == 0
+        assert getEvent(service) == {'id': 'event1'}
+
+
+def test_only_one_probe_goes_through_while_half_open(app, breaker):
+    with app.app_context():
+        for i in range(2):
+            breaker.failed()
+        breaker.clock[0] = 1005.0
+        assert breaker.allow() # the probe
+        assert not breaker.allow() # everyone else waits for its outcome
+        breaker.succeeded()
+        assert breaker.allow() and breaker.allow()
+
+
+def test_errors_that_are_not_an_outage_keep_the_breaker_closed(app, breaker):
+    with app.app_context():
+        service = calendarService(DOWN, NOT_FOUND, DOWN, OK)
+        for i in range(3):
+            with pytest.raises(HttpError):
+                getEvent(service)
+        assert breaker.openUntil is None # the 404 broke the run of failures
+        assert getEvent(service) == {'id': 'event1'}
@@ -0,0 +1,111 @@
+"""
+The calendar mirror against googleapiclient's own HTTP mock: full listings, incremental syncToken
+listings, and starting over when Google says the sync token has expired (410 Gone)
+"""
+
+import json
+
+import pytest
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpMockSequence
+
+from beauty_flask import mirror
+from beauty_flask.db import get_db
+
+CAL_ID = 'artist@example.com'
+OK = {'status': '200'}
+
+
+def calendarService(*responses):
+    """
+    A real calendar service whose HTTP requests get the given (headers, body) responses in turn
+    """
+    return build('calendar', 'v3', http=HttpMockSequence([(headers, json.dumps(body)) for headers, body in responses]),
+                 static_discovery=True)
+
+
+def event(eventId, start, end, **fields):
+    return dict({'id': eventId, 'status': 'confirmed', 'start': {'dateTime': start}, 'end': {'dateTime': end}},
+                **fields)
+
+
+MONDAY = event('mon', '2030-01-07T10:00:00-06:00', '2030-01-07T11:00:00-06:00')
+TUESDAY = event('tue', '2030-01-08T10:00:00-06:00', '2030-01-08T11:00:00-06:00')
+MONDAY_TIMES = ('2030-01-07T10:00:00-06:00', '2030-01-07T11:00:00-06:00')
+TUESDAY_TIMES = ('2030-01-08T10:00:00-06:00', '2030-01-08T11:00:00-06:00')
+
+
+def mirrored():
+    return {row['id']: (row['start_time'], row['end_time']) for row in get_db().execute(
+        'SELECT id, start_time, end_time FROM event WHERE calendar_id = ?', (CAL_ID,))}
+
+
+def syncToken():
+    return get_db().execute('SELECT sync_token FROM calendar_sync WHERE calendar_id = ?', (CAL_ID,)).fetchone()[0]
+
+
+def test_full_sync_pages_through_and_keeps_the_sync_token(app):
+    service = calendarService(
+        (OK, {'items': [MONDAY], 'nextPageToken': 'page2', 'timeZone': 'America/Chicago'}),
+        (OK, {'items': [TUESDAY, event('free', '2030-01-09T10:00:00-06:00', '2030-01-09T11:00:00-06:00',
+                                       transparency='transparent'),
+                        {'id': 'day', 'status': 'confirmed', 'start': {'date': '2030-01-10'}, 'end': {'date': '2030-01-11'}}],
+              'nextSyncToken': 'token1', 'timeZone': 'America/Chicago'}),
+    )
+    with app.app_context():
+        mirror.syncCalendar(service, CAL_ID)
+        assert mirrored() == {
+            'mon': MONDAY_TIMES,
+            'tue': TUESDAY_TIMES,
+            'day': ('2030-01-10T00:00:00-06:00', '2030-01-11T00:00:00-06:00'), # whole day in the calendar's timezone
+        }
+        assert syncToken() == 'token1'
+
+
+def test_incremental_sync_applies_only_the_changes(app):
+    moved = event('mon', '2030-01-07T14:00:00-06:00', '2030-01-07T15:00:00-06:00')
+    service = calendarService(
+        (OK, {'items': [MONDAY, TUESDAY], 'nextSyncToken': 'token1', 'timeZone': 'America/Chicago'}),
+        (OK, {'items': [moved, {'id': 'tue', 'status': 'cancelled'}], 'nextSyncToken': 'token2',
+              'timeZone': 'America/Chicago'}),
+    )
+    with app.app_context():
+        mirror.syncCalendar(service, CAL_ID)
+        touched = mirror.syncCalendar(service, CAL_ID)
+        assert mirrored() == {'mon': ('2030-01-07T14:00:00-06:00', '2030-01-07T15:00:00-06:00')}
+        assert syncToken() == 'token2'
+        assert sorted(touched) == sorted([MONDAY_TIMES, ('2030-01-07T14:00:00-06:00', '2030-01-07T15:00:00-06:00'),
+                                          TUESDAY_TIMES])
+
+
+def test_expired_sync_token_starts_over_with_a_full_sync(app):
+    gone = {'error': {'code': 410, 'message': 'Sync token is no longer valid, a full sync is required.'}}
+    service = calendarService(
+        (OK, {'items': [MONDAY], 'nextSyncToken': 'token1', 'timeZone': 'America/Chicago'}),
+        ({'status': '410'}, gone),
+        (OK, {'items': [TUESDAY], 'nextSyncToken': 'token2', 'timeZone': 'America/Chicago'}),
+    )
+    with app.app_context():
+        mirror.syncCalendar(service, CAL_ID)
+        mirror.syncCalendar(service, CAL_ID)
+        assert mirrored() == {'tue': TUESDAY_TIMES} # the full listing replaced the mirror
+        assert syncToken() == 'token2'
+
+
+def test_refresh_keeps_serving_the_mirror_when_a_sync_fails(app):
+    app.config['CALENDAR_MIRROR_REFRESH'] = 0 # always due
+    service = calendarService(
+        (OK, {'items': [MONDAY], 'nextSyncToken': 'token1', 'timeZone': 'America/Chicago'}),
+        ({'status': '500'}, {'error': {'code': 500, 'message': 'Backend Error'}}),
+    )
+    with app.app_context():
+        mirror.refreshMirror(service, CAL_ID)
+        mirror.refreshMirror(service, CAL_ID)
+        assert mirrored() == {'mon': MONDAY_TIMES}
+        assert syncToken() == 'token1'
+
+
+def test_first_sync_failure_is_raised(app):
+    service = calendarService(({'status': '500'}, {'error': {'code': 500, 'message': 'Backend Error'}}))
+    with app.app_context(), pytest.raises(Exception):
+        mirror.refreshMirror(service, CAL_ID)
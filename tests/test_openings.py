@@ -0,0 +1,100 @@
+"""
+The openings engine against the nested timeblock x event scan it replaced, on randomized calendars
+across timezones, DST weeks, grid steps and session lengths
+"""
+
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from dateutil import tz
+
+from beauty_flask import openings as engine
+from beauty_flask.openings import DAYS
+from beauty_flask.slotgrid import Grid
+
+TZNAMES = ('America/Chicago', 'Europe/London', 'Asia/Kolkata', 'Australia/Lord_Howe', 'UTC')
+WEEKS = ( # a Sunday in each, some spanning a DST change somewhere
+    (2021, 3, 7), (2021, 3, 14), (2021, 3, 28), (2021, 4, 4), (2021, 10, 31), (2021, 11, 7), (2021, 6, 20),
+)
+
+
+def referenceOpenings(baseDateTime, masks, events, grid, duration):
+    """
+    The scan findOpenings replaced: every timeblock of every remaining day checked against every event
+    A timeblock is available if each grid block the session covers is set in the day's mask
+    """
+    tzInfo = baseDateTime.tzinfo
+    length = timedelta(minutes=duration)
+    blocks = grid.blocks(duration)
+    events = [tuple(map(datetime.fromisoformat, e)) for e in events]
+    baseDateTimew = int(baseDateTime.strftime('%w'))
+    openings = {}
+    for i in range(baseDateTimew, 7): # from baseDateTime through the end of the week
+        currDate = (baseDateTime + timedelta(days=i-baseDateTimew)).date()
+        openings[DAYS[i]] = []
+        for k, tb in enumerate(grid.labels): # for each timeblock
+            currDateTime = datetime(currDate.year, currDate.month, currDate.day,
+                                    int(tb[:2]), int(tb[2:]), 00, 000000, tzInfo)
+            cDTEnd = currDateTime + length # ensure the length of a booking is free
+
+            if currDateTime <= baseDateTime: # in the past
+                continue
+            if k + blocks > grid.size or not all(masks[i] >> b & 1 for b in range(k, k + blocks)):
+                continue # not available
+
+            conflict = False
+            for eStart, eEnd in events: # check for conflicts
+                if cDTEnd <= eStart: # event in the future
+                    continue
+                elif eEnd <= currDateTime: # event in the past
+                    continue
+                else: # there's a conflict
+                    conflict = True
+                    break
+            if not conflict:
+                openings[DAYS[i]].append(tb)
+    return openings
+
+
+def randomCalendar(rng, sunday, tzInfo):
+    """
+    Events around the week as ISO strings, some in other timezones, some with seconds, some overlapping
+    or running over midnight
+    """
+    zones = [tzInfo, tz.gettz('UTC'), tz.gettz('Asia/Tokyo')]
+    events = []
+    for _ in range(rng.randrange(0, 40)):
+        start = sunday + timedelta(minutes=rng.randrange(-24 * 60, 8 * 24 * 60), seconds=rng.choice((0, 0, 0, 30)))
+        length = timedelta(minutes=rng.choice((15, 30, 45, 60, 90, 120, 600, 1500)))
+        zone = rng.choice(zones)
+        events.append((start.astimezone(zone).isoformat(), (start + length).astimezone(zone).isoformat()))
+    return events
+
+
+@pytest.mark.parametrize('step, duration', [(30, 60), (15, 30), (15, 90), (30, 120), (10, 50)])
+def test_findOpenings_matches_reference(step, duration):
+    rng = random.Random(step * 1000 + duration)
+    grid = Grid(step, 8 * 60, 21 * 60)
+    for case in range(100):
+        tzInfo = tz.gettz(rng.choice(TZNAMES))
+        sunday = datetime(*rng.choice(WEEKS), tzinfo=tzInfo)
+        if rng.random() < 0.5: # a future week, from its start
+            base = sunday
+        else: # this week, from some moment in it
+            base = sunday + timedelta(minutes=rng.randrange(0, 7 * 24 * 60), seconds=rng.randrange(60))
+        full = (1 << grid.size) - 1
+        masks = tuple(rng.choice((full, 0, rng.getrandbits(grid.size))) for d in DAYS)
+        events = randomCalendar(rng, sunday, tzInfo)
+
+        got = engine.findOpenings(base, masks, engine.busyIntervals(events), grid, duration)
+        assert got == referenceOpenings(base, masks, events, grid, duration), (case, base, events)
+
+
+def test_busyIntervals_merges_overlapping_and_touching_events():
+    events = [('2021-05-10T10:00:00-05:00', '2021-05-10T11:00:00-05:00'),
+              ('2021-05-10T10:30:00-05:00', '2021-05-10T12:00:00-05:00'),
+              ('2021-05-10T17:00:00+00:00', '2021-05-10T17:30:00+00:00'), # touches the one before
+              ('2021-05-10T14:00:00-05:00', '2021-05-10T14:00:30-05:00')]
+    start = engine.toMinutes(datetime(2021, 5, 10, 10, tzinfo=tz.gettz('America/Chicago')))
+    assert engine.busyIntervals(events) == [[start, start + 150], [start + 240, start + 241]]
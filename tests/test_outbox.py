@@ -0,0 +1,155 @@
+"""
+The email outbox against a local SMTP server (aiosmtpd): batched delivery over one connection,
+per-message failures, retries with backoff, and views that only queue
+"""
+
+import socket
+import time
+
+import pytest
+from aiosmtpd.controller import Controller
+from flask_mail import Message
+
+from beauty_flask import create_app, outbox
+from beauty_flask.db import get_db
+
+
+class Recorder:
+    """
+    aiosmtpd handler keeping every message it accepts, and refusing mail to refused@example.com
+    """
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.connections += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address == 'refused@example.com':
+            return '550 No such user'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return '250 Message accepted for delivery'
+
+
+def freePort():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp():
+    recorder = Recorder()
+    controller = Controller(recorder, hostname='127.0.0.1', port=freePort())
+    controller.start()
+    recorder.port = controller.port
+    yield recorder
+    controller.stop()
+
+
+@pytest.fixture
+def mailApp(tmp_path, smtp):
+    app = create_app({
+        'TESTING': False, # Flask-Mail suppresses sending while testing
+        'SECRET_KEY': 'test',
+        'DATABASE': str(tmp_path / 'test.sqlite'),
+        'CACHE_TYPE': 'SimpleCache',
+        'MAIL_SERVER': '127.0.0.1',
+        'MAIL_PORT': smtp.port,
+        'MAIL_USERNAME': None,
+        'MAIL_PASSWORD': None,
+        'MAIL_OUTBOX_WORKER': False,
+        'MAIL_OUTBOX_BACKOFF': 30,
+        'MAIL_OUTBOX_MAX_ATTEMPTS': 2,
+        'OPENINGS_REFRESH': False,
+        'PAGE_CACHE': False,
+    })
+    app.instance_path = str(tmp_path)
+    return app
+
+
+def queue(recipient, subject='Hello'):
+    outbox.enqueue(Message(subject, recipients=[recipient], html='<p>Hi</p>'))
+
+
+def statuses():
+    return [(row['status'], row['attempts']) for row in get_db().execute('SELECT * FROM outbox ORDER BY id')]
+
+
+def test_a_batch_goes_out_over_one_connection(mailApp, smtp):
+    with mailApp.app_context():
+        for i in range(3):
+            queue('client{}@example.com'.format(i), 'Booking {}'.format(i))
+        assert smtp.messages == [] # queuing sends nothing
+        assert outbox.deliverPending() == 3
+        assert statuses() == [('sent', 1)] * 3
+    assert smtp.connections == 1
+    assert [m.rcpt_tos for m in smtp.messages] == [['client0@example.com'], ['client1@example.com'],
+                                                     ['client2@example.com']]
+    assert b'Subject: Booking 0' in smtp.messages[0].original_content
+
+
+def test_a_refused_message_is_retried_without_holding_up_the_rest(mailApp, smtp, monkeypatch):
+    with mailApp.app_context():
+        queue('refused@example.com')
+        queue('client@example.com')
+        assert outbox.deliverPending() == 1
+        assert statuses() == [('pending', 1), ('sent', 1)]
+        row = get_db().execute('SELECT * FROM outbox WHERE id = 1').fetchone()
+        assert row['next_attempt'] >= time.time() + 29 # backed off
+        assert outbox.deliverPending() == 0 # not due yet
+
+        ## once due, the last allowed attempt fails for good
+        now = time.time()
+        monkeypatch.setattr(time, 'time', lambda: now + 60)
+        assert outbox.deliverPending() == 0
+        assert statuses() == [('failed', 2), ('sent', 1)]
+
+
+def test_an_unreachable_server_leaves_the_emails_queued(mailApp, smtp):
+    mailApp.extensions['mail'].port = freePort() # nothing listening
+    with mailApp.app_context():
+        queue('client@example.com')
+        assert outbox.deliverPending() == 0
+        assert statuses() == [('pending', 1)]
+    assert smtp.messages == []
+
+
+def test_contact_form_queues_and_send_mail_delivers(mailApp, smtp):
+    client = mailApp.test_client()
+    response = client.post('/contact', data={'contactName': 'Ann', 'contactEmail': 'ann@example.com',
+                                             'contactMessage': 'Hello there'})
+    assert response.status_code == 302
+    assert smtp.messages == []
+    result = mailApp.test_cli_runner().invoke(args=['send-mail'])
+    assert 'Sent 1 emails.' in result.output
+    assert len(smtp.messages) == 1 and b'Hello there' in smtp.messages[0].original_content
+
+
+def test_stopping_one_apps_worker_leaves_anothers_delivering(tmp_path):
+    apps = [create_app({'TESTING': True, # sending is suppressed, but still marks the emails sent
+                        'SECRET_KEY': 'test', 'DATABASE': str(tmp_path / '{}.sqlite'.format(i)),
+                        'MAIL_OUTBOX_WORKER': True, 'OPENINGS_REFRESH': False}) for i in range(2)]
+    stopped, running = [outbox.startWorker(app) for app in apps]
+    try:
+        outbox.stopWorker(stopped)
+        assert not stopped.thread.is_alive() and running.thread.is_alive()
+        with apps[1].app_context():
+            queue('client@example.com') # wakes its worker, long before MAIL_OUTBOX_POLL
+            deadline = time.monotonic() + 5
+            while statuses() != [('sent', 1)] and time.monotonic() < deadline:
+                time.sleep(0.05)
+            assert statuses() == [('sent', 1)]
+        with apps[0].app_context():
+            queue('client@example.com') # a stopped worker is not started again
+            assert not stopped.thread.is_alive()
+            assert statuses() == [('pending', 0)]
+    finally:
+        outbox.stopWorker(running)
@@ -0,0 +1,53 @@
+"""
+The openings refresher: a thread per app, started by requests and stopped without touching other apps',
+and the command line refresh, which needs no thread at all
+"""
+
+from datetime import datetime, timedelta
+
+from dateutil import tz
+
+from beauty_flask import create_app, refresher, site, slotgrid, weekcache
+from beauty_flask import openings as engine
+from beauty_flask.extensions import cache
+from beauty_flask.openings import DAYS
+
+
+def refreshingApp(tmp_path, name, **config):
+    app = create_app(dict({'TESTING': True, 'SECRET_KEY': 'test', 'DATABASE': str(tmp_path / '{}.sqlite'.format(name)),
+                           'CACHE_TYPE': 'SimpleCache', 'MAIL_OUTBOX_WORKER': False, 'PAGE_CACHE': False}, **config))
+    app.instance_path = str(tmp_path)
+    return app
+
+
+def test_stopping_one_apps_refresher_leaves_anothers_running(tmp_path):
+    apps = [refreshingApp(tmp_path, i) for i in range(2)]
+    for app in apps:
+        with app.test_request_context():
+            refresher.startRefresher()
+    stopped, running = [app.extensions['refresher'] for app in apps]
+    try:
+        refresher.stopRefresher(stopped)
+        assert not stopped.thread.is_alive() and running.thread.is_alive()
+        with apps[0].test_request_context():
+            refresher.startRefresher() # a stopped refresher is not started again
+        assert not stopped.thread.is_alive()
+    finally:
+        refresher.stopRefresher(running)
+
+
+def test_refresh_openings_command_fills_the_cache_without_a_refresh_thread(tmp_path, calendar, monkeypatch):
+    def computeWeeks(service, sunday, weeks, duration):
+        grid = slotgrid.currentGrid()
+        return [(engine.weekInfo(sunday + timedelta(weeks=i)), {None: {d: list(grid.labels) for d in DAYS}})
+                for i in range(weeks)]
+    monkeypatch.setattr(site, 'computeWeeks', computeWeeks)
+    app = refreshingApp(tmp_path, 'cli', OPENINGS_REFRESH=False, OPENINGS_REFRESH_TIMEZONES=('America/Chicago',))
+
+    result = app.test_cli_runner().invoke(args=['refresh-openings'])
+    assert 'Refreshed openings in 1 timezones.' in result.output
+    assert app.extensions['refresher'].thread is None
+    with app.app_context():
+        sunday = weekcache.startOfWeek(datetime.now(tz.gettz('America/Chicago')))
+        for duration in slotgrid.durations():
+            assert cache.get(weekcache.cacheKey('America/Chicago', duration, sunday)) is not None
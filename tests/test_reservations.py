@@ -0,0 +1,160 @@
+"""
+Slot reservations: concurrent bookings of one slot, rescheduling onto an overlapping slot, refusing a
+booking when the slot can't be held or the hold has lapsed, and the year of a picked slot
+"""
+
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from dateutil import tz
+
+from beauty_flask import reservations, site
+from beauty_flask.db import get_db
+
+TZNAME = 'America/Chicago'
+APPT_DT = datetime(2031, 5, 12, 10, 0) # a Monday, as /bookPost saves it
+CALENDAR = 'artist@example.com'
+
+
+def bookingClient(app, number):
+    """
+    A client that has picked APPT_DT on the 'book' page and filled in the 'booking' form
+    """
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess.update(tzName=TZNAME, apptDT=APPT_DT, apptMinutes=60, calendarId=CALENDAR,
+                    apptDate='Monday, May 12, 2031', apptTime={'start': '10:00 AM', 'end': '11:00 AM'},
+                    clientName='Client {}'.format(number), clientEmail='client{}@example.com'.format(number))
+    return client
+
+
+def test_one_of_many_concurrent_bookings_of_a_slot_wins(app, calendar):
+    n = 20
+    clients = [bookingClient(app, i) for i in range(n)]
+    barrier = threading.Barrier(n)
+    results = [None] * n
+
+    def book(i):
+        barrier.wait()
+        results[i] = clients[i].get('/appointment').get_json()
+
+    threads = [threading.Thread(target=book, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calendar.calls['events.insert'] == 1
+    assert len(calendar.store) == 1
+    booked = [r for r in results if 'apptID' in r]
+    taken = [r for r in results if r.get('slotTaken')]
+    assert len(booked) == 1 and len(taken) == n - 1
+    assert all(r['error'] == site.SLOT_TAKEN for r in taken)
+
+
+def test_booking_is_refused_when_the_slot_cannot_be_held(app, calendar, monkeypatch):
+    def locked(*args, **kwargs):
+        raise sqlite3.OperationalError('database is locked')
+    monkeypatch.setattr(reservations, 'hold', locked)
+
+    result = bookingClient(app, 0).get('/appointment').get_json()
+    assert result == {'error': site.SLOT_ERROR, 'slotTaken': False}
+    assert calendar.calls['events.insert'] == 0
+
+
+def unitRows(db):
+    return {row['unit_start']: (row['status'], row['appt_id'])
+            for row in db.execute('SELECT unit_start, status, appt_id FROM reservation')}
+
+
+def expectRows(*spans):
+    """
+    The rows for each (start, length, status, apptID), over the units of the slot grid
+    """
+    return {unit: (status, apptID) for start, length, status, apptID in spans
+            for unit in reservations.units(start, length)}
+
+
+def test_rescheduling_onto_an_overlapping_slot_keeps_the_shared_units_booked(app, monkeypatch):
+    start = APPT_DT.replace(tzinfo=tz.gettz(TZNAME))
+    hour = timedelta(hours=1)
+    half = timedelta(minutes=30)
+    with app.test_request_context():
+        db = get_db()
+        reservations.hold(CALENDAR, start, hour, token='first')
+        reservations.confirm(CALENDAR, start, hour, 'appt1', token='first')
+
+        ## moving it half an hour later holds only the units it didn't have
+        reservations.hold(CALENDAR, start + half, hour, token='mover', rescheduling='appt1')
+        assert unitRows(db) == expectRows((start, hour, 'booked', 'appt1'), (start + hour, half, 'held', None))
+
+        ## abandoning the reschedule lets the hold expire, but never frees the appointment's own units
+        later = time.time() + app.config['RESERVATION_HOLD_TTL'] + 1
+        monkeypatch.setattr(time, 'time', lambda: later)
+        with pytest.raises(reservations.SlotTaken):
+            reservations.hold(CALENDAR, start + half, hour, token='other')
+        reservations.hold(CALENDAR, start + hour, hour, token='other')
+
+        ## when it goes through, the shared units stay booked and only the old ones outside the slot are freed
+        reservations.release(CALENDAR, start + hour, hour, token='other')
+        reservations.hold(CALENDAR, start + half, hour, token='mover', rescheduling='appt1')
+        reservations.confirm(CALENDAR, start + half, hour, 'appt1', token='mover')
+        assert unitRows(db) == expectRows((start + half, hour, 'booked', 'appt1'))
+
+
+def test_confirm_refuses_a_lapsed_hold_and_leaves_no_transaction_open(app, monkeypatch):
+    start = APPT_DT.replace(tzinfo=tz.gettz(TZNAME))
+    hour = timedelta(hours=1)
+    with app.test_request_context():
+        db = get_db()
+        reservations.hold(CALENDAR, start, hour, token='slow')
+        later = time.time() + app.config['RESERVATION_HOLD_TTL'] + 1
+        monkeypatch.setattr(time, 'time', lambda: later)
+        reservations.hold(CALENDAR, start + hour / 2, hour, token='other') # prunes the lapsed hold
+
+        with pytest.raises(reservations.SlotTaken):
+            reservations.confirm(CALENDAR, start, hour, 'appt1', token='slow')
+        assert not db.in_transaction
+        assert unitRows(db) == expectRows((start + hour / 2, hour, 'held', None))
+        reservations.release(CALENDAR, start + hour / 2, hour, token='other') # the connection still writes
+        assert unitRows(db) == {}
+
+
+def test_booking_a_lapsed_hold_is_refused_before_the_calendar_insert(app, calendar, monkeypatch):
+    monkeypatch.setattr(reservations, 'hold', lambda *args, **kwargs: None) # as if it lapsed straight away
+    result = bookingClient(app, 0).get('/appointment').get_json()
+    assert result == {'error': site.SLOT_TAKEN, 'slotTaken': True}
+    assert calendar.calls['events.insert'] == 0
+
+
+def test_a_failed_reschedule_puts_the_booking_back(app, calendar):
+    client = bookingClient(app, 0)
+    apptID = client.get('/appointment').get_json()['apptID']
+    start = APPT_DT.replace(tzinfo=tz.gettz(TZNAME))
+    with app.test_request_context():
+        booked = unitRows(get_db())
+        assert booked == expectRows((start, timedelta(hours=1), 'booked', apptID))
+
+    calendar.failing.add('events.patch')
+    with client.session_transaction() as sess:
+        sess.update(apptDT=APPT_DT + timedelta(hours=3), reschedule=True)
+    result = client.get('/reschedule/{}'.format(apptID)).get_json()
+    assert 'error' in result and not result.get('slotTaken')
+    with app.test_request_context():
+        assert unitRows(get_db()) == booked
+
+    calendar.failing.clear()
+    assert client.get('/reschedule/{}'.format(apptID)).get_json() == {'success': True}
+    with app.test_request_context():
+        assert unitRows(get_db()) == expectRows((start + timedelta(hours=3), timedelta(hours=1), 'booked', apptID))
+
+
+def test_a_picked_slot_takes_the_year_of_its_day_in_the_week_shown():
+    chicago = tz.gettz(TZNAME)
+    now = datetime(2030, 12, 26, 15, 0, tzinfo=chicago) # a Thursday; next week spans New Year
+    assert site.pickedSlot('Dec_30_1000', 1, chicago, now) == datetime(2030, 12, 30, 10, 0)
+    assert site.pickedSlot('Jan_02_1000', 1, chicago, now) == datetime(2031, 1, 2, 10, 0)
+    assert site.pickedSlot('Dec_27_0900', 0, chicago, now) == datetime(2030, 12, 27, 9, 0)
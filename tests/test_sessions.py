@@ -0,0 +1,48 @@
+"""
+Server-side sessions in the database
+"""
+
+import logging
+
+from flask import session
+
+from beauty_flask import create_app, db
+
+
+def unmigratedApp(tmp_path):
+    """
+    An app on an empty database that startup leaves alone
+    """
+    return create_app({'TESTING': True, 'SECRET_KEY': 'test', 'DATABASE': str(tmp_path / 'empty.sqlite'),
+                       'DATABASE_MIGRATE': False, 'MAIL_OUTBOX_WORKER': False, 'OPENINGS_REFRESH': False})
+
+
+def test_session_table_is_created_on_first_use(tmp_path):
+    app = unmigratedApp(tmp_path)
+
+    @app.route('/visits')
+    def visits():
+        session['visits'] = session.get('visits', 0) + 1
+        return str(session['visits'])
+
+    client = app.test_client()
+    assert client.get('/visits').get_data(as_text=True) == '1'
+    assert client.get('/visits').get_data(as_text=True) == '2'
+    with app.app_context():
+        assert db.get_db().execute('SELECT COUNT(*) FROM session').fetchone()[0] == 1
+
+
+def test_a_session_cookie_before_any_session_is_saved_finds_nothing_quietly(tmp_path, caplog):
+    app = unmigratedApp(tmp_path)
+
+    @app.route('/visits')
+    def visits():
+        return str(session.get('visits', 0))
+
+    client = app.test_client()
+    client.set_cookie('session', 'left-over-id')
+    with caplog.at_level(logging.INFO):
+        assert client.get('/visits').get_data(as_text=True) == '0'
+    assert not caplog.records # the missing table is not an error to log
+    with app.app_context():
+        assert app.session_interface.store.load('left-over-id') is None
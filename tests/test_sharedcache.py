@@ -0,0 +1,87 @@
+"""
+The openings cache on a backend shared between worker processes, with a FileSystemCache standing in
+for Redis, and carrying on without it when it can't be reached
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from dateutil import tz
+
+from beauty_flask import create_app, slotgrid, weekcache
+from beauty_flask import openings as engine
+from beauty_flask.extensions import cache, sharedCache
+from beauty_flask.openings import DAYS
+
+CHICAGO = 'America/Chicago'
+SUNDAY = datetime(2030, 1, 6, tzinfo=tz.gettz(CHICAGO))
+
+
+class Unreachable:
+    """
+    A cache backend whose server refuses every connection
+    """
+    def __getattr__(self, name):
+        def refuse(*args, **kwargs):
+            raise ConnectionError("Connection refused")
+        return refuse
+
+
+def worker(tmp_path, name):
+    """
+    An app as one worker process would have it, all of them sharing the cache directory
+    """
+    app = create_app({'TESTING': True, 'SECRET_KEY': 'test', 'DATABASE': str(tmp_path / '{}.sqlite'.format(name)),
+                      'CACHE_TYPE': 'FileSystemCache', 'CACHE_DIR': str(tmp_path / 'cache'),
+                      'MAIL_OUTBOX_WORKER': False, 'OPENINGS_REFRESH': False, 'PAGE_CACHE': False})
+    app.instance_path = str(tmp_path)
+    return app
+
+
+def computer(calls):
+    def compute(sunday, count):
+        calls.append(sunday)
+        grid = slotgrid.currentGrid()
+        return [(engine.weekInfo(sunday + timedelta(weeks=i)), {None: {d: list(grid.labels) for d in DAYS}})
+                for i in range(count)]
+    return compute
+
+
+@pytest.fixture
+def workers(tmp_path):
+    return worker(tmp_path, 'one'), worker(tmp_path, 'two')
+
+
+def test_workers_serve_each_others_cached_weeks(workers):
+    calls = []
+    one, two = workers
+    with one.app_context():
+        assert sharedCache(one)
+        computed = weekcache.getWeeks(CHICAGO, 60, [SUNDAY], computer(calls), SUNDAY)
+        token = weekcache.generation()
+    with two.app_context():
+        assert weekcache.getWeeks(CHICAGO, 60, [SUNDAY], computer(calls), SUNDAY) == computed
+        assert weekcache.generation() == token # so validators hold whichever worker answers
+    assert calls == [SUNDAY]
+
+    ## a booking through one worker is seen by the other
+    with two.app_context():
+        weekcache.markBooked('2030-01-07T10:00:00-06:00', '2030-01-07T11:00:00-06:00')
+    with one.app_context():
+        week, openings = weekcache.getWeeks(CHICAGO, 60, [SUNDAY], computer(calls), SUNDAY)[0]
+        assert '1000' not in openings['Mon'] and '1000' in openings['Tue']
+    assert calls == [SUNDAY]
+
+
+def test_openings_are_computed_while_the_shared_cache_is_unreachable(workers):
+    calls = []
+    one, two = workers
+    with one.app_context():
+        one.extensions['cache'][cache] = Unreachable()
+        first = weekcache.getWeeks(CHICAGO, 60, [SUNDAY], computer(calls), SUNDAY)
+        assert weekcache.getWeeks(CHICAGO, 60, [SUNDAY], computer(calls), SUNDAY) == first
+        assert calls == [SUNDAY, SUNDAY] # nothing cached, but nothing failed either
+        assert weekcache.generation()
+        weekcache.markBooked('2030-01-07T10:00:00-06:00', '2030-01-07T11:00:00-06:00')
+        weekcache.invalidate()
+        assert cache.get('anything') is None
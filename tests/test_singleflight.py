@@ -0,0 +1,118 @@
+"""
+Coalescing concurrent cache misses: threads of a process wait for one computation, workers sharing a
+cache wait for the lease holder's, and a lease left by a worker that stopped renewing it is taken over
+"""
+
+import threading
+import time
+
+import pytest
+
+from beauty_flask import create_app, leases, metrics, singleflight
+from beauty_flask.extensions import cache
+
+
+def coalesced(scope):
+    """
+    The coalesced_total count for openings in one scope, as scraped
+    """
+    line = 'beauty_coalesced_total{{family="openings",scope="{}"}} '.format(scope)
+    for row in metrics.render().splitlines():
+        if row.startswith(line):
+            return int(row[len(line):])
+    return 0
+
+
+@pytest.fixture
+def sharedApp(tmp_path):
+    app = create_app({'TESTING': True, 'SECRET_KEY': 'test', 'DATABASE': str(tmp_path / 'shared.sqlite'),
+                      'CACHE_TYPE': 'FileSystemCache', 'CACHE_DIR': str(tmp_path / 'cache'),
+                      'MAIL_OUTBOX_WORKER': False, 'OPENINGS_REFRESH': False, 'PAGE_CACHE': False,
+                      'OPENINGS_COALESCE_POLL': 0.01})
+    app.instance_path = str(tmp_path)
+    return app
+
+
+def test_concurrent_misses_in_a_process_share_one_computation(app):
+    metrics.reset()
+    calls, results = [], []
+    start = threading.Barrier(6)
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.3) # long enough for every other thread to find it running
+        cache.set('k', 'openings')
+        return 'openings'
+
+    def miss():
+        with app.app_context():
+            start.wait()
+            results.append(singleflight.run('k', compute, lambda: cache.get('k'), 'openings'))
+
+    threads = [threading.Thread(target=miss) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == ['openings'] * 6
+    assert coalesced('process') == 5
+
+
+def test_a_failed_computation_leaves_each_waiter_to_compute_for_itself(app):
+    calls = []
+    started = threading.Event()
+
+    def failing():
+        calls.append('leader')
+        started.set()
+        time.sleep(0.2)
+        raise ConnectionError("calendar unreachable")
+
+    def leader():
+        with app.app_context():
+            with pytest.raises(ConnectionError):
+                singleflight.run('k', failing, lambda: cache.get('k'), 'openings')
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    started.wait()
+    with app.app_context():
+        assert singleflight.run('k', lambda: calls.append('waiter') or 'openings', lambda: cache.get('k'),
+                                'openings') == 'openings'
+    thread.join()
+    assert calls == ['leader', 'waiter']
+
+
+def test_a_worker_waits_for_the_lease_holder_instead_of_computing(sharedApp):
+    metrics.reset()
+    with sharedApp.app_context():
+        assert leases.acquire('flight_k', 30, who='other-worker')
+        threading.Timer(0.1, lambda: cache.set('k', 'openings')).start() # as the other worker finishes
+
+        def compute():
+            raise AssertionError("computed while another worker was computing")
+        assert singleflight.run('k', compute, lambda: cache.get('k'), 'openings') == 'openings'
+    assert coalesced('worker') == 1
+
+
+def test_a_lease_not_renewed_is_taken_over_once_it_expires(app, monkeypatch):
+    with app.app_context():
+        assert leases.acquire('refresh', 60, who='a')
+        assert leases.acquire('refresh', 60, who='a') # renewing
+        assert not leases.acquire('refresh', 60, who='b')
+
+        now = time.time()
+        monkeypatch.setattr(time, 'time', lambda: now + 61)
+        assert leases.acquire('refresh', 60, who='b')
+        assert not leases.acquire('refresh', 60, who='a') # 'a' lost it
+        leases.release('refresh', who='a') # and cannot give it up for 'b'
+        assert not leases.acquire('refresh', 60, who='c')
+
+
+def test_a_flight_lease_left_by_a_dead_worker_does_not_hold_up_the_next(sharedApp):
+    with sharedApp.app_context():
+        assert leases.acquire('flight_k', 0, who='dead-worker') # expired as soon as taken
+        begun = time.monotonic()
+        assert singleflight.run('k', lambda: 'openings', lambda: cache.get('k'), 'openings') == 'openings'
+        assert time.monotonic() - begun < sharedApp.config['OPENINGS_COALESCE_TIMEOUT'] / 10
@@ -0,0 +1,85 @@
+"""
+Day masks on the slot grid against a block by block check, at several grid steps, with spans and
+sessions running off either end of the day
+"""
+
+import random
+
+import pytest
+
+from beauty_flask.slotgrid import Grid, dayMask, fits, maskLabels, spanMask
+
+STEPS = (10, 15, 30)
+
+
+def referenceFits(grid, mask, blocks):
+    """
+    Every block at which 'blocks' blocks in a row, all on the same day, are set
+    """
+    return {k for k in range(grid.size)
+            if k + blocks <= grid.size and all(mask >> b & 1 for b in range(k, k + blocks))}
+
+
+def bits(mask):
+    return {k for k in range(mask.bit_length()) if mask >> k & 1}
+
+
+@pytest.mark.parametrize('step', STEPS)
+def test_fits_matches_reference_and_never_runs_past_the_day(step):
+    rng = random.Random(step)
+    grid = Grid(step, 8 * 60, 21 * 60)
+    full = (1 << grid.size) - 1
+    for case in range(200):
+        mask = rng.choice((full, 0, rng.getrandbits(grid.size), full ^ (1 << rng.randrange(grid.size))))
+        blocks = rng.randrange(1, grid.size + 2)
+        assert bits(fits(mask, blocks)) == referenceFits(grid, mask, blocks), (case, bin(mask), blocks)
+
+    ## the last session of the day ends at the end of the grid, however long it is
+    for minutes in (30, 60, 90, 120):
+        blocks = grid.blocks(minutes)
+        assert maskLabels(grid, fits(full, blocks))[-1] == '{:02d}{:02d}'.format(*divmod(21 * 60 - blocks * step, 60))
+
+
+@pytest.mark.parametrize('step', STEPS)
+def test_dayMask_keeps_only_whole_blocks_within_the_day(step):
+    grid = Grid(step, 0, 24 * 60) # a day running to midnight
+    full = (1 << grid.size) - 1
+    assert dayMask(grid, [(-60, 24 * 60 + 60)]) == full # from the day before into the day after
+    assert dayMask(grid, [(23 * 60, 26 * 60)]) == full & ~((1 << (23 * 60 // step)) - 1)
+    assert dayMask(grid, [(-120, -60), (24 * 60, 25 * 60)]) == 0 # entirely on other days
+    assert dayMask(grid, [(23 * 60 + 1, 24 * 60)]) == full & ~((1 << (23 * 60 // step + 1)) - 1) # part blocks are left out
+
+    grid = Grid(step, 8 * 60, 21 * 60)
+    assert dayMask(grid, [(7 * 60, 9 * 60)]) == (1 << (60 // step)) - 1 # before the first block
+    assert bits(dayMask(grid, [(20 * 60, 22 * 60)])) == set(range(grid.size - 60 // step, grid.size))
+
+
+@pytest.mark.parametrize('step', STEPS)
+def test_spanMask_covers_every_block_a_span_touches_within_the_day(step):
+    grid = Grid(step, 0, 24 * 60)
+    size = grid.size
+    assert spanMask(grid, -90, 30) == (1 << -(-30 // step)) - 1 # an event from the night before
+    assert bits(spanMask(grid, 23 * 60 + 59, 25 * 60)) == {size - 1} # into the next day
+    assert spanMask(grid, 24 * 60, 25 * 60) == 0
+    assert spanMask(grid, -60, 0) == 0
+    assert bits(spanMask(grid, step + 1, 2 * step + 1)) == {1, 2} # part blocks count as busy
+
+
+@pytest.mark.parametrize('step', STEPS)
+def test_a_session_fits_only_where_no_busy_span_touches_it(step):
+    rng = random.Random(100 + step)
+    grid = Grid(step, 8 * 60, 21 * 60)
+    full = (1 << grid.size) - 1
+    for case in range(100):
+        spans = [(start, start + rng.randrange(1, 240)) for start in
+                 (rng.randrange(-120, 14 * 60) for _ in range(rng.randrange(4)))]
+        busy = 0
+        for start, end in spans:
+            busy |= spanMask(grid, start, end)
+        minutes = rng.choice((30, 60, 90, 120))
+        got = fits(full & ~busy, grid.blocks(minutes))
+        for k in range(grid.size):
+            session = (k * step, k * step + grid.blocks(minutes) * step)
+            free = session[1] <= grid.size * step and all(end <= session[0] or session[1] <= start
+                                                          for start, end in spans)
+            assert bool(got >> k & 1) == free, (case, spans, minutes, k)
@@ -0,0 +1,95 @@
+"""
+Calendar push notifications: opening and renewing watch channels, and a local stand-in for Google
+posting notifications to the webhook
+"""
+
+import json
+import time
+
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpMockSequence
+
+from beauty_flask import gcal, mirror, weekcache, webhook
+from beauty_flask.db import get_db
+
+CAL_ID = 'artist@example.com'
+OK = {'status': '200'}
+MONDAY = {'id': 'mon', 'status': 'confirmed', 'start': {'dateTime': '2030-01-07T10:00:00-06:00'},
+          'end': {'dateTime': '2030-01-07T11:00:00-06:00'}}
+MOVED = dict(MONDAY, start={'dateTime': '2030-01-14T10:00:00-06:00'}, end={'dateTime': '2030-01-14T11:00:00-06:00'})
+
+
+def calendarService(*bodies):
+    return build('calendar', 'v3', http=HttpMockSequence([(OK, json.dumps(body)) for body in bodies]),
+                 static_discovery=True)
+
+
+def watchResponse(channelId, expiration):
+    return {'kind': 'api#channel', 'id': channelId, 'resourceId': 'resource-' + channelId,
+            'expiration': str(expiration * 1000)}
+
+
+def notify(client, channel, state='exists', token=None):
+    """
+    Post what Google posts for a change to a watched calendar: all headers, no body
+    """
+    return client.post('/webhook/calendar', headers={
+        'X-Goog-Channel-ID': channel['id'],
+        'X-Goog-Channel-Token': channel['token'] if token is None else token,
+        'X-Goog-Resource-ID': channel['resource_id'],
+        'X-Goog-Resource-State': state,
+        'X-Goog-Message-Number': '1',
+    })
+
+
+def openChannel(app):
+    app.config['CALENDAR_WEBHOOK_URL'] = 'https://example.com/webhook/calendar'
+    with app.app_context():
+        service = calendarService(watchResponse('channel1', int(time.time()) + 7 * 86400))
+        return webhook.watchCalendar(service, CAL_ID)
+
+
+def test_renew_opens_a_channel_only_when_due(app):
+    app.config['CALENDAR_WEBHOOK_URL'] = 'https://example.com/webhook/calendar'
+    soon = int(time.time()) + 60
+    with app.app_context():
+        assert webhook.renewChannels(calendarService(watchResponse('old', soon)), CAL_ID)
+        ## the channel expires within CALENDAR_WATCH_RENEW_BEFORE, so a new one opens and the old one stops
+        assert webhook.renewChannels(calendarService(watchResponse('new', soon + 7 * 86400), {}), CAL_ID)
+        assert not webhook.renewChannels(calendarService(), CAL_ID)
+        rows = get_db().execute('SELECT id FROM watch_channel WHERE calendar_id = ?', (CAL_ID,)).fetchall()
+        assert [row['id'] for row in rows] == ['new']
+
+
+def test_notification_syncs_and_invalidates_the_changed_weeks(app, client, monkeypatch):
+    channel = openChannel(app)
+    with app.app_context():
+        mirror.syncCalendar(calendarService({'items': [MONDAY], 'nextSyncToken': 't1'}), CAL_ID)
+    monkeypatch.setattr(gcal, 'getService', lambda: calendarService({'items': [MOVED], 'nextSyncToken': 't2'}))
+    invalidated = []
+    monkeypatch.setattr(weekcache, 'invalidate', lambda spans=None: invalidated.append(spans))
+
+    assert notify(client, channel, state='sync').status_code == 204 # the handshake changes nothing
+    assert invalidated == []
+    assert notify(client, channel).status_code == 204
+    assert sorted(invalidated[0]) == [('2030-01-07T10:00:00-06:00', '2030-01-07T11:00:00-06:00'),
+                                      ('2030-01-14T10:00:00-06:00', '2030-01-14T11:00:00-06:00')]
+
+
+def test_notification_for_an_unknown_channel_or_token_is_refused(app, client, monkeypatch):
+    channel = openChannel(app)
+    invalidated = []
+    monkeypatch.setattr(weekcache, 'invalidate', lambda spans=None: invalidated.append(spans))
+    assert notify(client, channel, token='forged').status_code == 404
+    assert notify(client, dict(channel, id='unknown')).status_code == 404
+    assert invalidated == []
+
+
+def test_failed_sync_invalidates_everything(app, client, monkeypatch):
+    channel = openChannel(app)
+    monkeypatch.setattr(gcal, 'getService', lambda: build(
+        'calendar', 'v3', http=HttpMockSequence([({'status': '500'}, '{}')]), static_discovery=True))
+    invalidated = []
+    monkeypatch.setattr(weekcache, 'invalidate', lambda spans=None: invalidated.append(spans))
+    assert notify(client, channel).status_code == 204
+    assert invalidated == [None]
@@ -0,0 +1,142 @@
+"""
+The openings cache: weeks keyed by timezone and absolute start, the past cut off when reading,
+bookings and cancellations patching or dropping just the weeks they touch, and last known good weeks
+served while they are recomputed
+"""
+
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from dateutil import tz
+
+from beauty_flask import slotgrid, weekcache
+from beauty_flask import openings as engine
+from beauty_flask.extensions import cache
+from beauty_flask.openings import DAYS
+
+CHICAGO = 'America/Chicago'
+LONDON = 'Europe/London'
+SUNDAY = datetime(2030, 1, 6, tzinfo=tz.gettz(CHICAGO))
+
+
+class Computer:
+    """
+    A compute function for getWeeks offering every block of every day, recording each call
+    """
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, sunday, count):
+        self.calls.append((sunday, count))
+        grid = slotgrid.currentGrid()
+        return [(engine.weekInfo(sunday + timedelta(weeks=i)), {None: {d: list(grid.labels) for d in DAYS}})
+                for i in range(count)]
+
+
+def cachedDay(tzName, duration, sunday, day):
+    week, byArtist = cache.get(weekcache.cacheKey(tzName, duration, sunday))
+    return byArtist[None][day]
+
+
+def test_weeks_are_cached_per_timezone_and_the_past_cut_off_when_read(app):
+    compute = Computer()
+    with app.app_context():
+        grid = slotgrid.currentGrid()
+        first = weekcache.getWeeks(CHICAGO, 60, [SUNDAY], compute, SUNDAY - timedelta(days=1))
+        assert compute.calls == [(SUNDAY, app.config['OPENINGS_PREFETCH_WEEKS'])] # the weeks ahead come too
+        assert first[0][1]['Sun'] == list(grid.labels)
+
+        ## later in the week the same entry serves, with what has passed left out
+        tuesday = SUNDAY + timedelta(days=2, hours=10, minutes=5)
+        week, openings = weekcache.getWeeks(CHICAGO, 60, [SUNDAY], compute, tuesday)[0]
+        assert len(compute.calls) == 1
+        assert week == engine.weekInfo(SUNDAY)
+        assert list(openings) == ['Tue', 'Wed', 'Thu', 'Fri', 'Sat']
+        assert openings['Tue'] == [tb for tb in grid.labels if tb > '1005']
+
+        weekcache.getWeeks(CHICAGO, 60, [SUNDAY + timedelta(weeks=3)], compute, SUNDAY)
+        assert len(compute.calls) == 1 # prefetched
+        weekcache.getWeeks(LONDON, 60, [SUNDAY.replace(tzinfo=tz.gettz(LONDON))], compute, SUNDAY)
+        assert len(compute.calls) == 2 # another timezone is another entry
+
+
+def test_markBooked_patches_just_the_booked_day_in_every_timezone(app):
+    compute = Computer()
+    with app.app_context():
+        for tzName in (CHICAGO, LONDON):
+            for duration in slotgrid.durations():
+                weekcache.putWeeks(tzName, duration, SUNDAY.date(), compute(SUNDAY, 2))
+        grid = slotgrid.currentGrid()
+        before = weekcache.generation()
+
+        weekcache.markBooked('2030-01-07T10:00:00-06:00', '2030-01-07T11:00:00-06:00')
+
+        assert weekcache.generation() != before
+        blocked = lambda first, last: [tb for tb in grid.labels if not first <= tb <= last]
+        assert cachedDay(CHICAGO, 60, SUNDAY, 'Mon') == blocked('0915', '1045') # each would overlap it
+        assert cachedDay(CHICAGO, 30, SUNDAY, 'Mon') == blocked('0945', '1045')
+        assert cachedDay(LONDON, 60, SUNDAY, 'Mon') == blocked('1515', '1645')
+        assert cachedDay(CHICAGO, 60, SUNDAY, 'Tue') == list(grid.labels)
+        assert cachedDay(CHICAGO, 60, SUNDAY + timedelta(weeks=1), 'Mon') == list(grid.labels)
+        week, byArtist = cache.get(weekcache.staleKey(weekcache.cacheKey(CHICAGO, 60, SUNDAY)))
+        assert byArtist[None]['Mon'] == blocked('0915', '1045') # never served stale with the slot in it
+
+
+def test_invalidate_drops_only_the_weeks_a_span_touches(app):
+    compute = Computer()
+    with app.app_context():
+        weekcache.putWeeks(CHICAGO, 60, SUNDAY.date(), compute(SUNDAY, 3))
+        before = weekcache.generation()
+        keys = [weekcache.cacheKey(CHICAGO, 60, SUNDAY + timedelta(weeks=i)) for i in range(3)]
+
+        weekcache.invalidate([('2030-01-13T09:00:00-06:00', '2030-01-13T10:00:00-06:00')]) # the second week's Sunday
+
+        assert weekcache.generation() != before
+        assert [cache.get(key) is not None for key in keys] == [True, False, True]
+        assert cache.get(weekcache.staleKey(keys[1])) is None
+        assert cache.get(weekcache.staleKey(keys[0])) is not None
+
+
+def expired(tzName, duration, sunday, weeks):
+    """
+    Drop the fresh copies of cached weeks, as their timeout would, leaving the stale ones
+    """
+    cache.delete_many(*(weekcache.cacheKey(tzName, duration, sunday + timedelta(weeks=i)) for i in range(weeks)))
+    return
+
+
+def test_expired_weeks_are_served_stale_while_revalidated_in_the_background(app):
+    compute, revalidate = Computer(), Computer()
+    with app.app_context():
+        weeks = app.config['OPENINGS_PREFETCH_WEEKS']
+        weekcache.putWeeks(CHICAGO, 60, SUNDAY.date(), [(week, {None: {'Mon': ['1000']}})
+                                                       for week, byArtist in compute(SUNDAY, weeks)])
+        compute.calls.clear()
+        expired(CHICAGO, 60, SUNDAY, weeks)
+
+        week, openings = weekcache.getWeeks(CHICAGO, 60, [SUNDAY], compute, SUNDAY, revalidate)[0]
+        assert openings == {'Mon': ['1000']} # straight away, without waiting for the calendar
+        assert compute.calls == []
+
+        deadline = time.monotonic() + 5
+        while cache.get(weekcache.cacheKey(CHICAGO, 60, SUNDAY)) is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert revalidate.calls == [(SUNDAY, weeks)]
+        week, openings = weekcache.getWeeks(CHICAGO, 60, [SUNDAY], compute, SUNDAY, revalidate)[0]
+        assert openings['Tue'] == list(slotgrid.currentGrid().labels)
+        assert compute.calls == []
+
+
+def test_stale_weeks_stand_in_only_when_computing_fails(app):
+    def failing(sunday, count):
+        raise ConnectionError("calendar unreachable")
+
+    with app.app_context():
+        weekcache.putWeeks(CHICAGO, 60, SUNDAY.date(), Computer()(SUNDAY, 1))
+        expired(CHICAGO, 60, SUNDAY, 1)
+        week, openings = weekcache.getWeeks(CHICAGO, 60, [SUNDAY], failing, SUNDAY)[0]
+        assert week == engine.weekInfo(SUNDAY)
+
+        with pytest.raises(ConnectionError): # nothing to stand in for a week never cached
+            weekcache.getWeeks(CHICAGO, 60, [SUNDAY + timedelta(weeks=1)], failing, SUNDAY)